@@ -0,0 +1,115 @@
+"""
+Async database module for running Database calls off the event loop.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import Database, DEFAULT_PRAGMAS
+
+# Database methods that never write and can run on a read connection
+READ_METHODS = frozenset({
+    'get_active_personas',
+    'get_user_max_sentences',
+    'get_user_preferences',
+    'get_message_history',
+    'get_channel_summary',
+    'get_messages_to_summarize',
+    'get_expired_message_ids',
+    'get_channels_over_row_limit',
+    'get_guilds_over_byte_limit',
+    'get_oldest_messages',
+    'search_messages',
+    'get_user_warnings',
+    'get_due_reminders',
+    'get_cached_response',
+    'get_image_cache_entry',
+    'get_image_cache_size',
+    'get_least_recent_image_cache_entries',
+    'image_content_in_use'
+})
+
+class AsyncDatabase:
+    """
+    Awaitable facade over Database.
+
+    Every Database method is available as a coroutine with the same arguments. Writes
+    run in submission order on a single writer thread that owns the writer connection,
+    and reads run on a small pool of threads that each open their own connection, so
+    the event loop never waits on SQLite.
+    """
+
+    def __init__(self, db_path, readers=2, pragmas=None, codec=None):
+        """
+        Initialize the database threads.
+
+        Args:
+            db_path: Path to the SQLite database file
+            readers: Number of reader threads and connections (0 runs reads on the writer)
+            pragmas: Connection settings passed to every Database (defaults to DEFAULT_PRAGMAS)
+            codec: ContentCodec shared by every Database (optional)
+        """
+        self.db_path = db_path
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.codec = codec
+
+        # The writer connection sets the journal mode and creates the tables before any reader opens
+        self.writer = Database(db_path, check_same_thread=False, pragmas=self.pragmas, codec=codec)
+
+        # The journal mode is stored in the file, readers only need the per-connection settings
+        self.reader_pragmas = {name: value for name, value in self.pragmas.items() if name != 'journal_mode'}
+
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.read_executor = None
+        if readers > 0:
+            self.read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+
+        # One read connection per reader thread
+        self.local = threading.local()
+        self.readers = []
+        self.readers_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        """Get an awaitable version of a Database method."""
+        method = getattr(Database, name, None)
+        if name.startswith('_') or not callable(method):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        if name in READ_METHODS and self.read_executor is not None:
+            executor, target = self.read_executor, functools.partial(self._read, name)
+        else:
+            executor, target = self.write_executor, getattr(self.writer, name)
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(target, *args, **kwargs))
+
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        return call
+
+    def _read(self, name, *args, **kwargs):
+        """Run a read method on this thread's read connection."""
+        reader = getattr(self.local, 'db', None)
+        if reader is None:
+            reader = Database(self.db_path, create_tables=False, check_same_thread=False,
+                              pragmas=self.reader_pragmas, codec=self.codec)
+            self.local.db = reader
+            with self.readers_lock:
+                self.readers.append(reader)
+
+        return getattr(reader, name)(*args, **kwargs)
+
+    def close(self):
+        """Finish queued work and close all connections."""
+        # Let pending writes land before the connections close
+        self.write_executor.shutdown(wait=True)
+        if self.read_executor is not None:
+            self.read_executor.shutdown(wait=True)
+
+        with self.readers_lock:
+            for reader in self.readers:
+                reader.close()
+            self.readers = []
+
+        self.writer.close()
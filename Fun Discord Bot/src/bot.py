@@ -9,12 +9,25 @@ import nltk
 import os
 from dotenv import load_dotenv
 from personas import personas, default_persona
-from database import Database
+from async_database import AsyncDatabase
+from sharding import ShardedDatabase
+from compression import ContentCodec
+from write_buffer import MessageWriteBuffer
+from preferences import UserPreferenceCache
+from retention import MessagePruner
 from permissions import PermissionLevel, check_permission
 from logger import BotLogger
 from rate_limiting import RateLimitType, rate_limiter, format_time_remaining
+from openai_client import OpenAIClientManager
+from scheduler import LLMScheduler, Priority
+from response_cache import ResponseCache
+from context_builder import ContextBuilder
+from summarizer import ConversationSummarizer
+from insult_pool import InsultPool
+from image_jobs import ImageJobQueue, ImageQueueFullError
 import datetime
 import asyncio
+import time
 
 # Download nltk data for sentence tokenization
 try:
@@ -37,11 +50,123 @@ load_dotenv()
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 DISCORD_APPLICATION_ID = os.getenv('DISCORD_APPLICATION_ID')
 BOT_NAME = os.getenv('BOT_NAME', 'General Brasch')
-MESSAGE_HISTORY_LIMIT = int(os.getenv('MESSAGE_HISTORY_LIMIT', 10))
+MESSAGE_HISTORY_LIMIT = int(os.getenv('MESSAGE_HISTORY_LIMIT', 50))  # Most history messages considered for context
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500))  # Prompt tokens for system prompt, history and prompt
 DEFAULT_MAX_SENTENCES = int(os.getenv('DEFAULT_MAX_SENTENCES', 5))  # Default max sentences in responses
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'  # Stream replies with progressive edits
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))  # Minimum seconds between reply edits
 
 # Configure OpenAI
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # Optional alternative endpoint, e.g. tools/fake_openai.py
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 20))  # Pooled HTTP connections to OpenAI
+OPENAI_MAX_KEEPALIVE = int(os.getenv('OPENAI_MAX_KEEPALIVE', 10))  # Idle connections kept open
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 60))  # Request timeout in seconds
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))  # Maximum OpenAI calls in flight
+LLM_MAX_WAIT = float(os.getenv('LLM_MAX_WAIT', 30))  # Seconds before a waiting lower priority call is served first
+SCHEDULER_METRICS_INTERVAL = int(os.getenv('SCHEDULER_METRICS_INTERVAL', 300))  # Seconds between metrics logs
+
+# Configure rolling conversation summaries
+SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', 'true').lower() == 'true'
+SUMMARY_IDLE_SECONDS = int(os.getenv('SUMMARY_IDLE_SECONDS', 120))  # Quiet time before a channel is summarized
+SUMMARY_BATCH_SIZE = int(os.getenv('SUMMARY_BATCH_SIZE', 50))  # Messages folded into a summary per refresh
+SUMMARY_CACHE_SIZE = int(os.getenv('SUMMARY_CACHE_SIZE', 10000))  # Channels whose summary stays in memory
+
+# Configure insult template pools
+INSULT_POOL_SIZE = int(os.getenv('INSULT_POOL_SIZE', 20))  # Templates kept per persona
+INSULT_POOL_LOW_WATER = int(os.getenv('INSULT_POOL_LOW_WATER', 5))  # Pool size that triggers a background refill
+INSULT_POOL_BATCH_SIZE = int(os.getenv('INSULT_POOL_BATCH_SIZE', 10))  # Templates generated per API call
+
+# Configure image generation jobs
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))  # Concurrent image generations
+IMAGE_QUEUE_SIZE = int(os.getenv('IMAGE_QUEUE_SIZE', 20))  # Jobs allowed to wait for a worker
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', 'data/image_cache')  # Where generated images are kept
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 524288000))  # Size cap of the image cache
+
+# Configure response cache (opt-in)
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 1048576))  # Size cap for cached responses
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 3600))  # Seconds a cached response stays valid
+RESPONSE_CACHE_HISTORY_WINDOW = int(os.getenv('RESPONSE_CACHE_HISTORY_WINDOW', 2))  # History messages in the key
+RESPONSE_CACHE_PERSIST = os.getenv('RESPONSE_CACHE_PERSIST', 'false').lower() == 'true'  # Keep entries in SQLite
+RESPONSE_CACHE_DB_MAX_ROWS = int(os.getenv('RESPONSE_CACHE_DB_MAX_ROWS', 10000))  # Row cap for persisted entries, 0 for none
+RESPONSE_CACHE_PRUNE_INTERVAL = int(os.getenv('RESPONSE_CACHE_PRUNE_INTERVAL', 600))  # Seconds between persisted cache prunes
+
+# Configure database
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'data/bot_data.db')  # SQLite database file
+DB_READERS = int(os.getenv('DB_READERS', 2))  # Reader threads, each with its own connection
+DB_SHARDS = int(os.getenv('DB_SHARDS', 0))  # Guild shard files, 0 keeps one file
+DB_SHARD_DIR = os.getenv('DB_SHARD_DIR', 'data/shards')  # Directory for the shard files
+MESSAGE_FLUSH_MAX_ROWS = int(os.getenv('MESSAGE_FLUSH_MAX_ROWS', 100))  # Buffered messages that force a write
+MESSAGE_FLUSH_MAX_DELAY_MS = int(os.getenv('MESSAGE_FLUSH_MAX_DELAY_MS', 500))  # Longest a message waits to be written
+MESSAGE_FLUSH_MAX_RETRIES = int(os.getenv('MESSAGE_FLUSH_MAX_RETRIES', 5))  # Failed flushes before failing rows are dropped
+DB_PRAGMAS = {
+    'journal_mode': os.getenv('DB_JOURNAL_MODE', 'WAL'),  # WAL lets reads run alongside writes
+    'synchronous': os.getenv('DB_SYNCHRONOUS', 'NORMAL'),  # NORMAL skips the fsync on each WAL commit
+    'cache_size': int(os.getenv('DB_CACHE_SIZE', -16000)),  # Page cache per connection, negative means KiB
+    'mmap_size': int(os.getenv('DB_MMAP_SIZE', 268435456)),  # Bytes of the file read through mmap
+    'temp_store': os.getenv('DB_TEMP_STORE', 'MEMORY'),  # Where temporary tables and indexes live
+    'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))  # Milliseconds to wait for a lock
+}
+DB_CHECKPOINT_INTERVAL = int(os.getenv('DB_CHECKPOINT_INTERVAL', 300))  # Seconds between WAL checkpoints
+PREFERENCE_CACHE_SIZE = int(os.getenv('PREFERENCE_CACHE_SIZE', 10000))  # Users whose preferences stay in memory
+MESSAGE_COMPRESSION = os.getenv('MESSAGE_COMPRESSION', 'zlib')  # zlib, zstd (needs zstandard) or none
+MESSAGE_COMPRESSION_THRESHOLD = int(os.getenv('MESSAGE_COMPRESSION_THRESHOLD', 512))  # Bytes before content is compressed
+MESSAGE_ZSTD_DICT = os.getenv('MESSAGE_ZSTD_DICT')  # Optional trained zstd dictionary file
+
+# Configure message retention (0 disables a limit, all are off unless set)
+RETENTION_MAX_AGE_DAYS = int(os.getenv('RETENTION_MAX_AGE_DAYS', 0))  # Delete messages older than this
+RETENTION_MAX_ROWS_PER_CHANNEL = int(os.getenv('RETENTION_MAX_ROWS_PER_CHANNEL', 0))  # Messages kept per channel
+RETENTION_MAX_BYTES_PER_GUILD = int(os.getenv('RETENTION_MAX_BYTES_PER_GUILD', 0))  # Message text kept per guild
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 3600))  # Seconds between pruning passes
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 500))  # Rows deleted per transaction
+SEARCH_RESULTS_PER_PAGE = int(os.getenv('SEARCH_RESULTS_PER_PAGE', 5))  # Messages shown per /search page
+
+# Configure rate limiter state
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))  # Users and servers tracked per limit type
+RATE_LIMIT_SWEEP_INTERVAL = int(os.getenv('RATE_LIMIT_SWEEP_INTERVAL', 300))  # Seconds between idle key sweeps
+
+# Configure bot-wide and per-command rate limits as "<requests>/<seconds>", "off" removes a limit
+GLOBAL_MESSAGE_RATE_LIMIT = os.getenv('GLOBAL_MESSAGE_RATE_LIMIT', '600/60')  # Chat replies across all servers
+GLOBAL_IMAGE_RATE_LIMIT = os.getenv('GLOBAL_IMAGE_RATE_LIMIT', '50/600')  # Image units across all servers
+COMMAND_RATE_LIMITS = os.getenv('COMMAND_RATE_LIMITS', '')  # e.g. "generate_image:global=5/60,insult:server=off"
+
+# Configure spend budgets, chat is charged in prompt and completion tokens and images in IMAGE_COST units
+USER_TOKEN_BUDGET = os.getenv('USER_TOKEN_BUDGET', '20000/3600')  # Chat tokens per user, can't be "off"
+GUILD_TOKEN_BUDGET = os.getenv('GUILD_TOKEN_BUDGET', '200000/3600')  # Chat tokens per server
+IMAGE_COST = int(os.getenv('IMAGE_COST', 1))  # Units charged per generated image
+USER_IMAGE_BUDGET = os.getenv('USER_IMAGE_BUDGET', '3/300')  # Image units per user, can't be "off"
+GUILD_IMAGE_BUDGET = os.getenv('GUILD_IMAGE_BUDGET', '10/600')  # Image units per server
+
+# Cap the users and servers the rate limiter remembers
+rate_limiter.max_keys = RATE_LIMIT_MAX_KEYS
+
+def parse_rate_limit(value):
+    """Parse a "<requests>/<seconds>" rate limit, "off" gives (None, None)."""
+    if value.strip().lower() == 'off':
+        return None, None
+    max_requests, window_seconds = value.split('/')
+    return int(max_requests), int(window_seconds)
+
+def parse_user_budget(name, value):
+    """Parse a per-user budget, rejecting "off" because every limit type needs a user limit."""
+    max_requests, window_seconds = parse_rate_limit(value)
+    if max_requests is None:
+        raise ValueError(f'{name} can\'t be "off", per-user budgets always apply. Set a high limit instead, '
+                         f'e.g. {name}=1000000/3600')
+    return max_requests, window_seconds
+
+# The OpenAI key is shared by every server, so cap total usage as well
+rate_limiter.update_rate_limit(RateLimitType.MESSAGE, *parse_rate_limit(GLOBAL_MESSAGE_RATE_LIMIT), scope='global')
+rate_limiter.update_rate_limit(RateLimitType.IMAGE, *parse_rate_limit(GLOBAL_IMAGE_RATE_LIMIT), scope='global')
+rate_limiter.update_rate_limit(RateLimitType.TOKENS, *parse_user_budget('USER_TOKEN_BUDGET', USER_TOKEN_BUDGET))
+rate_limiter.update_rate_limit(RateLimitType.TOKENS, *parse_rate_limit(GUILD_TOKEN_BUDGET), scope='server')
+rate_limiter.update_rate_limit(RateLimitType.IMAGE, *parse_user_budget('USER_IMAGE_BUDGET', USER_IMAGE_BUDGET))
+rate_limiter.update_rate_limit(RateLimitType.IMAGE, *parse_rate_limit(GUILD_IMAGE_BUDGET), scope='server')
+for entry in filter(None, COMMAND_RATE_LIMITS.split(',')):
+    target, limit = entry.split('=')
+    command_name, scope = target.strip().split(':')
+    rate_limiter.update_rate_limit(None, *parse_rate_limit(limit), scope=scope, command=command_name)
 
 # Set up Discord bot with intents
 intents = discord.Intents.default()
@@ -49,29 +174,234 @@ intents.message_content = True  # Enable message content intent
 intents.members = True  # Enable members intent
 bot = commands.Bot(command_prefix=commands.when_mentioned, intents=intents)
 
-# Initialize database
-db = Database("data/bot_data.db")
+# Compression for long message content
+zstd_dictionary = None
+if MESSAGE_ZSTD_DICT:
+    with open(MESSAGE_ZSTD_DICT, 'rb') as f:
+        zstd_dictionary = f.read()
+message_codec = ContentCodec(MESSAGE_COMPRESSION, threshold=MESSAGE_COMPRESSION_THRESHOLD, dictionary=zstd_dictionary)
+
+# Initialize database, all calls run on background threads
+if DB_SHARDS > 0:
+    # Guild rows are spread over shard files, DATABASE_PATH keeps the caches
+    db = ShardedDatabase(
+        DATABASE_PATH, DB_SHARD_DIR,
+        shards=DB_SHARDS,
+        readers=DB_READERS, pragmas=DB_PRAGMAS, codec=message_codec
+    )
+else:
+    db = AsyncDatabase(DATABASE_PATH, readers=DB_READERS, pragmas=DB_PRAGMAS, codec=message_codec)
 
 # Initialize logger
 logger = BotLogger(log_dir="logs")
 
+# Per-user preferences, read through an in-memory cache
+user_preferences = UserPreferenceCache(db, max_entries=PREFERENCE_CACHE_SIZE)
+
+# Enforces the message retention limits in the background
+message_pruner = MessagePruner(
+    db, logger,
+    max_age_days=RETENTION_MAX_AGE_DAYS,
+    max_rows_per_channel=RETENTION_MAX_ROWS_PER_CHANNEL,
+    max_bytes_per_guild=RETENTION_MAX_BYTES_PER_GUILD,
+    batch_size=RETENTION_BATCH_SIZE,
+    interval=RETENTION_INTERVAL
+)
+
+# Chat messages are written in batches
+message_buffer = MessageWriteBuffer(
+    db, logger,
+    max_rows=MESSAGE_FLUSH_MAX_ROWS,
+    max_delay_ms=MESSAGE_FLUSH_MAX_DELAY_MS,
+    max_retries=MESSAGE_FLUSH_MAX_RETRIES
+)
+
+# Shared async OpenAI client, created once the event loop is running
+openai_manager = OpenAIClientManager(
+    OPENAI_API_KEY,
+    max_connections=OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+    timeout=OPENAI_TIMEOUT,
+    base_url=OPENAI_BASE_URL
+)
+
+# Fits chat history into the prompt token budget
+context_builder = ContextBuilder(token_budget=CONTEXT_TOKEN_BUDGET)
+
+# Global scheduler every OpenAI call goes through
+llm_scheduler = LLMScheduler(max_concurrency=LLM_MAX_CONCURRENCY, max_wait=LLM_MAX_WAIT)
+
+# Rolling summaries of messages that left the history window, None when disabled
+summarizer = None
+if SUMMARY_ENABLED:
+    summarizer = ConversationSummarizer(
+        db, openai_manager, llm_scheduler, logger,
+        keep_recent=MESSAGE_HISTORY_LIMIT,
+        idle_seconds=SUMMARY_IDLE_SECONDS,
+        batch_size=SUMMARY_BATCH_SIZE,
+        max_channels=SUMMARY_CACHE_SIZE
+    )
+
+# Pre-generated insult templates per persona
+insult_pool = InsultPool(
+    openai_manager, llm_scheduler, logger, personas, default_persona,
+    pool_size=INSULT_POOL_SIZE,
+    low_water=INSULT_POOL_LOW_WATER,
+    batch_size=INSULT_POOL_BATCH_SIZE
+)
+
+# Queued image generation with an on-disk result cache
+image_jobs = ImageJobQueue(
+    db, openai_manager, llm_scheduler, logger,
+    cache_dir=IMAGE_CACHE_DIR,
+    max_cache_bytes=IMAGE_CACHE_MAX_BYTES,
+    workers=IMAGE_WORKERS,
+    max_queue=IMAGE_QUEUE_SIZE
+)
+
+# Cache for repeated prompts, None when disabled
+response_cache = None
+if RESPONSE_CACHE_ENABLED:
+    response_cache = ResponseCache(
+        max_bytes=RESPONSE_CACHE_MAX_BYTES,
+        ttl_seconds=RESPONSE_CACHE_TTL,
+        history_window=RESPONSE_CACHE_HISTORY_WINDOW,
+        db=db if RESPONSE_CACHE_PERSIST else None
+    )
+
 # Dictionary to cache server data to reduce database queries
 server_cache = {}
 
-def get_server_data(guild_id):
+async def get_server_data(guild_id):
     """Get or initialize server-specific data."""
     # Check cache first
     if guild_id in server_cache:
         return server_cache[guild_id]
     
     # Get from database
-    server_data = db.get_server_data(guild_id, default_persona)
+    server_data = await db.get_server_data(guild_id, default_persona)
     
     # Cache for future use
     server_cache[guild_id] = server_data
     
     return server_data
 
+@bot.event
+async def setup_hook():
+    """Create shared resources once the event loop is running."""
+    openai_manager.start()
+    logger.info(f"OpenAI client ready (max connections: {OPENAI_MAX_CONNECTIONS}, "
+                f"endpoint: {OPENAI_BASE_URL or 'default'})")
+    
+    if message_codec.method != MESSAGE_COMPRESSION:
+        logger.warning(f"zstandard is not installed, compressing messages with {message_codec.method} instead")
+    
+    if context_builder.encoding is None:
+        logger.warning("tiktoken is not installed, token budgets use an estimate of four characters per token")
+    
+    # Start the image generation workers
+    image_jobs.start()
+    
+    # Write buffered chat messages in the background
+    message_buffer.start()
+    
+    # Delete messages beyond the retention limits
+    bot.loop.create_task(message_pruner.run())
+    
+    # Keep the write-ahead log from growing between automatic checkpoints
+    if DB_PRAGMAS['journal_mode'].upper() == 'WAL':
+        bot.loop.create_task(checkpoint_database())
+    
+    # Drop expired and excess persisted cache entries, starting with those that expired while offline
+    if response_cache is not None and RESPONSE_CACHE_PERSIST:
+        await prune_response_cache_db()
+        bot.loop.create_task(prune_response_cache())
+    
+    # Fill the insult pools so the first /insult per persona doesn't wait on OpenAI
+    await warm_insult_pools()
+    
+    # Periodically report scheduler queue depth and wait times
+    bot.loop.create_task(log_scheduler_metrics())
+    
+    # Forget rate limit state for users and servers that have gone quiet
+    bot.loop.create_task(sweep_rate_limits())
+    
+    # Summarize idle channels in the background
+    if summarizer is not None:
+        bot.loop.create_task(summarizer.run())
+
+async def warm_insult_pools():
+    """Start background refills for the default persona and every persona a server uses."""
+    try:
+        active_personas = await db.get_active_personas()
+    except Exception as e:
+        logger.error(f"Error loading active personas: {e}", exc_info=True)
+        active_personas = []
+    
+    for persona_key in {default_persona, *active_personas}:
+        if persona_key in personas:
+            insult_pool.schedule_refill(persona_key)
+
+async def log_scheduler_metrics():
+    """Background task to log LLM scheduler metrics."""
+    try:
+        while True:
+            await asyncio.sleep(SCHEDULER_METRICS_INTERVAL)
+            metrics = llm_scheduler.get_metrics()
+            if metrics['total_started']:
+                logger.info(f"LLM scheduler metrics: {metrics}")
+            if response_cache is not None:
+                logger.info(f"Response cache stats: {response_cache.get_stats()}")
+            logger.info(f"Message write buffer stats: {message_buffer.get_stats()}")
+            logger.info(f"Rate limiter stats: {rate_limiter.get_stats()}")
+    except asyncio.CancelledError:
+        pass
+
+async def sweep_rate_limits():
+    """Background task to drop rate limiter keys whose limits have fully reset."""
+    try:
+        while True:
+            await asyncio.sleep(RATE_LIMIT_SWEEP_INTERVAL)
+            removed = rate_limiter.sweep()
+            if removed:
+                logger.debug(f"Rate limiter sweep removed {removed} idle keys")
+    except asyncio.CancelledError:
+        pass
+
+async def prune_response_cache_db():
+    """Delete expired persisted response cache entries and trim the table to its row cap."""
+    try:
+        expired = await db.delete_expired_cached_responses(time.time())
+        trimmed = 0
+        if RESPONSE_CACHE_DB_MAX_ROWS > 0:
+            trimmed = await db.trim_cached_responses(RESPONSE_CACHE_DB_MAX_ROWS)
+        if expired or trimmed:
+            logger.debug(f"Response cache prune removed {expired} expired and {trimmed} excess entries")
+    except Exception as e:
+        logger.error(f"Error pruning response cache: {e}", exc_info=True)
+
+async def prune_response_cache():
+    """Background task to keep the persisted response cache bounded."""
+    try:
+        while True:
+            await asyncio.sleep(RESPONSE_CACHE_PRUNE_INTERVAL)
+            await prune_response_cache_db()
+    except asyncio.CancelledError:
+        pass
+
+async def checkpoint_database():
+    """Background task to checkpoint the write-ahead log."""
+    try:
+        while True:
+            await asyncio.sleep(DB_CHECKPOINT_INTERVAL)
+            try:
+                result = await db.checkpoint()
+                logger.debug(f"WAL checkpoint: {result}")
+            except Exception as e:
+                logger.error(f"Error checkpointing database: {e}", exc_info=True)
+    except asyncio.CancelledError:
+        pass
+
 @bot.event
 async def on_ready():
     """Event triggered when the bot is ready and connected to Discord."""
@@ -111,9 +441,10 @@ async def change_persona(interaction: discord.Interaction, persona_choice: str):
                           success=False, error="Insufficient permissions")
         return
     
-    # Check rate limits
-    is_limited, wait_time, limit_info = rate_limiter.is_rate_limited(
-        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id
+    # Check and record rate limits in one step
+    is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id, interaction.channel_id,
+        command="persona"
     )
     
     if is_limited:
@@ -125,11 +456,8 @@ async def change_persona(interaction: discord.Interaction, persona_choice: str):
                              "Command rate limit exceeded", wait_time)
         return
     
-    # Record the request for rate limiting
-    rate_limiter.add_request(RateLimitType.COMMAND, interaction.user.id, interaction.guild_id)
-    
     # Get server data
-    server = get_server_data(interaction.guild_id)
+    server = await get_server_data(interaction.guild_id)
     
     # Update server's persona
     if persona_choice in personas:
@@ -137,7 +465,10 @@ async def change_persona(interaction: discord.Interaction, persona_choice: str):
         server['persona'] = persona_choice
         
         # Update in database
-        db.update_server_persona(interaction.guild_id, persona_choice)
+        await db.update_server_persona(interaction.guild_id, persona_choice)
+        
+        # Have insults ready in the new persona's voice
+        insult_pool.schedule_refill(persona_choice)
         
         # Change bot's nickname in the server
         try:
@@ -182,9 +513,10 @@ async def generate_image(interaction: discord.Interaction, prompt: str):
                           success=False, error="Insufficient permissions")
         return
     
-    # Check rate limits
-    is_limited, wait_time, limit_info = rate_limiter.is_rate_limited(
-        RateLimitType.IMAGE, interaction.user.id, interaction.guild_id
+    # Check and record rate limits in one step
+    is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+        RateLimitType.IMAGE, interaction.user.id, interaction.guild_id, interaction.channel_id,
+        command="generate_image", cost=IMAGE_COST
     )
     
     if is_limited:
@@ -200,38 +532,38 @@ async def generate_image(interaction: discord.Interaction, prompt: str):
     await interaction.response.defer(thinking=True)
     
     try:
-        # Initialize OpenAI client
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        
-        # Log API call
-        logger.log_api_call("OpenAI Image Generation", {"prompt": prompt})
-        
-        # Generate image
-        response = client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
-        
-        # Record the request for rate limiting
-        rate_limiter.add_request(RateLimitType.IMAGE, interaction.user.id, interaction.guild_id)
-        
-        # Get image URL
-        image_url = response.data[0].url
-        
-        # Create embed with the image
-        embed = discord.Embed(title="Generated Image", description=f"Prompt: {prompt}")
-        embed.set_image(url=image_url)
-        embed.set_footer(text=f"Generated by {interaction.user.display_name}")
-        
-        # Send the image
-        await interaction.followup.send(embed=embed)
+        # Queue the job, identical prompts share a job or come straight from the cache.
+        # The file is kept out of cache eviction until it has been sent.
+        async with image_jobs.image(prompt, interaction.guild_id, Priority.HIGH) as (image_path, cached, joined):
+            # Only new generations count towards the rate limit, cache hits and joined jobs are free
+            if cached or joined:
+                rate_limiter.refund(RateLimitType.IMAGE, interaction.user.id, interaction.guild_id, interaction.channel_id,
+                                    command="generate_image", cost=IMAGE_COST)
+            
+            # Attach the cached file so the embed never expires
+            image_file = discord.File(image_path, filename="image.png")
+            
+            # Create embed with the image
+            embed = discord.Embed(title="Generated Image", description=f"Prompt: {prompt}")
+            embed.set_image(url="attachment://image.png")
+            embed.set_footer(text=f"Generated by {interaction.user.display_name}")
+            
+            # Send the image
+            await interaction.followup.send(embed=embed, file=image_file)
+            logger.log_command("generate_image", interaction.user.id, interaction.guild_id, interaction.channel_id, 
+                              success=True)
+            source = 'served from cache' if cached else 'shared with a job in flight' if joined else 'generated'
+            logger.info(f"Image {source} in guild {interaction.guild_id} "
+                        f"by user {interaction.user.id}")
+    except ImageQueueFullError:
+        rate_limiter.refund(RateLimitType.IMAGE, interaction.user.id, interaction.guild_id, interaction.channel_id,
+                            command="generate_image", cost=IMAGE_COST)
         logger.log_command("generate_image", interaction.user.id, interaction.guild_id, interaction.channel_id, 
-                          success=True)
-        logger.info(f"Image generated in guild {interaction.guild_id} by user {interaction.user.id}")
+                          success=False, error="Image queue full")
+        await interaction.followup.send("Too many images are being generated right now. Please try again in a minute.")
     except Exception as e:
+        rate_limiter.refund(RateLimitType.IMAGE, interaction.user.id, interaction.guild_id, interaction.channel_id,
+                            command="generate_image", cost=IMAGE_COST)
         error_msg = f"Error generating image: {str(e)}"
         logger.error(error_msg, exc_info=True)
         logger.log_command("generate_image", interaction.user.id, interaction.guild_id, interaction.channel_id, 
@@ -258,9 +590,10 @@ async def set_response_length(interaction: discord.Interaction, sentences: int):
                           success=False, error="Invalid sentence count")
         return
     
-    # Check rate limits
-    is_limited, wait_time, limit_info = rate_limiter.is_rate_limited(
-        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id
+    # Check and record rate limits in one step
+    is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id, interaction.channel_id,
+        command="set_response_length"
     )
     
     if is_limited:
@@ -272,11 +605,8 @@ async def set_response_length(interaction: discord.Interaction, sentences: int):
                              "Command rate limit exceeded", wait_time)
         return
     
-    # Record the request for rate limiting
-    rate_limiter.add_request(RateLimitType.COMMAND, interaction.user.id, interaction.guild_id)
-    
     # Update user's preference in database
-    success = db.update_user_max_sentences(interaction.guild_id, interaction.user.id, sentences)
+    success = await user_preferences.set(interaction.guild_id, interaction.user.id, 'max_sentences', sentences)
     
     if success:
         # Prepare response message
@@ -327,9 +657,10 @@ async def purge_messages(interaction: discord.Interaction, amount: int):
                           success=False, error="Invalid amount")
         return
     
-    # Check rate limits
-    is_limited, wait_time, limit_info = rate_limiter.is_rate_limited(
-        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id
+    # Check and record rate limits in one step
+    is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id, interaction.channel_id,
+        command="purge"
     )
     
     if is_limited:
@@ -341,9 +672,6 @@ async def purge_messages(interaction: discord.Interaction, amount: int):
                              "Command rate limit exceeded", wait_time)
         return
     
-    # Record the request for rate limiting
-    rate_limiter.add_request(RateLimitType.COMMAND, interaction.user.id, interaction.guild_id)
-    
     # Defer response since deletion might take time
     await interaction.response.defer(ephemeral=True)
     
@@ -394,9 +722,10 @@ async def warn_user(interaction: discord.Interaction, user: discord.Member, reas
                           success=False, error="Insufficient permissions")
         return
     
-    # Check rate limits
-    is_limited, wait_time, limit_info = rate_limiter.is_rate_limited(
-        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id
+    # Check and record rate limits in one step
+    is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id, interaction.channel_id,
+        command="warn"
     )
     
     if is_limited:
@@ -408,15 +737,12 @@ async def warn_user(interaction: discord.Interaction, user: discord.Member, reas
                              "Command rate limit exceeded", wait_time)
         return
     
-    # Record the request for rate limiting
-    rate_limiter.add_request(RateLimitType.COMMAND, interaction.user.id, interaction.guild_id)
-    
     try:
         # Add warning to database
-        warning_id = db.add_warning(interaction.guild_id, user.id, interaction.user.id, reason)
+        warning_id = await db.add_warning(interaction.guild_id, user.id, interaction.user.id, reason)
         
         # Get all warnings for this user
-        warnings = db.get_user_warnings(interaction.guild_id, user.id)
+        warnings = await db.get_user_warnings(interaction.guild_id, user.id)
         warning_count = len(warnings)
         
         # Create embed for the warning
@@ -458,6 +784,125 @@ async def warn_user(interaction: discord.Interaction, user: discord.Member, reas
         logger.log_command("warn", interaction.user.id, interaction.guild_id, interaction.channel_id, 
                           success=False, error=str(e))
 
+def search_terms(query):
+    """Split a search query into the words the full-text index matches on."""
+    return re.findall(r'\w+', query.lower())[:10]
+
+def search_results_embed(query, results, page):
+    """Build the embed for one page of /search results."""
+    embed = discord.Embed(
+        title=f"Search: {query}"[:256],
+        color=discord.Color.blue()
+    )
+    
+    if not results:
+        embed.description = "No matching messages found." if page == 1 else "No more results."
+        return embed
+    
+    for result in results:
+        author = result['name'] or (BOT_NAME if result['role'] == 'assistant' else "Unknown")
+        snippet = result['content'] if len(result['content']) <= 300 else result['content'][:297] + "..."
+        embed.add_field(
+            name=f"{author} in #{bot.get_channel(result['channel_id']) or result['channel_id']}"[:256],
+            value=f"<t:{result['timestamp'] // 1000}:R> {snippet}",
+            inline=False
+        )
+    embed.set_footer(text=f"Page {page}")
+    return embed
+
+class SearchResultsView(discord.ui.View):
+    """Next page button for /search results, paging with the last result's (score, id)."""
+    
+    def __init__(self, user_id, guild_id, query, channel_id, results, page):
+        super().__init__(timeout=300)
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.query = query
+        self.channel_id = channel_id
+        self.page = page
+        self.after = (results[-1]['score'], results[-1]['id']) if results else None
+        
+        # A short page means there is nothing after it
+        if len(results) < SEARCH_RESULTS_PER_PAGE:
+            self.next_page.disabled = True
+    
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Show the next page of results."""
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message("Only the person who searched can page through results.", ephemeral=True)
+            return
+        
+        results = await db.search_messages(
+            self.guild_id, search_terms(self.query), SEARCH_RESULTS_PER_PAGE,
+            channel_id=self.channel_id, after=self.after
+        )
+        view = SearchResultsView(self.user_id, self.guild_id, self.query, self.channel_id, results, self.page + 1)
+        await interaction.response.edit_message(
+            embed=search_results_embed(self.query, results, self.page + 1), view=view
+        )
+
+@bot.tree.command(name="search", description="Search stored chat history (Moderators and Admins only)")
+@app_commands.describe(query="Words to search for", channel="Only search this channel")
+async def search_history(interaction: discord.Interaction, query: str, channel: discord.TextChannel = None):
+    """Slash command to full-text search the server's stored chat history (restricted to moderators and admins)."""
+    if interaction.guild_id is None:
+        await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+        logger.log_command("search", interaction.user.id, interaction.guild_id, interaction.channel_id, 
+                          success=False, error="Command used in DM")
+        return
+    
+    # Check if user has permission to use this command
+    if not check_permission(interaction, PermissionLevel.MODERATOR):
+        await interaction.response.send_message(
+            "You don't have permission to search chat history. This command is restricted to moderators and admins.",
+            ephemeral=True
+        )
+        logger.log_command("search", interaction.user.id, interaction.guild_id, interaction.channel_id, 
+                          success=False, error="Insufficient permissions")
+        return
+    
+    # Check and record rate limits in one step
+    is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id, interaction.channel_id,
+        command="search"
+    )
+    
+    if is_limited:
+        await interaction.response.send_message(
+            f"You're using commands too quickly. Please wait {format_time_remaining(wait_time)} before trying again.",
+            ephemeral=True
+        )
+        logger.log_rate_limit(interaction.user.id, interaction.guild_id, "search", 
+                             "Command rate limit exceeded", wait_time)
+        return
+    
+    if not search_terms(query):
+        await interaction.response.send_message("Please include at least one word to search for.", ephemeral=True)
+        logger.log_command("search", interaction.user.id, interaction.guild_id, interaction.channel_id, 
+                          success=False, error="Empty query")
+        return
+    
+    try:
+        channel_id = channel.id if channel else None
+        results = await db.search_messages(
+            interaction.guild_id, search_terms(query), SEARCH_RESULTS_PER_PAGE, channel_id=channel_id
+        )
+        view = SearchResultsView(interaction.user.id, interaction.guild_id, query, channel_id, results, 1)
+        await interaction.response.send_message(
+            embed=search_results_embed(query, results, 1), view=view, ephemeral=True
+        )
+        
+        logger.log_command("search", interaction.user.id, interaction.guild_id, interaction.channel_id, 
+                          success=True)
+    except Exception as e:
+        await interaction.response.send_message(
+            f"An error occurred while searching: {str(e)}",
+            ephemeral=True
+        )
+        logger.log_command("search", interaction.user.id, interaction.guild_id, interaction.channel_id, 
+                          success=False, error=str(e))
+
 @bot.tree.command(name="remindme", description="Set a reminder for yourself")
 @app_commands.describe(time="Time until reminder (e.g., 1h, 30m, 5h30m)", message="Message to remind you about")
 async def remind_me(interaction: discord.Interaction, time: str, message: str):
@@ -468,9 +913,10 @@ async def remind_me(interaction: discord.Interaction, time: str, message: str):
                           success=False, error="Command used in DM")
         return
     
-    # Check rate limits
-    is_limited, wait_time, limit_info = rate_limiter.is_rate_limited(
-        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id
+    # Check and record rate limits in one step
+    is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+        RateLimitType.COMMAND, interaction.user.id, interaction.guild_id, interaction.channel_id,
+        command="remindme"
     )
     
     if is_limited:
@@ -482,9 +928,6 @@ async def remind_me(interaction: discord.Interaction, time: str, message: str):
                              "Command rate limit exceeded", wait_time)
         return
     
-    # Record the request for rate limiting
-    rate_limiter.add_request(RateLimitType.COMMAND, interaction.user.id, interaction.guild_id)
-    
     # Parse the time string
     try:
         # Extract hours and minutes from the time string
@@ -512,15 +955,15 @@ async def remind_me(interaction: discord.Interaction, time: str, message: str):
             return
         
         # Calculate the reminder time
-        remind_time = datetime.datetime.now() + datetime.timedelta(hours=hours, minutes=minutes)
+        remind_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=hours, minutes=minutes)
         
-        # Add the reminder to the database
-        reminder_id = db.add_reminder(
+        # Add the reminder to the database, times are stored as epoch milliseconds
+        reminder_id = await db.add_reminder(
             interaction.user.id, 
             interaction.channel_id, 
             interaction.guild_id, 
             message, 
-            remind_time
+            int(remind_time.timestamp() * 1000)
         )
         
         # Format the time for display
@@ -559,8 +1002,8 @@ async def check_reminders():
     """Background task to check for due reminders."""
     try:
         while True:
-            current_time = datetime.datetime.now()
-            due_reminders = db.get_due_reminders(current_time)
+            current_time = int(time.time() * 1000)
+            due_reminders = await db.get_due_reminders(current_time)
             
             for reminder in due_reminders:
                 try:
@@ -577,7 +1020,11 @@ async def check_reminders():
                             description=reminder['message'],
                             color=discord.Color.blue()
                         )
-                        embed.set_footer(text=f"Reminder set on {reminder['created_time']}")
+                        # Discord shows the timestamp in each reader's own time zone
+                        embed.set_footer(text="Reminder set")
+                        embed.timestamp = datetime.datetime.fromtimestamp(
+                            reminder['created_time'] / 1000, tz=datetime.timezone.utc
+                        )
                         
                         # Send the reminder
                         await channel.send(f"<@{user_id}> Here's your reminder:", embed=embed)
@@ -585,7 +1032,7 @@ async def check_reminders():
                         logger.info(f"Reminder sent to user {user_id} in channel {channel.id}")
                     
                     # Delete the reminder from the database
-                    db.delete_reminder(reminder['id'])
+                    await db.delete_reminder(reminder['id'])
                     
                 except Exception as e:
                     logger.error(f"Error sending reminder: {e}", exc_info=True)
@@ -618,9 +1065,10 @@ async def insult_user(interaction: discord.Interaction, user: discord.Member = N
                           success=False, error="Insufficient permissions")
         return
     
-    # Check rate limits
-    is_limited, wait_time, limit_info = rate_limiter.is_rate_limited(
-        RateLimitType.INSULT, interaction.user.id, interaction.guild_id
+    # Check and record rate limits in one step
+    is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+        RateLimitType.INSULT, interaction.user.id, interaction.guild_id, interaction.channel_id,
+        command="insult"
     )
     
     if is_limited:
@@ -632,7 +1080,7 @@ async def insult_user(interaction: discord.Interaction, user: discord.Member = N
                              "Insult rate limit exceeded", wait_time)
         return
     
-    # Defer response since API call might take time
+    # Defer response in case the insult pool needs a refill
     await interaction.response.defer()
     
     try:
@@ -646,6 +1094,8 @@ async def insult_user(interaction: discord.Interaction, user: discord.Member = N
                     members.append(member)
             
             if not members:
+                rate_limiter.refund(RateLimitType.INSULT, interaction.user.id, interaction.guild_id,
+                                    interaction.channel_id, command="insult")
                 await interaction.followup.send("There are no users to insult in this channel.")
                 logger.log_command("insult", interaction.user.id, interaction.guild_id, interaction.channel_id, 
                                   success=False, error="No valid users in channel")
@@ -654,76 +1104,18 @@ async def insult_user(interaction: discord.Interaction, user: discord.Member = N
             # Select a random user
             user = random.choice(members)
         
-        # Generate an insult using OpenAI
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        
-        # Log API call
-        logger.log_api_call("OpenAI Chat Completion", {"purpose": "insult generation"})
-        
-        # Generate insult
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a bot that generates creative, humorous insults that are not too offensive. The insults should be funny but not cruel or contain profanity."},
-                {"role": "user", "content": f"Generate a creative, humorous insult for {user.display_name}."}
-            ],
-            max_tokens=100,
-            temperature=0.8
-        )
-        
-        # Record the request for rate limiting
-        rate_limiter.add_request(RateLimitType.INSULT, interaction.user.id, interaction.guild_id)
-        
-        # Extract the insult
-        insult = response.choices[0].message.content.strip()
-        
-        # Send the insult
-        await interaction.followup.send(f"{user.mention} {insult}")
-        logger.log_command("insult", interaction.user.id, interaction.guild_id, interaction.channel_id, 
-                          success=True)
-        logger.info(f"Insult generated for user {user.id} by {interaction.user.id} in guild {interaction.guild_id}")
-    except Exception as e:
-        await interaction.followup.send("I'm sorry, I encountered an error while generating an insult.")
-        logger.error(f"Error generating insult: {e}", exc_info=True)
-        logger.log_command("insult", interaction.user.id, interaction.guild_id, interaction.channel_id, 
-                          success=False, error=str(e))
-        
-        # Get the persona's system prompt
-        persona_info = personas.get(persona_key, personas[default_persona])
-        system_prompt = persona_info["system_prompt"]
-        
-        # Create a prompt for the insult
-        insult_prompt = f"Create a humorous, light-hearted insult directed at {target_member.display_name}. The insult should be playful, not genuinely mean or offensive. Keep it appropriate for a Discord server."
-        
-        # Log API call
-        logger.log_api_call("OpenAI Chat Completion", {
-            "persona": persona_key,
-            "target_user": target_member.display_name
-        })
-        
-        # Generate the insult
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": insult_prompt}
-            ],
-            max_tokens=150,
-            temperature=0.8
-        )
-        
-        # Record the request for rate limiting
-        rate_limiter.add_request(RateLimitType.INSULT, interaction.user.id, interaction.guild_id)
-        
-        # Extract the insult
-        insult = response.choices[0].message.content
+        # Fill a pre-generated template in the server persona's voice
+        server = await get_server_data(interaction.guild_id)
+        insult = await insult_pool.get_insult(server['persona'], user.display_name)
         
         # Send the insult, tagging the target user
-        await interaction.followup.send(f"<@{target_member.id}> {insult}")
+        await interaction.followup.send(f"{user.mention} {insult}")
         logger.log_command("insult", interaction.user.id, interaction.guild_id, interaction.channel_id, 
                           success=True)
-        logger.info(f"Insult generated for user {target_member.id} in guild {interaction.guild_id}")
+        logger.info(f"Insult sent to user {user.id} by {interaction.user.id} in guild {interaction.guild_id}")
     except Exception as e:
+        rate_limiter.refund(RateLimitType.INSULT, interaction.user.id, interaction.guild_id, interaction.channel_id,
+                            command="insult")
         error_msg = f"Error generating insult: {str(e)}"
         logger.error(error_msg, exc_info=True)
         logger.log_command("insult", interaction.user.id, interaction.guild_id, interaction.channel_id, 
@@ -748,9 +1140,9 @@ async def on_message(message):
         
         # If there's actual content after removing the mention
         if content:
-            # Check rate limits
-            is_limited, wait_time, limit_info = rate_limiter.is_rate_limited(
-                RateLimitType.MESSAGE, message.author.id, message.guild.id
+            # Check and record rate limits in one step, so concurrent mentions can't all pass
+            is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+                RateLimitType.MESSAGE, message.author.id, message.guild.id, message.channel.id
             )
             
             if is_limited:
@@ -761,34 +1153,88 @@ async def on_message(message):
                                      "Message rate limit exceeded", wait_time)
                 return
             
+            # Prompt tokens charged to the token budgets, given back if the reply fails
+            prompt_tokens = 0
             try:
                 # Get server data
-                server = get_server_data(message.guild.id)
+                server = await get_server_data(message.guild.id)
                 
                 # Get message history for context
                 message_history = await get_message_history(message.channel, message, MESSAGE_HISTORY_LIMIT, server)
                 
+                # Summary of older messages, placed in front of the history
+                summary = None
+                if summarizer is not None:
+                    summary = await summarizer.get_summary(message.guild.id, message.channel.id)
+                
+                # Keep the newest messages that fit in the token budget
+                message_history = context_builder.build(
+                    get_system_prompt(server['persona']) + (summary or ""), message_history, content
+                )
+                if summarizer is not None:
+                    # Messages the budget left out are the ones the summary has to cover
+                    summarizer.set_window(message.guild.id, message.channel.id, len(message_history))
+                if summary:
+                    message_history.insert(0, summary_message(summary))
+                
+                # Charge the prompt to the user's and server's token budgets before calling OpenAI
+                tokens = context_builder.count_prompt(get_system_prompt(server['persona']), message_history, content)
+                is_limited, wait_time, limit_info = rate_limiter.try_acquire(
+                    RateLimitType.TOKENS, message.author.id, message.guild.id, message.channel.id, cost=tokens
+                )
+                if is_limited:
+                    rate_limiter.refund(RateLimitType.MESSAGE, message.author.id, message.guild.id, message.channel.id)
+                    await message.reply(
+                        f"You've used up your conversation budget for now. Please wait {format_time_remaining(wait_time)} before trying again."
+                    )
+                    logger.log_rate_limit(message.author.id, message.guild.id, "message", 
+                                         "Token budget exceeded", wait_time)
+                    return
+                prompt_tokens = tokens
+                
                 # Log API call
                 logger.log_api_call("OpenAI Chat Completion", {
                     "persona": server['persona'],
                     "message_history_length": len(message_history)
                 })
                 
-                # Generate response with context
-                response = await generate_response(content, message_history, server['persona'], 
-                                                 user_id=message.author.id, guild_id=message.guild.id)
+                if STREAM_RESPONSES:
+                    # Stream the response straight into the reply
+                    response, cached, completion_tokens = await stream_response(
+                        message, content, message_history, server['persona'],
+                        user_id=message.author.id, guild_id=message.guild.id
+                    )
+                else:
+                    # Generate response with context
+                    response, cached, completion_tokens = await generate_response(
+                        content, message_history, server['persona'],
+                        user_id=message.author.id, guild_id=message.guild.id
+                    )
                 
-                # Record the request for rate limiting
-                rate_limiter.add_request(RateLimitType.MESSAGE, message.author.id, message.guild.id)
+                if cached:
+                    # Cached responses cost nothing, so the prompt charge is given back
+                    rate_limiter.refund(RateLimitType.TOKENS, message.author.id, message.guild.id, message.channel.id,
+                                        cost=prompt_tokens)
+                    prompt_tokens = 0
+                else:
+                    # Completion tokens are only known now, charge everything generated without a check
+                    rate_limiter.add_request(RateLimitType.TOKENS, message.author.id, message.guild.id, message.channel.id,
+                                             cost=completion_tokens)
                 
                 # Store the interaction in chat history
                 store_message(server, message.guild.id, message.channel.id, "user", message.author.display_name, content)
                 store_message(server, message.guild.id, message.channel.id, "assistant", bot.user.display_name, response)
                 
                 # Send the response
-                await message.reply(response)
+                if not STREAM_RESPONSES:
+                    await message.reply(response)
                 logger.info(f"Responded to message from {message.author.id} in guild {message.guild.id}")
             except Exception as e:
+                # Failed responses don't count towards the limits
+                rate_limiter.refund(RateLimitType.MESSAGE, message.author.id, message.guild.id, message.channel.id)
+                if prompt_tokens:
+                    rate_limiter.refund(RateLimitType.TOKENS, message.author.id, message.guild.id, message.channel.id,
+                                        cost=prompt_tokens)
                 error_msg = f"Error generating response: {str(e)}"
                 logger.error(error_msg, exc_info=True)
                 await message.reply("I'm sorry, I encountered an error while processing your request.")
@@ -809,8 +1255,12 @@ def sanitize_name(name):
 
 def store_message(server, guild_id, channel_id, role, name, content):
     """Store a message in the server's chat history and database."""
-    # Store in database
-    db.store_message(guild_id, channel_id, role, sanitize_name(name) if role == "user" else None, content)
+    # Count tokens once and keep the count with the message
+    token_count = context_builder.count_tokens(content)
+    
+    # Queue for the database, written in batches
+    message_buffer.add(guild_id, channel_id, role, sanitize_name(name) if role == "user" else None, content,
+                       token_count=token_count)
     
     # Initialize channel history in cache if it doesn't exist
     if 'chat_history' not in server:
@@ -823,12 +1273,17 @@ def store_message(server, guild_id, channel_id, role, name, content):
     server['chat_history'][channel_id].append({
         "role": role,
         "name": sanitize_name(name) if role == "user" else None,
-        "content": content
+        "content": content,
+        "token_count": token_count
     })
     
+    # Let the summarizer know this channel has new messages
+    if summarizer is not None:
+        summarizer.mark_activity(guild_id, channel_id)
+    
     # Limit cached history size
-    if len(server['chat_history'][channel_id]) > MESSAGE_HISTORY_LIMIT * 2:  # Store twice as many as we use
-        server['chat_history'][channel_id] = server['chat_history'][channel_id][-MESSAGE_HISTORY_LIMIT * 2:]
+    if len(server['chat_history'][channel_id]) > MESSAGE_HISTORY_LIMIT:
+        server['chat_history'][channel_id] = server['chat_history'][channel_id][-MESSAGE_HISTORY_LIMIT:]
 
 async def get_message_history(channel, current_message, limit, server):
     """Get the message history from the server's stored chat history or database."""
@@ -840,7 +1295,7 @@ async def get_message_history(channel, current_message, limit, server):
         return server['chat_history'][channel_id][-limit:]
     
     # Otherwise, fetch from database
-    db_messages = db.get_message_history(guild_id, channel_id, limit)
+    db_messages = await db.get_message_history(guild_id, channel_id, limit)
     
     # If we have history in the database, use it
     if db_messages:
@@ -851,99 +1306,259 @@ async def get_message_history(channel, current_message, limit, server):
         return db_messages
     
     # If no history in database, fetch from Discord and initialize history
-    messages = []
+    fetched = []
     try:
         async for msg in channel.history(limit=limit, before=current_message):
             # Determine the role based on whether the message is from the bot
             role = "assistant" if msg.author == bot.user else "user"
-            
-            message_data = {
-                "role": role,
-                "content": msg.content
-            }
-            
-            # Only include name for user messages, and ensure it's properly sanitized
-            if role == "user":
-                message_data["name"] = sanitize_name(msg.author.display_name)
-            
-            messages.append(message_data)
-            
-            # Store in database and server's chat history
-            store_message(server, guild_id, channel_id, role, msg.author.display_name, msg.content)
+            fetched.append((role, msg.author.display_name, msg.content))
     except Exception as e:
         logger.error(f"Error getting message history: {e}", exc_info=True)
     
-    # Reverse the messages to get them in chronological order
-    messages.reverse()
+    # Discord returns newest first, store in chronological order
+    for role, name, content in reversed(fetched):
+        store_message(server, guild_id, channel_id, role, name, content)
+    
+    return list(server.get('chat_history', {}).get(channel_id, []))
+
+def summary_message(summary):
+    """Build the system message carrying a channel's rolling summary."""
+    return {
+        "role": "system",
+        "content": f"Summary of the earlier conversation in this channel: {summary}"
+    }
+
+def get_system_prompt(persona_key):
+    """Get the system prompt for a persona, falling back to the default persona."""
+    persona_info = personas.get(persona_key, personas[default_persona])
+    return persona_info["system_prompt"]
+
+def build_chat_messages(prompt, message_history, persona_key):
+    """Build the list of chat messages sent to OpenAI for a prompt."""
+    # Get the persona's system prompt
+    system_prompt = get_system_prompt(persona_key)
+    
+    # Prepare messages for the API call
+    messages = [
+        {"role": "system", "content": system_prompt}
+    ]
+    
+    # Add message history for context
+    if message_history:
+        messages.extend(message_history)
+    
+    # Add the current prompt with sanitized name
+    messages.append({
+        "role": "user", 
+        "name": sanitize_name(f"user_{len(messages)}"),
+        "content": prompt
+    })
+    
     return messages
 
-async def generate_response(prompt, message_history, persona_key, user_id=None, guild_id=None):
-    """Generate a response using OpenAI's API with message history context."""
+def limit_sentences(text, max_sentences, user_id=None):
+    """Trim text to at most max_sentences sentences (0 means unlimited)."""
+    if max_sentences <= 0:
+        return text
+    
     try:
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        
-        # Get the persona's system prompt
-        persona_info = personas.get(persona_key, personas[default_persona])
-        system_prompt = persona_info["system_prompt"]
+        # Use NLTK to split into sentences
+        sentences = nltk.sent_tokenize(text)
         
-        # Prepare messages for the API call
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
+        # Limit to max_sentences
+        if len(sentences) > max_sentences:
+            logger.debug(f"Limited response from {len(sentences)} to {max_sentences} sentences for user {user_id}")
+            return ' '.join(sentences[:max_sentences])
+    except Exception as e:
+        # If sentence tokenization fails, log the error but return the full response
+        logger.error(f"Error limiting sentences: {e}", exc_info=True)
+    
+    return text
+
+async def apply_user_sentence_limit(text, user_id, guild_id):
+    """Apply a user's max sentences preference if user_id and guild_id are provided."""
+    if user_id and guild_id:
+        max_sentences = await user_preferences.get(guild_id, user_id, 'max_sentences', DEFAULT_MAX_SENTENCES)
+        return limit_sentences(text, max_sentences, user_id)
+    return text
+
+async def generate_response(prompt, message_history, persona_key, user_id=None, guild_id=None):
+    """
+    Generate a response using OpenAI's API with message history context.
+    
+    Returns:
+        tuple: (response text, True if it came from the response cache,
+                completion tokens generated before any per-user limiting)
+    """
+    try:
+        # Serve repeated prompts from the cache
+        cache_key = None
+        if response_cache is not None:
+            cache_key = response_cache.make_key(persona_key, prompt, message_history)
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"Response cache hit for persona {persona_key}")
+                return await apply_user_sentence_limit(cached, user_id, guild_id), True, 0
         
-        # Add message history for context
-        if message_history:
-            messages.extend(message_history)
+        client = openai_manager.get()
         
-        # Add the current prompt with sanitized name
-        messages.append({
-            "role": "user", 
-            "name": sanitize_name(f"user_{len(messages)}"),
-            "content": prompt
-        })
+        messages = build_chat_messages(prompt, message_history, persona_key)
         
         # For debugging
         logger.debug(f"Using persona: {persona_key}")
         logger.debug(f"Sending {len(messages)} messages to OpenAI")
         
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # You can change this to a different model
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
+        # Call OpenAI API without blocking the event loop
+        async with llm_scheduler.slot(guild_id):
+            response = await client.chat.completions.create(
+                model="gpt-3.5-turbo",  # You can change this to a different model
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7
+            )
         
         # Extract the response text
         response_text = response.choices[0].message.content
         
-        # Apply sentence limiting if user_id and guild_id are provided
+        # Prefer the API's own count, the trimmed reply undercounts what was generated
+        usage = getattr(response, 'usage', None)
+        if usage is not None and usage.completion_tokens is not None:
+            completion_tokens = usage.completion_tokens
+        else:
+            completion_tokens = context_builder.count_tokens(response_text)
+        
+        # Cache the full response before any per-user limiting
+        if cache_key is not None:
+            await response_cache.set(cache_key, response_text)
+        
+        return await apply_user_sentence_limit(response_text, user_id, guild_id), False, completion_tokens
+    except Exception as e:
+        logger.error(f"OpenAI API error: {e}", exc_info=True)
+        raise
+
+async def stream_response(message, prompt, message_history, persona_key, user_id=None, guild_id=None):
+    """
+    Stream a response into a reply to message, editing it as text arrives.
+    
+    The reply is posted once the first sentence is complete and then edited at most
+    once per STREAM_EDIT_INTERVAL seconds. The upstream stream is closed as soon as
+    the user's sentence limit is reached, so discarded tokens are never generated.
+    
+    Returns:
+        tuple: (final reply text, True if it came from the response cache,
+                completion tokens streamed before the sentence limit was applied)
+    """
+    try:
+        # Serve repeated prompts from the cache without streaming
+        cache_key = None
+        if response_cache is not None:
+            cache_key = response_cache.make_key(persona_key, prompt, message_history)
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"Response cache hit for persona {persona_key}")
+                text = await apply_user_sentence_limit(cached, user_id, guild_id)
+                await message.reply(text)
+                return text, True, 0
+        
+        client = openai_manager.get()
+        
+        messages = build_chat_messages(prompt, message_history, persona_key)
+        
+        # Get user's max sentences preference
+        max_sentences = 0
         if user_id and guild_id:
-            # Get user's max sentences preference
-            max_sentences = db.get_user_max_sentences(guild_id, user_id, DEFAULT_MAX_SENTENCES)
+            max_sentences = await user_preferences.get(guild_id, user_id, 'max_sentences', DEFAULT_MAX_SENTENCES)
+        
+        logger.debug(f"Streaming {len(messages)} messages to OpenAI with persona {persona_key}")
+        
+        text = ""
+        generated = ""
+        stopped_early = False
+        reply = None
+        shown_text = ""
+        last_edit = 0.0
+        loop = asyncio.get_running_loop()
+        
+        # Hold a scheduler slot for the whole stream
+        async with llm_scheduler.slot(guild_id):
+            stream = await client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7,
+                stream=True
+            )
             
-            # Limit sentences if max_sentences is set
-            if max_sentences > 0:
-                try:
-                    # Use NLTK to split into sentences
-                    sentences = nltk.sent_tokenize(response_text)
+            try:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    text += delta
                     
-                    # Limit to max_sentences
-                    if len(sentences) > max_sentences:
-                        limited_response = ' '.join(sentences[:max_sentences])
-                        logger.debug(f"Limited response from {len(sentences)} to {max_sentences} sentences for user {user_id}")
-                        return limited_response
-                except Exception as e:
-                    # If sentence tokenization fails, log the error but return the full response
-                    logger.error(f"Error limiting sentences: {e}", exc_info=True)
-                    # Continue with the full response
+                    # Only re-split when the new text could have ended a sentence
+                    if not any(mark in delta for mark in ".!?\n"):
+                        continue
+                    sentences = nltk.sent_tokenize(text)
+                    
+                    # The last sentence may still be in progress
+                    complete = sentences[:-1]
+                    if not complete:
+                        continue
+                    
+                    # Stop generating once the user's limit is reached
+                    if max_sentences > 0 and len(complete) >= max_sentences:
+                        generated = text
+                        text = ' '.join(complete[:max_sentences])
+                        stopped_early = True
+                        logger.debug(f"Stopped stream at {max_sentences} sentences for user {user_id}")
+                        break
+                    
+                    visible = ' '.join(complete)
+                    now = loop.time()
+                    if reply is None:
+                        reply = await message.reply(visible)
+                        shown_text, last_edit = visible, now
+                    elif visible != shown_text and now - last_edit >= STREAM_EDIT_INTERVAL:
+                        await reply.edit(content=visible)
+                        shown_text, last_edit = visible, now
+            finally:
+                # Cancel the upstream request if we stopped early
+                await stream.close()
+        
+        # Everything streamed was generated and billed, including text cut by the limit
+        completion_tokens = context_builder.count_tokens(generated if stopped_early else text)
         
-        # Return the full response if no limiting was applied
-        return response_text
+        # Only complete responses are reusable
+        if cache_key is not None and not stopped_early:
+            await response_cache.set(cache_key, text.strip())
+        
+        # Apply the limit to whatever text was collected
+        text = limit_sentences(text.strip(), max_sentences, user_id)
+        
+        if reply is None:
+            await message.reply(text)
+        elif text != shown_text:
+            await reply.edit(content=text)
+        
+        return text, False, completion_tokens
     except Exception as e:
         logger.error(f"OpenAI API error: {e}", exc_info=True)
         raise
 
+async def run_bot():
+    """Run the bot and release shared resources when it stops."""
+    async with bot:
+        try:
+            await bot.start(DISCORD_TOKEN)
+        finally:
+            # Write chat messages that are still buffered
+            await message_buffer.close()
+            
+            # Stop image workers and close the pooled OpenAI connections
+            await image_jobs.stop()
+            await openai_manager.close()
+
 def main():
     """Main function to run the bot."""
     try:
@@ -954,11 +1569,13 @@ def main():
         logger.info("Starting Discord bot")
         
         # Run the bot
-        bot.run(DISCORD_TOKEN)
+        asyncio.run(run_bot())
+    except KeyboardInterrupt:
+        logger.info("Shutdown requested")
     except Exception as e:
         logger.critical(f"Error running bot: {e}", exc_info=True)
     finally:
-        # Close database connection when bot exits
+        # Finish queued writes and close the database connections
         db.close()
         logger.info("Bot shutdown complete")
 
@@ -0,0 +1,124 @@
+"""
+Compression module for storing long message content compactly.
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Values of messages.encoding
+ENCODING_TEXT = 0
+ENCODING_ZLIB = 1
+ENCODING_ZSTD = 2
+ENCODING_ZSTD_DICT = 3
+
+class ContentCodec:
+    """
+    Compresses message content above a size threshold.
+
+    Short messages stay plain text, since compression would barely shrink them and
+    costs time on every read. zstd is used when the zstandard package is installed
+    and requested, optionally with a dictionary trained on the bot's own messages,
+    otherwise zlib. Rows written with any method can always be read back.
+    """
+
+    def __init__(self, method="zlib", threshold=512, level=None, dictionary=None):
+        """
+        Initialize the codec.
+
+        Args:
+            method: "zlib", "zstd" or "none"
+            threshold: Minimum content size in bytes before it is compressed
+            level: Compression level (default 6 for zlib, 3 for zstd)
+            dictionary: Trained zstd dictionary bytes (optional)
+        """
+        if method not in ("zlib", "zstd", "none"):
+            raise ValueError(f"Unknown compression method: {method}")
+
+        # Fall back to zlib when zstandard isn't installed
+        if method == "zstd" and zstandard is None:
+            method = "zlib"
+
+        self.method = method
+        self.threshold = threshold
+        self.level = level if level is not None else (3 if method == "zstd" else 6)
+
+        self.zstd_dict = None
+        self.zstd_compressor = None
+        self.zstd_decompressor = None
+        self.zstd_dict_decompressor = None
+        if zstandard is not None:
+            self.zstd_decompressor = zstandard.ZstdDecompressor()
+            if dictionary:
+                self.zstd_dict = zstandard.ZstdCompressionDict(dictionary)
+                self.zstd_dict_decompressor = zstandard.ZstdDecompressor(dict_data=self.zstd_dict)
+            if method == "zstd":
+                self.zstd_compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.zstd_dict)
+
+    def encode(self, text):
+        """
+        Encode content for storage.
+
+        Args:
+            text: Message content
+
+        Returns:
+            tuple: (stored value, encoding)
+        """
+        data = text.encode('utf-8')
+        if self.method == "none" or len(data) < self.threshold:
+            return text, ENCODING_TEXT
+
+        if self.method == "zstd":
+            compressed = self.zstd_compressor.compress(data)
+            encoding = ENCODING_ZSTD_DICT if self.zstd_dict is not None else ENCODING_ZSTD
+        else:
+            compressed = zlib.compress(data, self.level)
+            encoding = ENCODING_ZLIB
+
+        # Keep incompressible content as text
+        if len(compressed) >= len(data):
+            return text, ENCODING_TEXT
+        return compressed, encoding
+
+    def decode(self, value, encoding):
+        """
+        Decode stored content.
+
+        Args:
+            value: Stored value
+            encoding: Encoding the value was stored with
+
+        Returns:
+            str: Message content
+        """
+        if not encoding:
+            return value
+        if encoding == ENCODING_ZLIB:
+            return zlib.decompress(value).decode('utf-8')
+
+        if self.zstd_decompressor is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed messages")
+        if encoding == ENCODING_ZSTD_DICT:
+            if self.zstd_dict_decompressor is None:
+                raise RuntimeError("The zstd dictionary used for stored messages is not configured")
+            return self.zstd_dict_decompressor.decompress(value).decode('utf-8')
+        return self.zstd_decompressor.decompress(value).decode('utf-8')
+
+    @staticmethod
+    def train_dictionary(samples, size=16384):
+        """
+        Train a zstd dictionary on sample messages.
+
+        Args:
+            samples: List of message strings
+            size: Dictionary size in bytes
+
+        Returns:
+            bytes: Dictionary data
+        """
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to train a dictionary")
+        return zstandard.train_dictionary(size, [sample.encode('utf-8') for sample in samples]).as_bytes()
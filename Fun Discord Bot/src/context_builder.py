@@ -0,0 +1,118 @@
+"""
+Context building module for fitting chat history into a token budget.
+"""
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Tokens OpenAI adds around every chat message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+class ContextBuilder:
+    """Selects the newest history messages that fit in a token budget."""
+
+    def __init__(self, token_budget=1500, model="gpt-3.5-turbo"):
+        """
+        Initialize the context builder.
+
+        Args:
+            token_budget: Maximum prompt tokens for system prompt, history and prompt
+            model: Model name used to pick the tokenizer
+        """
+        self.token_budget = token_budget
+        self.encoding = None
+
+        # Use the exact tokenizer when tiktoken is installed
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(self, text):
+        """
+        Count the tokens in a piece of text.
+
+        Args:
+            text: Text to count
+
+        Returns:
+            int: Number of tokens
+        """
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+
+        # Rough estimate of about four characters per token
+        return (len(text) + 3) // 4
+
+    def message_tokens(self, message):
+        """
+        Get the token count of a history message, computing it only once.
+
+        Args:
+            message: History message dictionary
+
+        Returns:
+            int: Number of tokens including per-message overhead
+        """
+        token_count = message.get('token_count')
+        if token_count is None:
+            token_count = self.count_tokens(message.get('content'))
+            message['token_count'] = token_count
+        return token_count + MESSAGE_OVERHEAD_TOKENS
+
+    def build(self, system_prompt, message_history, prompt):
+        """
+        Pick the newest history messages that fit in the budget.
+
+        Args:
+            system_prompt: Persona system prompt
+            message_history: History messages in chronological order
+            prompt: Current user prompt
+
+        Returns:
+            list: History messages in chronological order, ready to send to OpenAI
+        """
+        used = (self.count_tokens(system_prompt) + self.count_tokens(prompt)
+                + 2 * MESSAGE_OVERHEAD_TOKENS)
+
+        selected = []
+        for message in reversed(message_history or []):
+            tokens = self.message_tokens(message)
+            if used + tokens > self.token_budget:
+                break
+            used += tokens
+            selected.append(message)
+
+        selected.reverse()
+        return [self._to_api_message(message) for message in selected]
+
+    def count_prompt(self, system_prompt, messages, prompt):
+        """
+        Count the tokens a chat completion request sends.
+
+        Args:
+            system_prompt: Persona system prompt
+            messages: API messages between the system prompt and the prompt
+            prompt: Current user prompt
+
+        Returns:
+            int: Number of prompt tokens including per-message overhead
+        """
+        return (self.count_tokens(system_prompt) + self.count_tokens(prompt)
+                + sum(self.count_tokens(message['content']) for message in messages)
+                + (len(messages) + 2) * MESSAGE_OVERHEAD_TOKENS)
+
+    @staticmethod
+    def _to_api_message(message):
+        """Strip bookkeeping fields from a history message."""
+        api_message = {
+            'role': message['role'],
+            'content': message['content']
+        }
+        if message.get('name'):
+            api_message['name'] = message['name']
+        return api_message
@@ -1,50 +1,261 @@
 import sqlite3
 import json
 import os
+from compression import ContentCodec
+
+# Connection settings used when none are given
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000
+}
+
+# Current schema version, stored in PRAGMA user_version
+SCHEMA_VERSION = 3
+
+# SQL expression for the current time in epoch milliseconds
+NOW_MS = "CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)"
+
+# SQL expression for the stored size of a message row's text in bytes
+MESSAGE_SIZE = "LENGTH(CAST(content AS BLOB)) + COALESCE(LENGTH(CAST(name AS BLOB)), 0)"
+
+# Accepted values for the text pragmas
+PRAGMA_CHOICES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'}
+}
+
+def _search_scope(guild_id, channel_id):
+    """Build the full-text scope tokens for a message."""
+    return f"g{guild_id} c{channel_id}"
+
+def _utc_ms(column):
+    """SQL converting a UTC DATETIME string column to epoch milliseconds."""
+    return f"CAST(ROUND((julianday({column}) - 2440587.5) * 86400000) AS INTEGER)"
+
+def _local_ms(column):
+    """SQL converting a local-time DATETIME string column to epoch milliseconds."""
+    return f"CAST(ROUND((julianday({column}, 'utc') - 2440587.5) * 86400000) AS INTEGER)"
+
+# Version 0 tables and how each column is converted: {table: {column: SQL expression}}
+LEGACY_COLUMNS = {
+    'servers': {
+        'guild_id': 'CAST(guild_id AS INTEGER)',
+        'persona': 'persona',
+        'settings': 'settings'
+    },
+    'messages': {
+        'id': 'id',
+        'guild_id': 'CAST(guild_id AS INTEGER)',
+        'channel_id': 'CAST(channel_id AS INTEGER)',
+        'timestamp': _utc_ms('timestamp'),
+        'role': 'role',
+        'name': 'name',
+        'content': 'content',
+        'token_count': 'token_count'
+    },
+    'user_preferences': {
+        'guild_id': 'CAST(guild_id AS INTEGER)',
+        'user_id': 'CAST(user_id AS INTEGER)',
+        'key': 'key',
+        'value': 'value'
+    },
+    'warnings': {
+        'id': 'id',
+        'guild_id': 'CAST(guild_id AS INTEGER)',
+        'user_id': 'CAST(user_id AS INTEGER)',
+        'moderator_id': 'CAST(moderator_id AS INTEGER)',
+        'reason': 'reason',
+        'timestamp': _utc_ms('timestamp')
+    },
+    'reminders': {
+        'id': 'id',
+        'user_id': 'CAST(user_id AS INTEGER)',
+        'channel_id': 'CAST(channel_id AS INTEGER)',
+        'guild_id': 'CAST(guild_id AS INTEGER)',
+        'message': 'message',
+        # Reminder times were written from datetime.now(), so they are local time
+        'remind_time': _local_ms('remind_time'),
+        'created_time': _utc_ms('created_time')
+    },
+    'channel_summaries': {
+        'guild_id': 'CAST(guild_id AS INTEGER)',
+        'channel_id': 'CAST(channel_id AS INTEGER)',
+        'summary': 'summary',
+        'last_message_id': 'last_message_id',
+        'updated_at': _utc_ms('updated_at')
+    }
+}
 
 class Database:
     """Database class for persistent storage."""
     
-    def __init__(self, db_path):
+    def __init__(self, db_path, create_tables=True, check_same_thread=True, pragmas=None, codec=None):
         """
         Initialize the database connection.
         
         Args:
             db_path: Path to the SQLite database file
+            create_tables: Create and migrate tables (off for extra read connections)
+            check_same_thread: Restrict the connection to the creating thread
+            pragmas: Connection settings such as journal_mode and synchronous (defaults to DEFAULT_PRAGMAS)
+            codec: ContentCodec for message content (defaults to zlib above 512 bytes)
         """
+        self.codec = codec if codec is not None else ContentCodec()
+        
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         
         # Connect to database
-        self.conn = sqlite3.connect(db_path)
+        self.conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
         self.conn.row_factory = sqlite3.Row
         
+        # Must be set before the journal mode initializes a new file
+        if create_tables:
+            self._enable_incremental_vacuum()
+        
+        # Apply journaling and cache settings
+        self._apply_pragmas(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        
         # Create tables if they don't exist
-        self._create_tables()
+        if create_tables:
+            self._create_tables()
+    
+    def _apply_pragmas(self, pragmas):
+        """Apply connection pragmas, journal mode first."""
+        cursor = self.conn.cursor()
+        
+        for name in sorted(pragmas, key=lambda name: name != 'journal_mode'):
+            value = pragmas[name]
+            
+            # Pragma values can't be bound as parameters, so only allow known values
+            if name in PRAGMA_CHOICES:
+                value = str(value).upper()
+                if value not in PRAGMA_CHOICES[name]:
+                    raise ValueError(f"Invalid value for PRAGMA {name}: {pragmas[name]}")
+            elif name in ('cache_size', 'mmap_size', 'busy_timeout', 'wal_autocheckpoint'):
+                value = int(value)
+            else:
+                raise ValueError(f"Unsupported PRAGMA: {name}")
+            
+            cursor.execute(f'PRAGMA {name} = {value}')
+    
+    def checkpoint(self, mode='PASSIVE'):
+        """
+        Copy committed WAL pages back into the database file.
+        
+        Args:
+            mode: Checkpoint mode (PASSIVE, FULL, RESTART or TRUNCATE)
+            
+        Returns:
+            dict: Whether the checkpoint was blocked, WAL pages and pages checkpointed
+        """
+        mode = mode.upper()
+        if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError(f"Invalid checkpoint mode: {mode}")
+        
+        cursor = self.conn.cursor()
+        cursor.execute(f'PRAGMA wal_checkpoint({mode})')
+        row = cursor.fetchone()
+        
+        return {
+            'busy': bool(row[0]),
+            'wal_pages': row[1],
+            'checkpointed_pages': row[2]
+        }
+    
+    def _enable_incremental_vacuum(self):
+        """Switch the file to auto_vacuum=INCREMENTAL so pruned space can be returned in steps."""
+        cursor = self.conn.cursor()
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] == 2:
+            return
+        
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        
+        # Existing files only change mode after a full rebuild, done once
+        cursor.execute('PRAGMA page_count')
+        if cursor.fetchone()[0]:
+            self.conn.commit()
+            cursor.execute('VACUUM')
+    
+    def incremental_vacuum(self, pages=1000):
+        """
+        Return free pages to the file system.
+        
+        Args:
+            pages: Maximum number of pages to release
+            
+        Returns:
+            int: Number of bytes released
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+        cursor.execute('PRAGMA freelist_count')
+        before = cursor.fetchone()[0]
+        
+        # execute() steps the pragma only once, a script runs it to completion
+        self.conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+        
+        cursor.execute('PRAGMA freelist_count')
+        return (before - cursor.fetchone()[0]) * page_size
     
     def _create_tables(self):
-        """Create necessary tables if they don't exist."""
+        """Create necessary tables if they don't exist and migrate older schemas."""
         cursor = self.conn.cursor()
         
+        # Create and migrate everything in one transaction
+        self.conn.commit()
+        cursor.execute('BEGIN IMMEDIATE')
+        
+        # Version 0 tables are moved aside and copied into the new schema below
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+        legacy_tables = []
+        if version < 1:
+            legacy_tables = self._rename_legacy_tables(cursor)
+        
         # Create servers table
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS servers (
-            guild_id TEXT PRIMARY KEY,
+            guild_id INTEGER PRIMARY KEY,
             persona TEXT NOT NULL,
             settings TEXT
         )
         ''')
         
         # Create messages table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            guild_id TEXT NOT NULL,
-            channel_id TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL DEFAULT ({NOW_MS}),
             role TEXT NOT NULL,
             name TEXT,
-            content TEXT NOT NULL
+            content TEXT NOT NULL,
+            token_count INTEGER,
+            encoding INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        
+        # Version 1 stored all content as plain text
+        if 0 < version < 2:
+            cursor.execute('ALTER TABLE messages ADD COLUMN encoding INTEGER NOT NULL DEFAULT 0')
+        
+        # Create user preferences table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (guild_id, user_id, key)
         )
         ''')
         
@@ -57,32 +268,179 @@ class Database:
         ''')
         
         # Create warnings table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS warnings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            guild_id TEXT NOT NULL,
-            user_id TEXT NOT NULL,
-            moderator_id TEXT NOT NULL,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            moderator_id INTEGER NOT NULL,
             reason TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            timestamp INTEGER NOT NULL DEFAULT ({NOW_MS})
         )
         ''')
         
         # Create reminders table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS reminders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            channel_id TEXT NOT NULL,
-            guild_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
             message TEXT NOT NULL,
-            remind_time DATETIME NOT NULL,
-            created_time DATETIME DEFAULT CURRENT_TIMESTAMP
+            remind_time INTEGER NOT NULL,
+            created_time INTEGER NOT NULL DEFAULT ({NOW_MS})
         )
         ''')
         
+        # Create channel summaries table
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS channel_summaries (
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL DEFAULT ({NOW_MS}),
+            PRIMARY KEY (guild_id, channel_id)
+        )
+        ''')
+        
+        # Create image cache index table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_cache (
+            prompt_key TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        )
+        ''')
+        
+        # Indexes for LRU eviction and shared-image lookups
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_cache_last_used ON image_cache (last_used)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_cache_content ON image_cache (content_hash)')
+        
+        # Create response cache table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            cache_key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''')
+        
+        # Copy version 0 data into the new tables
+        if legacy_tables:
+            self._copy_legacy_tables(cursor, legacy_tables)
+        
+        # Move preferences out of the per-server settings blobs
+        self._migrate_settings_preferences(cursor)
+        
+        # Full-text index over message content. It is contentless because the content
+        # may be compressed, so rows are added and removed from the write path with the
+        # original text. The scope column holds guild and channel tokens for filtering.
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            body,
+            scope,
+            content='',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''')
+        
+        # Index messages stored before full-text search existed
+        if version < 3:
+            self._index_existing_messages(cursor)
+        
+        # Index for newest-first history per channel
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_channel
+        ON messages (guild_id, channel_id, id)
+        ''')
+        
+        # Index for age-based retention
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)')
+        
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_warnings_user
+        ON warnings (guild_id, user_id)
+        ''')
+        
+        # Index for the due reminder scan
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reminders_time
+        ON reminders (remind_time)
+        ''')
+        
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at)')
+        
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         self.conn.commit()
     
+    def _index_existing_messages(self, cursor):
+        """Add all stored messages to the full-text index."""
+        cursor.execute('SELECT id, guild_id, channel_id, content, encoding FROM messages')
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            self.conn.executemany(
+                'INSERT INTO messages_fts (rowid, body, scope) VALUES (?, ?, ?)',
+                [
+                    (row['id'], self.codec.decode(row['content'], row['encoding']),
+                     _search_scope(row['guild_id'], row['channel_id']))
+                    for row in rows
+                ]
+            )
+    
+    def _rename_legacy_tables(self, cursor):
+        """Move version 0 tables with TEXT IDs aside so the current schema can be created."""
+        renamed = []
+        for table in LEGACY_COLUMNS:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+            if cursor.fetchone():
+                # Indexes move with the table and are dropped with it
+                cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_v0')
+                renamed.append(table)
+        return renamed
+    
+    def _copy_legacy_tables(self, cursor, tables):
+        """Copy version 0 rows into the current schema and drop the old tables."""
+        for table in tables:
+            # Tables from before a column existed get NULL for it
+            cursor.execute(f'PRAGMA table_info({table}_v0)')
+            existing = {column['name'] for column in cursor.fetchall()}
+            
+            columns = LEGACY_COLUMNS[table]
+            select = [
+                expression if column in existing else 'NULL'
+                for column, expression in columns.items()
+            ]
+            
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) SELECT {", ".join(select)} FROM {table}_v0'
+            )
+            cursor.execute(f'DROP TABLE {table}_v0')
+    
+    def _migrate_settings_preferences(self, cursor):
+        """Copy user preferences stored in servers.settings into user_preferences."""
+        cursor.execute("SELECT guild_id, settings FROM servers WHERE settings LIKE '%user_preferences%'")
+        
+        for row in cursor.fetchall():
+            settings = json.loads(row['settings'])
+            users = settings.pop('user_preferences', {}).get('users', {})
+            
+            for user_id, preferences in users.items():
+                for key, value in preferences.items():
+                    # Rows written after the migration started take precedence
+                    cursor.execute(
+                        'INSERT OR IGNORE INTO user_preferences (guild_id, user_id, key, value) VALUES (?, ?, ?, ?)',
+                        (row['guild_id'], user_id, key, json.dumps(value))
+                    )
+            
+            cursor.execute(
+                'UPDATE servers SET settings = ? WHERE guild_id = ?',
+                (json.dumps(settings), row['guild_id'])
+            )
+    
     def get_server_data(self, guild_id, default_persona):
         """
         Get server-specific data.
@@ -143,62 +501,66 @@ class Database:
         
         self.conn.commit()
         
-    def update_user_max_sentences(self, guild_id, user_id, max_sentences):
+    def get_active_personas(self):
         """
-        Update a user's maximum sentences preference.
+        Get the personas servers currently have selected.
+        
+        Returns:
+            list: Distinct persona keys
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT DISTINCT persona FROM servers')
+        return [row['persona'] for row in cursor.fetchall()]
+    
+    def set_user_preference(self, guild_id, user_id, key, value):
+        """
+        Set one preference for a user in a guild.
         
         Args:
             guild_id: Discord guild ID
             user_id: Discord user ID
-            max_sentences: Maximum number of sentences in responses
+            key: Preference name
+            value: JSON-serializable preference value
         """
         cursor = self.conn.cursor()
+        cursor.execute(
+            '''
+            INSERT INTO user_preferences (guild_id, user_id, key, value) VALUES (?, ?, ?, ?)
+            ON CONFLICT (guild_id, user_id, key) DO UPDATE SET value = excluded.value
+            ''',
+            (guild_id, user_id, key, json.dumps(value))
+        )
+        self.conn.commit()
+    
+    def get_user_preferences(self, guild_id, user_id):
+        """
+        Get all preferences for a user in a guild.
         
-        # Get current server settings
-        cursor.execute('SELECT settings FROM servers WHERE guild_id = ?', (guild_id,))
-        row = cursor.fetchone()
-        
-        if row:
-            # Parse existing settings
-            settings = json.loads(row['settings']) if row['settings'] else {}
-            
-            # Initialize user_preferences if it doesn't exist
-            if 'user_preferences' not in settings:
-                settings['user_preferences'] = {}
-                
-            # Update max_sentences for this user
-            if 'users' not in settings['user_preferences']:
-                settings['user_preferences']['users'] = {}
-                
-            settings['user_preferences']['users'][str(user_id)] = {
-                'max_sentences': max_sentences
-            }
-            
-            # Save updated settings
-            cursor.execute(
-                'UPDATE servers SET settings = ? WHERE guild_id = ?',
-                (json.dumps(settings), guild_id)
-            )
-            self.conn.commit()
-            return True
-        else:
-            # Initialize new server with default settings and user preference
-            default_settings = {
-                'user_preferences': {
-                    'users': {
-                        str(user_id): {
-                            'max_sentences': max_sentences
-                        }
-                    }
-                }
-            }
+        Args:
+            guild_id: Discord guild ID
+            user_id: Discord user ID
             
-            cursor.execute(
-                'INSERT INTO servers (guild_id, persona, settings) VALUES (?, ?, ?)',
-                (guild_id, 'helpful_assistant', json.dumps(default_settings))
-            )
-            self.conn.commit()
-            return True
+        Returns:
+            dict: Preference values by name
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT key, value FROM user_preferences WHERE guild_id = ? AND user_id = ?',
+            (guild_id, user_id)
+        )
+        return {row['key']: json.loads(row['value']) for row in cursor.fetchall()}
+    
+    def update_user_max_sentences(self, guild_id, user_id, max_sentences):
+        """
+        Update a user's maximum sentences preference.
+        
+        Args:
+            guild_id: Discord guild ID
+            user_id: Discord user ID
+            max_sentences: Maximum number of sentences in responses
+        """
+        self.set_user_preference(guild_id, user_id, 'max_sentences', max_sentences)
+        return True
         
     def get_user_max_sentences(self, guild_id, user_id, default_max_sentences):
         """
@@ -212,24 +574,9 @@ class Database:
         Returns:
             int: Maximum number of sentences for responses
         """
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT settings FROM servers WHERE guild_id = ?', (guild_id,))
-        row = cursor.fetchone()
-        
-        if row and row['settings']:
-            settings = json.loads(row['settings'])
-            
-            # Check if user has a preference
-            if ('user_preferences' in settings and 
-                'users' in settings['user_preferences'] and 
-                str(user_id) in settings['user_preferences']['users'] and
-                'max_sentences' in settings['user_preferences']['users'][str(user_id)]):
-                return settings['user_preferences']['users'][str(user_id)]['max_sentences']
-        
-        # Return default if no preference is set
-        return default_max_sentences
+        return self.get_user_preferences(guild_id, user_id).get('max_sentences', default_max_sentences)
     
-    def store_message(self, guild_id, channel_id, role, name, content):
+    def store_message(self, guild_id, channel_id, role, name, content, token_count=None):
         """
         Store a message in the database.
         
@@ -239,17 +586,54 @@ class Database:
             role: Message role (user or assistant)
             name: Username (only for user messages)
             content: Message content
+            token_count: Number of tokens in the content (optional)
         """
-        cursor = self.conn.cursor()
-        cursor.execute(
-            'INSERT INTO messages (guild_id, channel_id, role, name, content) VALUES (?, ?, ?, ?, ?)',
-            (guild_id, channel_id, role, name, content)
-        )
-        self.conn.commit()
+        self.store_messages([(guild_id, channel_id, role, name, content, token_count)])
+    
+    def store_messages(self, rows):
+        """
+        Store several messages in one transaction.
+        
+        Args:
+            rows: List of (guild_id, channel_id, role, name, content, token_count) tuples
+        """
+        if not rows:
+            return
+        
+        # Long content is stored compressed
+        encoded = []
+        for guild_id, channel_id, role, name, content, token_count in rows:
+            value, encoding = self.codec.encode(content)
+            encoded.append((guild_id, channel_id, role, name, value, token_count, encoding))
+        
+        # Either every row and its index entry is stored or none are, so a retry can't duplicate rows
+        with self.conn:
+            cursor = self.conn.cursor()
+            cursor.executemany(
+                '''
+                INSERT INTO messages (guild_id, channel_id, role, name, content, token_count, encoding)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''',
+                encoded
+            )
+            
+            # AUTOINCREMENT IDs only grow and nothing else writes inside this transaction,
+            # so the new rows are the last len(rows) IDs
+            cursor.execute('SELECT MAX(id) FROM messages')
+            first_id = cursor.fetchone()[0] - len(rows) + 1
+            
+            # Index the original text, the stored content may be compressed
+            cursor.executemany(
+                'INSERT INTO messages_fts (rowid, body, scope) VALUES (?, ?, ?)',
+                [
+                    (first_id + offset, content, _search_scope(guild_id, channel_id))
+                    for offset, (guild_id, channel_id, _, _, content, _) in enumerate(rows)
+                ]
+            )
     
     def get_message_history(self, guild_id, channel_id, limit):
         """
-        Get message history for a channel.
+        Get the most recent messages for a channel.
         
         Args:
             guild_id: Discord guild ID
@@ -257,24 +641,27 @@ class Database:
             limit: Maximum number of messages to retrieve
             
         Returns:
-            list: List of message dictionaries
+            list: List of message dictionaries in chronological order
         """
         cursor = self.conn.cursor()
+        
+        # Walk the channel index newest first, then put the rows back in order
         cursor.execute(
             '''
-            SELECT role, name, content FROM messages 
+            SELECT role, name, content, token_count, encoding FROM messages 
             WHERE guild_id = ? AND channel_id = ? 
-            ORDER BY timestamp ASC
+            ORDER BY id DESC
             LIMIT ?
             ''',
             (guild_id, channel_id, limit)
         )
         
         messages = []
-        for row in cursor.fetchall():
+        for row in reversed(cursor.fetchall()):
             message = {
                 'role': row['role'],
-                'content': row['content']
+                'content': self.codec.decode(row['content'], row['encoding']),
+                'token_count': row['token_count']
             }
             
             # Only include name for user messages
@@ -285,6 +672,301 @@ class Database:
         
         return messages
     
+    def get_channel_summary(self, guild_id, channel_id):
+        """
+        Get the rolling summary for a channel.
+        
+        Args:
+            guild_id: Discord guild ID
+            channel_id: Discord channel ID
+            
+        Returns:
+            dict: Summary data, or None if the channel has no summary
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT summary, last_message_id, updated_at FROM channel_summaries WHERE guild_id = ? AND channel_id = ?',
+            (guild_id, channel_id)
+        )
+        row = cursor.fetchone()
+        
+        if row:
+            return {
+                'summary': row['summary'],
+                'last_message_id': row['last_message_id'],
+                'updated_at': row['updated_at']
+            }
+        return None
+    
+    def update_channel_summary(self, guild_id, channel_id, summary, last_message_id):
+        """
+        Store the rolling summary for a channel.
+        
+        Args:
+            guild_id: Discord guild ID
+            channel_id: Discord channel ID
+            summary: Summary text
+            last_message_id: ID of the newest message folded into the summary
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f'''
+            INSERT OR REPLACE INTO channel_summaries (guild_id, channel_id, summary, last_message_id, updated_at)
+            VALUES (?, ?, ?, ?, {NOW_MS})
+            ''',
+            (guild_id, channel_id, summary, last_message_id)
+        )
+        self.conn.commit()
+    
+    def get_messages_to_summarize(self, guild_id, channel_id, after_id, keep_recent, limit):
+        """
+        Get messages that fell out of the recent history window and are not summarized yet.
+        
+        Args:
+            guild_id: Discord guild ID
+            channel_id: Discord channel ID
+            after_id: ID of the newest message already summarized
+            keep_recent: Number of most recent messages that stay in the history window
+            limit: Maximum number of messages to return
+            
+        Returns:
+            list: List of message dictionaries (with IDs) in chronological order
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            '''
+            SELECT id, role, name, content, encoding FROM messages
+            WHERE guild_id = ? AND channel_id = ? AND id > ?
+            AND id < (
+                SELECT MIN(id) FROM (
+                    SELECT id FROM messages
+                    WHERE guild_id = ? AND channel_id = ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                )
+            )
+            ORDER BY id ASC
+            LIMIT ?
+            ''',
+            (guild_id, channel_id, after_id, guild_id, channel_id, keep_recent, limit)
+        )
+        
+        messages = []
+        for row in cursor.fetchall():
+            messages.append({
+                'id': row['id'],
+                'role': row['role'],
+                'name': row['name'],
+                'content': self.codec.decode(row['content'], row['encoding'])
+            })
+        
+        return messages
+    
+    def get_expired_message_ids(self, cutoff, limit):
+        """
+        Get the IDs of messages older than a cutoff.
+        
+        Args:
+            cutoff: Cutoff time in epoch milliseconds
+            limit: Maximum number of IDs to return
+            
+        Returns:
+            list: Message IDs, oldest first
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT id FROM messages WHERE timestamp < ? ORDER BY timestamp ASC LIMIT ?',
+            (cutoff, limit)
+        )
+        return [row['id'] for row in cursor.fetchall()]
+    
+    def get_channels_over_row_limit(self, max_rows):
+        """
+        Get channels that store more than a number of messages.
+        
+        Args:
+            max_rows: Maximum number of messages per channel
+            
+        Returns:
+            list: List of dictionaries with guild_id, channel_id and message count
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            '''
+            SELECT guild_id, channel_id, COUNT(*) AS message_count FROM messages
+            GROUP BY guild_id, channel_id
+            HAVING message_count > ?
+            ''',
+            (max_rows,)
+        )
+        
+        return [
+            {'guild_id': row['guild_id'], 'channel_id': row['channel_id'], 'message_count': row['message_count']}
+            for row in cursor.fetchall()
+        ]
+    
+    def get_guilds_over_byte_limit(self, max_bytes):
+        """
+        Get guilds whose stored message text is larger than a limit.
+        
+        Args:
+            max_bytes: Maximum message bytes per guild
+            
+        Returns:
+            list: List of dictionaries with guild_id and size_bytes
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f'''
+            SELECT guild_id, SUM({MESSAGE_SIZE}) AS size_bytes FROM messages
+            GROUP BY guild_id
+            HAVING size_bytes > ?
+            ''',
+            (max_bytes,)
+        )
+        
+        return [{'guild_id': row['guild_id'], 'size_bytes': row['size_bytes']} for row in cursor.fetchall()]
+    
+    def get_oldest_messages(self, guild_id, limit, channel_id=None):
+        """
+        Get the oldest messages of a guild or channel.
+        
+        Args:
+            guild_id: Discord guild ID
+            limit: Maximum number of messages to return
+            channel_id: Discord channel ID (optional, whole guild if omitted)
+            
+        Returns:
+            list: List of dictionaries with id and size_bytes, oldest first
+        """
+        cursor = self.conn.cursor()
+        if channel_id is None:
+            cursor.execute(
+                f'SELECT id, {MESSAGE_SIZE} AS size_bytes FROM messages WHERE guild_id = ? ORDER BY id ASC LIMIT ?',
+                (guild_id, limit)
+            )
+        else:
+            cursor.execute(
+                f'''
+                SELECT id, {MESSAGE_SIZE} AS size_bytes FROM messages
+                WHERE guild_id = ? AND channel_id = ?
+                ORDER BY id ASC LIMIT ?
+                ''',
+                (guild_id, channel_id, limit)
+            )
+        
+        return [{'id': row['id'], 'size_bytes': row['size_bytes']} for row in cursor.fetchall()]
+    
+    def delete_messages(self, message_ids):
+        """
+        Delete messages by ID in one transaction.
+        
+        Args:
+            message_ids: IDs of the messages to delete
+            
+        Returns:
+            tuple: (rows deleted, bytes of message text deleted)
+        """
+        if not message_ids:
+            return 0, 0
+        
+        cursor = self.conn.cursor()
+        placeholders = ', '.join('?' * len(message_ids))
+        cursor.execute(
+            f'''
+            SELECT id, guild_id, channel_id, content, encoding, {MESSAGE_SIZE} AS size_bytes
+            FROM messages WHERE id IN ({placeholders})
+            ''',
+            message_ids
+        )
+        rows = cursor.fetchall()
+        size_bytes = sum(row['size_bytes'] for row in rows)
+        
+        # A contentless index needs the original values to remove an entry
+        cursor.executemany(
+            "INSERT INTO messages_fts (messages_fts, rowid, body, scope) VALUES ('delete', ?, ?, ?)",
+            [
+                (row['id'], self.codec.decode(row['content'], row['encoding']),
+                 _search_scope(row['guild_id'], row['channel_id']))
+                for row in rows
+            ]
+        )
+        
+        cursor.execute(f'DELETE FROM messages WHERE id IN ({placeholders})', message_ids)
+        self.conn.commit()
+        return cursor.rowcount, size_bytes
+    
+    def search_messages(self, guild_id, terms, limit, channel_id=None, after=None):
+        """
+        Full-text search a guild's messages, best matches first.
+        
+        Args:
+            guild_id: Discord guild ID
+            terms: List of words that must all appear
+            limit: Maximum number of results
+            channel_id: Discord channel ID (optional, whole guild if omitted)
+            after: (score, id) of the last result of the previous page (optional)
+            
+        Returns:
+            list: List of result dictionaries with id, channel_id, role, name, content, timestamp and score
+        """
+        if not terms:
+            return []
+        
+        # Quote every term so user input can't use FTS5 query syntax
+        quoted = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+        scope = f'scope : "g{guild_id}"'
+        if channel_id is not None:
+            scope += f' AND scope : "c{channel_id}"'
+        match = f'{scope} AND body : ({quoted})'
+        
+        # Keyset pagination on (score, id), the scope column doesn't affect ranking
+        last_score, last_id = after if after is not None else (None, None)
+        cursor = self.conn.cursor()
+        cursor.execute(
+            '''
+            SELECT m.id, m.channel_id, m.role, m.name, m.content, m.encoding, m.timestamp, f.score
+            FROM (
+                SELECT rowid, bm25(messages_fts, 1.0, 0.0) AS score
+                FROM messages_fts WHERE messages_fts MATCH ?
+            ) AS f
+            JOIN messages AS m ON m.id = f.rowid
+            WHERE ? IS NULL OR f.score > ? OR (f.score = ? AND f.rowid > ?)
+            ORDER BY f.score, f.rowid
+            LIMIT ?
+            ''',
+            (match, last_score, last_score, last_score, last_id, limit)
+        )
+        
+        results = []
+        for row in cursor.fetchall():
+            results.append({
+                'id': row['id'],
+                'channel_id': row['channel_id'],
+                'role': row['role'],
+                'name': row['name'],
+                'content': self.codec.decode(row['content'], row['encoding']),
+                'timestamp': row['timestamp'],
+                'score': row['score']
+            })
+        
+        return results
+    
+    def rebuild_search_index(self):
+        """
+        Rebuild the full-text index from the stored messages.
+        
+        Returns:
+            int: Number of messages indexed
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+        self._index_existing_messages(cursor)
+        self.conn.commit()
+        
+        cursor.execute('SELECT COUNT(*) FROM messages')
+        return cursor.fetchone()[0]
+    
     def add_warning(self, guild_id, user_id, moderator_id, reason=None):
         """
         Add a warning for a user.
@@ -345,7 +1027,7 @@ class Database:
             channel_id: Discord channel ID where the reminder should be sent
             guild_id: Discord guild ID
             message: Reminder message
-            remind_time: Datetime when the reminder should be sent
+            remind_time: When the reminder should be sent, in epoch milliseconds
             
         Returns:
             int: ID of the new reminder
@@ -363,7 +1045,7 @@ class Database:
         Get all reminders that are due.
         
         Args:
-            current_time: Current datetime
+            current_time: Current time in epoch milliseconds
             
         Returns:
             list: List of due reminder dictionaries
@@ -403,6 +1085,197 @@ class Database:
         self.conn.commit()
         return cursor.rowcount > 0
     
+    def get_cached_response(self, cache_key, current_time):
+        """
+        Get a cached response that has not expired.
+        
+        Args:
+            cache_key: Response cache key
+            current_time: Current time as a Unix timestamp
+            
+        Returns:
+            tuple: (response, expires_at), or None if missing or expired
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT response, expires_at FROM response_cache WHERE cache_key = ? AND expires_at > ?',
+            (cache_key, current_time)
+        )
+        row = cursor.fetchone()
+        
+        if row:
+            return row['response'], row['expires_at']
+        return None
+    
+    def store_cached_response(self, cache_key, response, expires_at):
+        """
+        Store a response in the persistent response cache.
+        
+        Args:
+            cache_key: Response cache key
+            response: Response text
+            expires_at: Expiry time as a Unix timestamp
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'INSERT OR REPLACE INTO response_cache (cache_key, response, expires_at) VALUES (?, ?, ?)',
+            (cache_key, response, expires_at)
+        )
+        self.conn.commit()
+    
+    def delete_expired_cached_responses(self, current_time):
+        """
+        Delete expired response cache entries.
+        
+        Args:
+            current_time: Current time as a Unix timestamp
+            
+        Returns:
+            int: Number of entries deleted
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM response_cache WHERE expires_at <= ?', (current_time,))
+        self.conn.commit()
+        return cursor.rowcount
+    
+    def trim_cached_responses(self, max_rows):
+        """
+        Delete the response cache entries closest to expiry beyond a row cap.
+        
+        Args:
+            max_rows: Number of entries to keep
+            
+        Returns:
+            int: Number of entries deleted
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'DELETE FROM response_cache WHERE cache_key IN '
+            '(SELECT cache_key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+            (max_rows,)
+        )
+        self.conn.commit()
+        return cursor.rowcount
+    
+    def get_image_cache_entry(self, prompt_key):
+        """
+        Get the cached image for a prompt key.
+        
+        Args:
+            prompt_key: Image prompt key
+            
+        Returns:
+            dict: Cache entry, or None if the prompt is not cached
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM image_cache WHERE prompt_key = ?', (prompt_key,))
+        row = cursor.fetchone()
+        
+        if row:
+            return {
+                'prompt_key': row['prompt_key'],
+                'content_hash': row['content_hash'],
+                'size_bytes': row['size_bytes'],
+                'last_used': row['last_used']
+            }
+        return None
+    
+    def store_image_cache_entry(self, prompt_key, content_hash, size_bytes, last_used):
+        """
+        Store the cached image for a prompt key.
+        
+        Args:
+            prompt_key: Image prompt key
+            content_hash: SHA-256 of the image data
+            size_bytes: Size of the image file
+            last_used: Unix timestamp of the last use
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'INSERT OR REPLACE INTO image_cache (prompt_key, content_hash, size_bytes, last_used) VALUES (?, ?, ?, ?)',
+            (prompt_key, content_hash, size_bytes, last_used)
+        )
+        self.conn.commit()
+    
+    def touch_image_cache_entry(self, prompt_key, last_used):
+        """
+        Mark a cached image as recently used.
+        
+        Args:
+            prompt_key: Image prompt key
+            last_used: Unix timestamp of the use
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('UPDATE image_cache SET last_used = ? WHERE prompt_key = ?', (last_used, prompt_key))
+        self.conn.commit()
+    
+    def delete_image_cache_entry(self, prompt_key):
+        """
+        Delete a cached image entry.
+        
+        Args:
+            prompt_key: Image prompt key
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM image_cache WHERE prompt_key = ?', (prompt_key,))
+        self.conn.commit()
+    
+    def get_image_cache_size(self):
+        """
+        Get the total size of cached images, counting an image shared by several prompts once.
+        
+        Returns:
+            int: Total size in bytes
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            '''
+            SELECT COALESCE(SUM(size_bytes), 0) FROM (
+                SELECT MAX(size_bytes) AS size_bytes FROM image_cache GROUP BY content_hash
+            )
+            '''
+        )
+        return cursor.fetchone()[0]
+    
+    def get_least_recent_image_cache_entries(self, limit, offset=0):
+        """
+        Get the least recently used cached images.
+        
+        Args:
+            limit: Maximum number of entries to return
+            offset: Number of least recently used entries to skip
+            
+        Returns:
+            list: List of cache entry dictionaries, oldest first
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM image_cache ORDER BY last_used ASC LIMIT ? OFFSET ?', (limit, offset))
+        
+        entries = []
+        for row in cursor.fetchall():
+            entries.append({
+                'prompt_key': row['prompt_key'],
+                'content_hash': row['content_hash'],
+                'size_bytes': row['size_bytes'],
+                'last_used': row['last_used']
+            })
+        
+        return entries
+    
+    def image_content_in_use(self, content_hash):
+        """
+        Check whether any prompt still refers to an image.
+        
+        Args:
+            content_hash: SHA-256 of the image data
+            
+        Returns:
+            bool: True if the image is still referenced
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT 1 FROM image_cache WHERE content_hash = ? LIMIT 1', (content_hash,))
+        return cursor.fetchone() is not None
+    
     def close(self):
         """Close the database connection."""
         if self.conn:
@@ -0,0 +1,276 @@
+"""
+Image job module for queued DALL-E generation with a local result cache.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+import httpx
+from scheduler import Priority
+
+class ImageQueueFullError(Exception):
+    """Raised when the image job queue cannot accept more work."""
+
+class ImageJobQueue:
+    """
+    Bounded worker pool for image generation.
+
+    Identical prompts that are already being generated share one job, and finished
+    images are stored on disk under their content hash so repeated prompts are
+    served from the cache instead of expiring OpenAI URLs.
+    """
+
+    def __init__(self, db, openai_manager, scheduler, logger, cache_dir="data/image_cache",
+                 max_cache_bytes=524288000, workers=2, max_queue=20,
+                 model="dall-e-3", size="1024x1024", quality="standard"):
+        """
+        Initialize the image job queue.
+
+        Args:
+            db: AsyncDatabase instance holding the prompt to image index
+            openai_manager: OpenAIClientManager providing the shared client
+            scheduler: LLMScheduler the generation calls go through
+            logger: BotLogger instance
+            cache_dir: Directory for cached images
+            max_cache_bytes: Maximum total size of cached images
+            workers: Number of concurrent generation workers
+            max_queue: Maximum number of jobs waiting for a worker
+            model: Image model
+            size: Image size
+            quality: Image quality
+        """
+        self.db = db
+        self.openai_manager = openai_manager
+        self.scheduler = scheduler
+        self.logger = logger
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.model = model
+        self.size = size
+        self.quality = quality
+
+        self.queue = None
+        self.workers = []
+        self.http_client = None
+
+        # Structure: {prompt_key: future resolving to an image path}
+        self.inflight = {}
+
+        # Structure: Counter({prompt_key: callers still sending the image}), skipped by eviction
+        self.pinned = Counter()
+
+    def start(self):
+        """Start the worker pool. Must be called from within the running event loop."""
+        if self.workers:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.http_client = httpx.AsyncClient(timeout=60.0)
+
+        loop = asyncio.get_running_loop()
+        self.workers = [loop.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        """Stop the workers and close the download client."""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+
+    def prompt_key(self, prompt):
+        """Build the dedup key for a prompt and the current image settings."""
+        normalized = re.sub(r'\s+', ' ', prompt.strip().lower())
+        raw = f"{self.model}\x00{self.size}\x00{self.quality}\x00{normalized}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def generate(self, prompt, guild_id=None, priority=Priority.HIGH):
+        """
+        Get an image for a prompt from the cache, an identical job in flight, or a new job.
+
+        Args:
+            prompt: Image prompt
+            guild_id: Discord guild ID the image is generated for
+            priority: Scheduler lane for the generation call
+
+        Returns:
+            tuple: (path to the image file, True if served from the cache,
+                    True if an identical job was already in flight)
+        """
+        key = self.prompt_key(prompt)
+
+        # Serve finished images from disk
+        path = await self._lookup(key)
+        if path is not None:
+            return path, True, False
+
+        # Join an identical job that is already running
+        future = self.inflight.get(key)
+        joined = future is not None
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            try:
+                self.queue.put_nowait((key, prompt, guild_id, priority, future))
+            except asyncio.QueueFull:
+                raise ImageQueueFullError("Too many images are being generated right now")
+            self.inflight[key] = future
+
+        path = await asyncio.shield(future)
+        return path, False, joined
+
+    @asynccontextmanager
+    async def image(self, prompt, guild_id=None, priority=Priority.HIGH):
+        """
+        Get an image like generate, keeping its file out of eviction until the block ends.
+
+        Args:
+            prompt: Image prompt
+            guild_id: Discord guild ID the image is generated for
+            priority: Scheduler lane for the generation call
+
+        Yields:
+            tuple: (path to the image file, True if served from the cache,
+                    True if an identical job was already in flight)
+        """
+        key = self.prompt_key(prompt)
+        self.pinned[key] += 1
+        try:
+            yield await self.generate(prompt, guild_id, priority)
+        finally:
+            self.pinned[key] -= 1
+            if not self.pinned[key]:
+                del self.pinned[key]
+
+    async def get_stats(self):
+        """
+        Get queue statistics.
+
+        Returns:
+            dict: Queue depth, in-flight jobs and cache usage
+        """
+        return {
+            'queued': self.queue.qsize() if self.queue else 0,
+            'inflight': len(self.inflight),
+            'workers': len(self.workers),
+            'cache_bytes': await self.db.get_image_cache_size()
+        }
+
+    async def _worker(self):
+        """Worker task that runs queued jobs one at a time."""
+        while True:
+            key, prompt, guild_id, priority, future = await self.queue.get()
+            try:
+                path = await self._run_job(key, prompt, guild_id, priority)
+                if not future.done():
+                    future.set_result(path)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                self.logger.error(f"Image job failed: {e}", exc_info=True)
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.inflight.pop(key, None)
+                self.queue.task_done()
+
+    async def _run_job(self, key, prompt, guild_id, priority):
+        """Generate, download and cache one image."""
+        client = self.openai_manager.get()
+
+        self.logger.log_api_call("OpenAI Image Generation", {"prompt": prompt})
+
+        async with self.scheduler.slot(guild_id, priority):
+            response = await client.images.generate(
+                model=self.model,
+                prompt=prompt,
+                size=self.size,
+                quality=self.quality,
+                n=1,
+            )
+
+        # The returned URL expires, so keep our own copy
+        download = await self.http_client.get(response.data[0].url)
+        download.raise_for_status()
+        data = download.content
+
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self._content_path(content_hash)
+        if not os.path.exists(path):
+            await asyncio.to_thread(self._write_file, path, data)
+
+        await self.db.store_image_cache_entry(key, content_hash, len(data), time.time())
+
+        # Another prompt's entry for the same image may have been evicted before this one was stored
+        if not os.path.exists(path):
+            await asyncio.to_thread(self._write_file, path, data)
+
+        await self._evict()
+
+        return path
+
+    async def _lookup(self, key):
+        """Get the cached file for a prompt key, if it is still on disk."""
+        entry = await self.db.get_image_cache_entry(key)
+        if entry is None:
+            return None
+
+        path = self._content_path(entry['content_hash'])
+        if not os.path.exists(path):
+            await self.db.delete_image_cache_entry(key)
+            return None
+
+        await self.db.touch_image_cache_entry(key, time.time())
+        return path
+
+    def _content_path(self, content_hash):
+        """Get the on-disk path for a content hash."""
+        return os.path.join(self.cache_dir, content_hash[:2], f"{content_hash}.png")
+
+    @staticmethod
+    def _write_file(path, data):
+        """Atomically write an image file."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def _evict(self):
+        """Delete least recently used images until the cache fits its size limit."""
+        total = await self.db.get_image_cache_size()
+
+        # Entries of images still being sent are kept, later pages are read past them
+        skipped = 0
+        while total > self.max_cache_bytes:
+            entries = await self.db.get_least_recent_image_cache_entries(20, offset=skipped)
+            if not entries:
+                break
+
+            for entry in entries:
+                if entry['prompt_key'] in self.pinned:
+                    skipped += 1
+                    continue
+
+                await self.db.delete_image_cache_entry(entry['prompt_key'])
+
+                # Several prompts can map to the same image, its bytes are freed with the last one
+                if not await self.db.image_content_in_use(entry['content_hash']):
+                    total -= entry['size_bytes']
+                    try:
+                        os.remove(self._content_path(entry['content_hash']))
+                    except FileNotFoundError:
+                        pass
+
+                if total <= self.max_cache_bytes:
+                    break
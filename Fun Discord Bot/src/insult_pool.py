@@ -0,0 +1,208 @@
+"""
+Insult pool module for serving /insult from pre-generated, persona-specific templates.
+"""
+import asyncio
+import re
+from collections import defaultdict, deque
+from scheduler import Priority
+
+# Placeholder replaced with the target's name
+NAME_PLACEHOLDER = "{name}"
+
+INSULT_BATCH_PROMPT = (
+    "Write {count} different humorous, light-hearted insults in your own voice. They should be "
+    "playful, not genuinely mean or offensive, contain no profanity and be appropriate for a "
+    "Discord server. Refer to the target only as {placeholder}. Put each insult on its own line "
+    "with no numbering and nothing else."
+)
+
+class InsultPool:
+    """Per-persona pools of insult templates that are refilled in the background."""
+
+    def __init__(self, openai_manager, scheduler, logger, personas, default_persona,
+                 pool_size=20, low_water=5, batch_size=10, model="gpt-3.5-turbo"):
+        """
+        Initialize the insult pool.
+
+        Args:
+            openai_manager: OpenAIClientManager providing the shared client
+            scheduler: LLMScheduler the refill calls go through
+            logger: BotLogger instance
+            personas: Persona configuration dictionary
+            default_persona: Persona key used for unknown personas
+            pool_size: Number of templates a refill tops each pool up to
+            low_water: Pool size below which a background refill starts
+            batch_size: Number of templates requested per API call
+            model: Model used to generate templates
+        """
+        self.openai_manager = openai_manager
+        self.scheduler = scheduler
+        self.logger = logger
+        self.personas = personas
+        self.default_persona = default_persona
+        self.pool_size = pool_size
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.model = model
+
+        # Structure: {persona_key: deque([template, ...])}
+        self.pools = defaultdict(deque)
+
+        # Structure: {persona_key: refill task}
+        self.refills = {}
+
+        # Structure: {persona_key: asyncio.Event set once someone waits on the refill}
+        self.urgent = {}
+
+    async def get_insult(self, persona_key, target_name):
+        """
+        Get an insult for a target, waiting for a refill only if the pool is empty.
+
+        Args:
+            persona_key: Active persona key
+            target_name: Display name of the target
+
+        Returns:
+            str: Insult text
+        """
+        if persona_key not in self.personas:
+            persona_key = self.default_persona
+
+        pool = self.pools[persona_key]
+        while not pool:
+            # Callers waiting on the same refill may take its templates first, so try again
+            # until one is left or a refill comes back with nothing
+            added = await self.refill(persona_key, Priority.HIGH)
+            if not pool and not added:
+                raise RuntimeError(f"No insult templates generated for persona {persona_key}")
+
+        template = pool.popleft()
+
+        # Top the pool up in the background before it runs dry
+        if len(pool) < self.low_water:
+            self.schedule_refill(persona_key)
+
+        return template.replace(NAME_PLACEHOLDER, target_name)
+
+    def schedule_refill(self, persona_key):
+        """Start a background refill for a persona if one is not already running."""
+        if persona_key in self.refills:
+            return
+        if len(self.pools[persona_key]) >= self.pool_size:
+            return
+        asyncio.get_running_loop().create_task(self.refill(persona_key))
+
+    async def refill(self, persona_key, priority=Priority.LOW):
+        """
+        Refill a persona's pool up to pool_size, joining a refill already in progress.
+
+        Joining with Priority.HIGH moves a background refill ahead of chat traffic.
+
+        Args:
+            persona_key: Persona key to refill
+            priority: Scheduler lane for the refill calls (LOW or HIGH)
+
+        Returns:
+            int: Number of templates the refill added
+        """
+        task = self.refills.get(persona_key)
+        if task is None:
+            self.urgent[persona_key] = asyncio.Event()
+            task = asyncio.get_running_loop().create_task(self._refill(persona_key))
+            self.refills[persona_key] = task
+            task.add_done_callback(lambda _: self.refills.pop(persona_key, None))
+
+        if priority == Priority.HIGH:
+            self.urgent[persona_key].set()
+
+        return await asyncio.shield(task)
+
+    async def _refill(self, persona_key):
+        """Generate batches of templates until the pool is full."""
+        pool = self.pools[persona_key]
+        added = 0
+        try:
+            while len(pool) < self.pool_size:
+                templates = await self._generate_batch(persona_key)
+                if not templates:
+                    break
+                templates = templates[:self.pool_size - len(pool)]
+                pool.extend(templates)
+                added += len(templates)
+
+            self.logger.debug(f"Insult pool for {persona_key} refilled to {len(pool)} templates")
+        except Exception as e:
+            # Callers waiting on an empty pool see the failure as an empty pool
+            self.logger.error(f"Error refilling insult pool for {persona_key}: {e}", exc_info=True)
+        return added
+
+    async def _acquire_slot(self, persona_key):
+        """
+        Wait for a scheduler slot in the LOW lane, moving to the HIGH lane once a caller
+        is waiting on the refill.
+
+        Returns:
+            Priority: Lane the slot was granted in
+        """
+        urgent = self.urgent[persona_key]
+        if urgent.is_set():
+            await self.scheduler.acquire(None, Priority.HIGH)
+            return Priority.HIGH
+
+        acquire = asyncio.ensure_future(self.scheduler.acquire(None, Priority.LOW))
+        promote = asyncio.ensure_future(urgent.wait())
+        try:
+            await asyncio.wait({acquire, promote}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            promote.cancel()
+            if not acquire.done():
+                # The scheduler hands back a slot granted while the ticket is cancelled
+                acquire.cancel()
+
+        try:
+            await acquire
+            return Priority.LOW
+        except asyncio.CancelledError:
+            pass
+
+        await self.scheduler.acquire(None, Priority.HIGH)
+        return Priority.HIGH
+
+    async def _generate_batch(self, persona_key):
+        """Generate one batch of insult templates in the persona's voice."""
+        client = self.openai_manager.get()
+        system_prompt = self.personas[persona_key]["system_prompt"]
+
+        priority = await self._acquire_slot(persona_key)
+        try:
+            self.logger.log_api_call("OpenAI Chat Completion", {
+                "purpose": "insult pool refill",
+                "persona": persona_key,
+                "priority": priority.name.lower(),
+                "count": self.batch_size
+            })
+
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": INSULT_BATCH_PROMPT.format(count=self.batch_size, placeholder=NAME_PLACEHOLDER)}
+                ],
+                max_tokens=60 * self.batch_size,
+                temperature=0.9
+            )
+        finally:
+            self.scheduler.release()
+
+        return self._parse_templates(response.choices[0].message.content)
+
+    @staticmethod
+    def _parse_templates(text):
+        """Split a completion into templates that contain the name placeholder."""
+        templates = []
+        for line in (text or "").splitlines():
+            # Drop list markers the model may add anyway
+            line = re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', line).strip().strip('"')
+            if NAME_PLACEHOLDER in line:
+                templates.append(line)
+        return templates
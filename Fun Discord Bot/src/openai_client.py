@@ -0,0 +1,69 @@
+"""
+OpenAI client module for sharing one pooled async client across the bot.
+"""
+import httpx
+import openai
+
+class OpenAIClientManager:
+    """Owns the long-lived AsyncOpenAI client and its pooled HTTP transport."""
+
+    def __init__(self, api_key, max_connections=20, max_keepalive_connections=10, timeout=60.0, base_url=None):
+        """
+        Initialize the client manager.
+
+        Args:
+            api_key: OpenAI API key
+            max_connections: Maximum number of concurrent HTTP connections
+            max_keepalive_connections: Maximum number of idle connections kept open
+            timeout: Request timeout in seconds
+            base_url: Alternative API base URL, e.g. a local stand-in server (optional)
+        """
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.timeout = timeout
+        self.base_url = base_url
+        self.client = None
+
+    def start(self):
+        """
+        Create the shared client. Must be called from within the running event loop.
+
+        Returns:
+            openai.AsyncOpenAI: The shared client
+        """
+        if self.client is not None:
+            return self.client
+
+        # One pooled transport reused by every request
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections
+            ),
+            timeout=self.timeout
+        )
+
+        self.client = openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=http_client
+        )
+        return self.client
+
+    def get(self):
+        """
+        Get the shared client, creating it if needed.
+
+        Returns:
+            openai.AsyncOpenAI: The shared client
+        """
+        if self.client is None:
+            return self.start()
+        return self.client
+
+    async def close(self):
+        """Close the shared client and its connection pool."""
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
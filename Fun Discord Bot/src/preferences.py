@@ -0,0 +1,119 @@
+"""
+Preferences module for cached access to per-user settings.
+"""
+from collections import OrderedDict
+
+class UserPreferenceCache:
+    """
+    Read-through LRU cache over the user_preferences table.
+
+    Each (guild, user) pair is loaded with one query and kept until it is evicted or
+    one of its preferences is written, which drops the cached copy.
+    """
+
+    def __init__(self, db, max_entries=10000):
+        """
+        Initialize the preference cache.
+
+        Args:
+            db: AsyncDatabase instance
+            max_entries: Maximum number of (guild, user) pairs kept in memory
+        """
+        self.db = db
+        self.max_entries = max_entries
+
+        # Structure: {(guild_id, user_id): {key: value}}
+        self.entries = OrderedDict()
+
+        # Structure: {(guild_id, user_id): write count}, so loads that raced a write aren't cached
+        self.versions = {}
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, guild_id, user_id, key, default=None):
+        """
+        Get one preference for a user.
+
+        Args:
+            guild_id: Discord guild ID
+            user_id: Discord user ID
+            key: Preference name
+            default: Value returned if the preference is not set
+
+        Returns:
+            The preference value, or default
+        """
+        preferences = await self.get_all(guild_id, user_id)
+        return preferences.get(key, default)
+
+    async def get_all(self, guild_id, user_id):
+        """
+        Get all preferences for a user.
+
+        Args:
+            guild_id: Discord guild ID
+            user_id: Discord user ID
+
+        Returns:
+            dict: Preference values by name
+        """
+        cache_key = (guild_id, user_id)
+
+        preferences = self.entries.get(cache_key)
+        if preferences is not None:
+            self.entries.move_to_end(cache_key)
+            self.hits += 1
+            return preferences
+
+        self.misses += 1
+        version = self.versions.get(cache_key, 0)
+        preferences = await self.db.get_user_preferences(guild_id, user_id)
+
+        # A write landed while we were reading, the next read will load it
+        if self.versions.get(cache_key, 0) != version:
+            return preferences
+
+        self.entries[cache_key] = preferences
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            self.versions.pop(evicted, None)
+
+        return preferences
+
+    async def set(self, guild_id, user_id, key, value):
+        """
+        Set one preference for a user and drop the cached copy.
+
+        Args:
+            guild_id: Discord guild ID
+            user_id: Discord user ID
+            key: Preference name
+            value: JSON-serializable preference value
+
+        Returns:
+            bool: True once the preference is stored
+        """
+        cache_key = (guild_id, user_id)
+        self.versions[cache_key] = self.versions.get(cache_key, 0) + 1
+        self.entries.pop(cache_key, None)
+
+        await self.db.set_user_preference(guild_id, user_id, key, value)
+
+        # Drop anything loaded while the write was in flight
+        self.entries.pop(cache_key, None)
+        return True
+
+    def get_stats(self):
+        """
+        Get cache statistics.
+
+        Returns:
+            dict: Entry count and hit/miss counters
+        """
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -4,8 +4,10 @@ Rate limiting and logging module for the Discord bot.
 import time
 import logging
 import os
+import sys
+import threading
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from enum import Enum
 
 # Ensure data directory exists
@@ -30,14 +32,56 @@ class RateLimitType(Enum):
     COMMAND = "command"
     IMAGE = "image"
     INSULT = "insult"
+    TOKENS = "tokens"
+
+# How each tier is named in logs and in limit_info
+SCOPES = {
+    'user': ("Rate limit exceeded for user {key}", ""),
+    'channel': ("Channel rate limit exceeded for channel {key}", " (channel-wide)"),
+    'server': ("Server rate limit exceeded for guild {key}", " (server-wide)"),
+    'global': ("Global rate limit exceeded", " (bot-wide)"),
+}
 
 class RateLimiter:
-    """Rate limiter class to prevent API abuse."""
+    """
+    Rate limiter class to prevent API abuse.
+    
+    Uses the generic cell rate algorithm (GCRA): each user, channel and server keeps
+    one theoretical arrival time (TAT) per limit type instead of a list of timestamps,
+    and the global tier keeps one per limit type. A limit of N requests per window
+    spaces requests by window / N seconds and allows bursts of up to N, so every check
+    and record is O(1) whatever the limit size.
+    
+    Slash commands can also have their own limits per user, channel, server or across
+    the bot, checked in the same pass as the limits of their type.
+    
+    Requests can carry a cost, so a limit of N per window becomes a budget of N units,
+    e.g. OpenAI tokens for TOKENS. A key with nothing outstanding may overdraw its
+    budget with one expensive request and then waits until it is paid back. Command
+    limits always count invocations.
+    
+    try_acquire() checks and records every tier at once, so concurrent handlers can't
+    all pass the check before any of them is counted.
+    
+    A key whose TAT has passed is indistinguishable from one never seen, so sweep()
+    drops those keys without changing any decision. Each limit type also tracks at
+    most max_keys keys per tier, evicting the least recently recorded.
+    """
+    
+    # Slack for float rounding when a burst exactly fills a limit
+    EPSILON = 1e-9
     
-    def __init__(self):
-        """Initialize the rate limiter."""
-        # Structure: {rate_limit_type: {user_id: [timestamp1, timestamp2, ...]}}
-        self.user_requests = defaultdict(lambda: defaultdict(list))
+    def __init__(self, max_keys=100000):
+        """
+        Initialize the rate limiter.
+        
+        Args:
+            max_keys: Most users, channels and servers tracked per limit type
+        """
+        self.max_keys = max_keys
+        
+        # Structure: {rate_limit_type: OrderedDict({user_id: theoretical arrival time})}, least recent first
+        self.user_tats = defaultdict(OrderedDict)
         
         # Default rate limits
         self.rate_limits = {
@@ -45,23 +89,140 @@ class RateLimiter:
             RateLimitType.COMMAND: (5, 60),   # 5 commands per 60 seconds
             RateLimitType.IMAGE: (3, 300),    # 3 image generations per 300 seconds (5 minutes)
             RateLimitType.INSULT: (2, 300),   # 2 insults per 300 seconds (5 minutes)
+            RateLimitType.TOKENS: (20000, 3600),  # 20000 prompt and completion tokens per hour
+        }
+        
+        # Channel-wide rate limits, same structure keyed by channel_id
+        self.channel_tats = defaultdict(OrderedDict)
+        self.channel_rate_limits = {
+            RateLimitType.MESSAGE: (20, 60),  # 20 messages per 60 seconds per channel
         }
         
         # Server-wide rate limits
-        self.server_requests = defaultdict(list)
+        # Structure: {rate_limit_type: OrderedDict({guild_id: theoretical arrival time})}, least recent first
+        self.server_tats = defaultdict(OrderedDict)
         self.server_rate_limits = {
             RateLimitType.MESSAGE: (30, 60),  # 30 messages per 60 seconds per server
             RateLimitType.IMAGE: (10, 600),   # 10 images per 600 seconds (10 minutes) per server
+            RateLimitType.TOKENS: (200000, 3600),  # 200000 tokens per hour per server
+        }
+        
+        # Bot-wide rate limits, same structure with a single None key
+        self.global_tats = defaultdict(OrderedDict)
+        self.global_rate_limits = {
+            RateLimitType.MESSAGE: (600, 60),  # 600 messages per 60 seconds across all servers
+            RateLimitType.IMAGE: (50, 600),    # 50 images per 600 seconds (10 minutes) across all servers
         }
         
+        # Per-command limits on top of the type limits, by scope
+        # Structure: {command_name: {scope: (max_requests, window_seconds)}}
+        self.command_rate_limits = {
+            'generate_image': {'global': (5, 60)},  # 5 image commands per 60 seconds across all servers
+            'insult': {'server': (3, 60)},          # 3 insults per 60 seconds per server
+        }
+        
+        # Structure: {(command_name, scope): OrderedDict({key: theoretical arrival time})}, least recent first
+        self.command_tats = defaultdict(OrderedDict)
+        
+        # Keys removed since startup
+        self.swept_keys = 0
+        self.evicted_keys = 0
+        
+        # Makes try_acquire and refund atomic across threads as well as coroutines
+        self.lock = threading.Lock()
+        
         logger.info("Rate limiter initialized with default limits")
     
-    def _clean_old_timestamps(self, timestamps, window_seconds):
-        """Remove timestamps older than the window."""
-        cutoff_time = time.time() - window_seconds
-        return [ts for ts in timestamps if ts > cutoff_time]
+    def _tiers(self, rate_limit_type, user_id, guild_id=None, channel_id=None, command=None):
+        """
+        Get the limits that apply to a request.
+        
+        Returns:
+            list: (scope, tats, key, max_requests, window_seconds, command) tuples
+        """
+        tiers = [('user', self.user_tats[rate_limit_type], user_id, *self.rate_limits[rate_limit_type], None)]
+        if channel_id and rate_limit_type in self.channel_rate_limits:
+            tiers.append(('channel', self.channel_tats[rate_limit_type], channel_id,
+                          *self.channel_rate_limits[rate_limit_type], None))
+        if guild_id and rate_limit_type in self.server_rate_limits:
+            tiers.append(('server', self.server_tats[rate_limit_type], guild_id,
+                          *self.server_rate_limits[rate_limit_type], None))
+        if rate_limit_type in self.global_rate_limits:
+            tiers.append(('global', self.global_tats[rate_limit_type], None,
+                          *self.global_rate_limits[rate_limit_type], None))
+        
+        if command in self.command_rate_limits:
+            keys = {'user': user_id, 'channel': channel_id, 'server': guild_id, 'global': None}
+            for scope, (max_requests, window_seconds) in self.command_rate_limits[command].items():
+                if scope in ('channel', 'server') and not keys[scope]:
+                    continue
+                tiers.append((scope, self.command_tats[(command, scope)], keys[scope],
+                              max_requests, window_seconds, command))
+        return tiers
+    
+    def _wait_time(self, tat, max_requests, window_seconds, now, cost=1):
+        """
+        Get how long until one more request fits under a limit.
+        
+        Args:
+            tat: Stored theoretical arrival time, or None for an unseen key
+            max_requests: Maximum number of requests allowed
+            window_seconds: Time window in seconds
+            now: Current time
+            cost: Units the request uses
+            
+        Returns:
+            float: Seconds to wait, 0 if a request is allowed now
+        """
+        if tat is None or tat <= now:
+            return 0
+        
+        # Allowed while the TAT is at most window - cost intervals ahead of now
+        interval = window_seconds / max_requests
+        wait_time = tat - now - (window_seconds - cost * interval)
+        return wait_time if wait_time > self.EPSILON else 0
+    
+    def _check(self, rate_limit_type, tiers, now, cost=1):
+        """
+        Check every tier in one pass and log the one that limits longest.
+        
+        Returns:
+            tuple: (is_limited, wait_time, limit_info)
+        """
+        limiting = None
+        longest = 0
+        for tier in tiers:
+            _, tats, key, max_requests, window_seconds, command = tier
+            wait_time = self._wait_time(tats.get(key), max_requests, window_seconds, now, 1 if command else cost)
+            if wait_time > longest:
+                limiting, longest = tier, wait_time
+        
+        if limiting is None:
+            return False, 0, None
+        
+        scope, _, key, max_requests, window_seconds, command = limiting
+        message, suffix = SCOPES[scope]
+        target = f"/{command}" if command else rate_limit_type.value
+        logger.warning(
+            f"{message.format(key=key)} on {target}. "
+            f"Limit: {max_requests} per {window_seconds}s. "
+            f"Wait time: {longest:.1f}s"
+        )
+        
+        if command:
+            suffix = f" for /{command}{suffix}"
+        return True, longest, f"{max_requests} per {window_seconds}s{suffix}"
+    
+    def _record(self, tats, key, amount, now):
+        """Advance a key's TAT by amount seconds and evict the least recent keys over max_keys."""
+        tats[key] = max(tats.get(key, now), now) + amount
+        tats.move_to_end(key)
+        
+        while len(tats) > self.max_keys:
+            tats.popitem(last=False)
+            self.evicted_keys += 1
     
-    def is_rate_limited(self, rate_limit_type, user_id, guild_id=None):
+    def is_rate_limited(self, rate_limit_type, user_id, guild_id=None, channel_id=None, command=None, cost=1):
         """
         Check if a user is rate limited for a specific action.
         
@@ -69,79 +230,95 @@ class RateLimiter:
             rate_limit_type: Type of rate limit to check
             user_id: Discord user ID
             guild_id: Discord guild ID (optional, for server-wide limits)
+            channel_id: Discord channel ID (optional, for channel-wide limits)
+            command: Slash command name (optional, for per-command limits)
+            cost: Units the request uses against each type limit (default 1)
             
         Returns:
             tuple: (is_limited, wait_time, limit_info)
         """
-        # Get rate limit configuration
-        max_requests, window_seconds = self.rate_limits[rate_limit_type]
+        with self.lock:
+            return self._check(
+                rate_limit_type, self._tiers(rate_limit_type, user_id, guild_id, channel_id, command), time.time(), cost
+            )
+    
+    def add_request(self, rate_limit_type, user_id, guild_id=None, channel_id=None, command=None, cost=1):
+        """
+        Record a request for rate limiting purposes.
         
-        # Clean old timestamps for user
-        self.user_requests[rate_limit_type][user_id] = self._clean_old_timestamps(
-            self.user_requests[rate_limit_type][user_id], window_seconds
-        )
+        Also charges costs only known after the fact, such as completion tokens, without
+        checking the limits first.
         
-        # Check user rate limit
-        user_timestamps = self.user_requests[rate_limit_type][user_id]
-        if len(user_timestamps) >= max_requests:
-            oldest_timestamp = min(user_timestamps)
-            reset_time = oldest_timestamp + window_seconds
-            wait_time = reset_time - time.time()
-            
-            logger.warning(
-                f"Rate limit exceeded for user {user_id} on {rate_limit_type.value}. "
-                f"Limit: {max_requests} per {window_seconds}s. "
-                f"Wait time: {wait_time:.1f}s"
-            )
+        Args:
+            rate_limit_type: Type of rate limit
+            user_id: Discord user ID
+            guild_id: Discord guild ID (optional, for server-wide limits)
+            channel_id: Discord channel ID (optional, for channel-wide limits)
+            command: Slash command name (optional, for per-command limits)
+            cost: Units the request uses against each type limit (default 1)
+        """
+        with self.lock:
+            now = time.time()
             
-            return True, wait_time, f"{max_requests} per {window_seconds}s"
+            # Push each tier's TAT back by one interval per unit of cost
+            tiers = self._tiers(rate_limit_type, user_id, guild_id, channel_id, command)
+            for _, tats, key, max_requests, window_seconds, tier_command in tiers:
+                self._record(tats, key, window_seconds / max_requests * (1 if tier_command else cost), now)
         
-        # Check server-wide rate limit if guild_id is provided
-        if guild_id and rate_limit_type in self.server_rate_limits:
-            server_max, server_window = self.server_rate_limits[rate_limit_type]
+        logger.debug(
+            f"Request recorded: type={rate_limit_type.value}, user={user_id}, "
+            f"guild={guild_id if guild_id else 'N/A'}, cost={cost}"
+        )
+    
+    def try_acquire(self, rate_limit_type, user_id, guild_id=None, channel_id=None, command=None, cost=1):
+        """
+        Check every tier and record the request only if all of them allow it.
+        
+        Args:
+            rate_limit_type: Type of rate limit
+            user_id: Discord user ID
+            guild_id: Discord guild ID (optional, for server-wide limits)
+            channel_id: Discord channel ID (optional, for channel-wide limits)
+            command: Slash command name (optional, for per-command limits)
+            cost: Units the request uses against each type limit (default 1)
             
-            # Clean old timestamps for server
-            self.server_requests[f"{rate_limit_type.value}_{guild_id}"] = self._clean_old_timestamps(
-                self.server_requests[f"{rate_limit_type.value}_{guild_id}"], server_window
-            )
+        Returns:
+            tuple: (is_limited, wait_time, limit_info), the request is recorded when is_limited is False
+        """
+        with self.lock:
+            now = time.time()
+            tiers = self._tiers(rate_limit_type, user_id, guild_id, channel_id, command)
+            
+            result = self._check(rate_limit_type, tiers, now, cost)
+            if result[0]:
+                return result
             
-            server_timestamps = self.server_requests[f"{rate_limit_type.value}_{guild_id}"]
-            if len(server_timestamps) >= server_max:
-                oldest_timestamp = min(server_timestamps)
-                reset_time = oldest_timestamp + server_window
-                wait_time = reset_time - time.time()
-                
-                logger.warning(
-                    f"Server rate limit exceeded for guild {guild_id} on {rate_limit_type.value}. "
-                    f"Limit: {server_max} per {server_window}s. "
-                    f"Wait time: {wait_time:.1f}s"
-                )
-                
-                return True, wait_time, f"{server_max} per {server_window}s (server-wide)"
-        
-        return False, 0, None
+            for _, tats, key, max_requests, window_seconds, tier_command in tiers:
+                self._record(tats, key, window_seconds / max_requests * (1 if tier_command else cost), now)
+            return result
     
-    def add_request(self, rate_limit_type, user_id, guild_id=None):
+    def refund(self, rate_limit_type, user_id, guild_id=None, channel_id=None, command=None, cost=1):
         """
-        Record a request for rate limiting purposes.
+        Give back a request recorded by try_acquire, e.g. when the API call failed.
         
         Args:
             rate_limit_type: Type of rate limit
             user_id: Discord user ID
             guild_id: Discord guild ID (optional, for server-wide limits)
+            channel_id: Discord channel ID (optional, for channel-wide limits)
+            command: Slash command name (optional, for per-command limits)
+            cost: Units the request uses against each type limit (default 1)
         """
-        current_time = time.time()
-        
-        # Add timestamp for user
-        self.user_requests[rate_limit_type][user_id].append(current_time)
-        
-        # Add timestamp for server if guild_id is provided
-        if guild_id:
-            self.server_requests[f"{rate_limit_type.value}_{guild_id}"].append(current_time)
+        with self.lock:
+            tiers = self._tiers(rate_limit_type, user_id, guild_id, channel_id, command)
+            for _, tats, key, max_requests, window_seconds, tier_command in tiers:
+                tat = tats.get(key)
+                if tat is not None:
+                    tats[key] = tat - window_seconds / max_requests * (1 if tier_command else cost)
         
         logger.debug(
-            f"Request recorded: type={rate_limit_type.value}, user={user_id}, "
-            f"guild={guild_id if guild_id else 'N/A'}"
+            f"Request refunded: type={rate_limit_type.value}, user={user_id}, "
+            f"guild={guild_id if guild_id else 'N/A'}, cost={cost}"
         )
     
     def get_remaining_requests(self, rate_limit_type, user_id):
@@ -156,39 +333,105 @@ class RateLimiter:
             tuple: (remaining_requests, reset_time)
         """
         max_requests, window_seconds = self.rate_limits[rate_limit_type]
+        now = time.time()
         
-        # Clean old timestamps
-        self.user_requests[rate_limit_type][user_id] = self._clean_old_timestamps(
-            self.user_requests[rate_limit_type][user_id], window_seconds
-        )
+        tat = self.user_tats[rate_limit_type].get(user_id)
+        if tat is None or tat <= now:
+            return max_requests, now + window_seconds
         
-        # Calculate remaining requests
-        current_requests = len(self.user_requests[rate_limit_type][user_id])
-        remaining = max(0, max_requests - current_requests)
+        # Each request still counted holds one interval of the window
+        interval = window_seconds / max_requests
+        remaining = int((window_seconds - (tat - now)) / interval + self.EPSILON)
         
-        # Calculate reset time
-        if current_requests > 0:
-            oldest_timestamp = min(self.user_requests[rate_limit_type][user_id])
-            reset_time = oldest_timestamp + window_seconds
-        else:
-            reset_time = time.time() + window_seconds
+        # The full limit is available again once the TAT has passed
+        return max(0, remaining), tat
+    
+    def sweep(self):
+        """
+        Drop keys whose TAT has passed.
         
-        return remaining, reset_time
+        Returns:
+            int: Number of keys removed
+        """
+        now = time.time()
+        removed = 0
+        with self.lock:
+            for tiers in (self.user_tats, self.channel_tats, self.server_tats, self.global_tats, self.command_tats):
+                for tats in tiers.values():
+                    expired = [key for key, tat in tats.items() if tat <= now]
+                    for key in expired:
+                        del tats[key]
+                    removed += len(expired)
+        
+        self.swept_keys += removed
+        return removed
     
-    def update_rate_limit(self, rate_limit_type, max_requests, window_seconds):
+    def get_stats(self):
+        """
+        Get gauges for the tracked limiter state.
+        
+        Returns:
+            dict: Tracked user, channel, server and command keys, approximate state size in bytes and keys removed
+        """
+        all_tiers = (self.user_tats, self.channel_tats, self.server_tats, self.global_tats, self.command_tats)
+        memory_bytes = sum(sys.getsizeof(tiers) for tiers in all_tiers)
+        for tiers in all_tiers:
+            for tats in tiers.values():
+                memory_bytes += sys.getsizeof(tats)
+                memory_bytes += sum(sys.getsizeof(key) + sys.getsizeof(tat) for key, tat in tats.items())
+        
+        return {
+            'user_keys': sum(len(tats) for tats in self.user_tats.values()),
+            'channel_keys': sum(len(tats) for tats in self.channel_tats.values()),
+            'server_keys': sum(len(tats) for tats in self.server_tats.values()),
+            'command_keys': sum(len(tats) for tats in self.command_tats.values()),
+            'memory_bytes': memory_bytes,
+            'swept_keys': self.swept_keys,
+            'evicted_keys': self.evicted_keys
+        }
+    
+    def update_rate_limit(self, rate_limit_type, max_requests, window_seconds, scope='user', command=None):
         """
         Update a rate limit configuration.
         
         Args:
-            rate_limit_type: Type of rate limit to update
-            max_requests: Maximum number of requests allowed
+            rate_limit_type: Type of rate limit to update (ignored for command limits)
+            max_requests: Maximum number of requests allowed, None removes a channel, server, global or command limit
             window_seconds: Time window in seconds
+            scope: "user", "channel", "server" or "global"
+            command: Slash command name, to update that command's limit instead of the type's
         """
-        self.rate_limits[rate_limit_type] = (max_requests, window_seconds)
-        logger.info(
-            f"Rate limit updated for {rate_limit_type.value}: "
-            f"{max_requests} requests per {window_seconds} seconds"
-        )
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown rate limit scope: {scope}")
+        if max_requests is None and scope == 'user' and command is None:
+            raise ValueError("Every rate limit type needs a per-user limit")
+        
+        if command is not None:
+            limits = self.command_rate_limits.setdefault(command, {})
+            key, name = scope, f"/{command}"
+        else:
+            limits = {
+                'user': self.rate_limits,
+                'channel': self.channel_rate_limits,
+                'server': self.server_rate_limits,
+                'global': self.global_rate_limits,
+            }[scope]
+            key, name = rate_limit_type, rate_limit_type.value
+        
+        # Limits are read on every check, so the change applies from the next request
+        with self.lock:
+            if max_requests is None:
+                limits.pop(key, None)
+            else:
+                limits[key] = (max_requests, window_seconds)
+        
+        if max_requests is None:
+            logger.info(f"Rate limit removed for {name} ({scope})")
+        else:
+            logger.info(
+                f"Rate limit updated for {name} ({scope}): "
+                f"{max_requests} requests per {window_seconds} seconds"
+            )
 
 # Create a global rate limiter instance
 rate_limiter = RateLimiter()
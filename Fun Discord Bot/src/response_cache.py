@@ -0,0 +1,163 @@
+"""
+Response cache module for reusing replies to repeated prompts.
+"""
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+
+class ResponseCache:
+    """
+    LRU cache of chat responses keyed on persona, prompt and recent context.
+
+    Entries expire after a TTL and the cache is bounded by the total size of the
+    stored responses. An optional AsyncDatabase tier keeps entries across restarts.
+    """
+
+    def __init__(self, max_bytes=1048576, ttl_seconds=3600, history_window=2, db=None):
+        """
+        Initialize the response cache.
+
+        Args:
+            max_bytes: Maximum total size of cached keys and responses in bytes
+            ttl_seconds: Seconds an entry stays valid
+            history_window: Number of most recent history messages included in the key
+            db: AsyncDatabase used as a persistent second tier (optional)
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.history_window = history_window
+        self.db = db
+
+        # Structure: {cache_key: (response, expires_at, size)}
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+
+        # Counters
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize_prompt(prompt):
+        """Normalize a prompt so trivial variations share a cache entry."""
+        prompt = re.sub(r'\s+', ' ', prompt.strip().lower())
+        return prompt.rstrip('.!?')
+
+    def make_key(self, persona_key, prompt, message_history):
+        """
+        Build the cache key for a request.
+
+        Args:
+            persona_key: Active persona key
+            prompt: User prompt
+            message_history: History messages sent as context
+
+        Returns:
+            str: Cache key
+        """
+        window = message_history[-self.history_window:] if self.history_window > 0 and message_history else []
+        context = json.dumps(
+            [[m.get('role'), m.get('name'), m.get('content')] for m in window],
+            ensure_ascii=False
+        )
+        context_hash = hashlib.sha256(context.encode('utf-8')).hexdigest()
+
+        raw = f"{persona_key}\x00{self.normalize_prompt(prompt)}\x00{context_hash}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def get(self, key):
+        """
+        Get a cached response.
+
+        Args:
+            key: Cache key from make_key
+
+        Returns:
+            str: Cached response, or None on a miss
+        """
+        now = time.time()
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            response, expires_at, _ = entry
+            if expires_at > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return response
+            self._remove(key)
+
+        # Fall back to the persistent tier
+        if self.db is not None:
+            row = await self.db.get_cached_response(key, now)
+            if row is not None:
+                response, expires_at = row
+                self._insert(key, response, expires_at)
+                self.hits += 1
+                self.db_hits += 1
+                return response
+
+        self.misses += 1
+        return None
+
+    async def set(self, key, response):
+        """
+        Store a response.
+
+        Args:
+            key: Cache key from make_key
+            response: Full response text
+        """
+        expires_at = time.time() + self.ttl_seconds
+        self._insert(key, response, expires_at)
+
+        if self.db is not None:
+            await self.db.store_cached_response(key, response, expires_at)
+
+    def clear(self):
+        """Remove all in-memory entries."""
+        self.entries.clear()
+        self.current_bytes = 0
+
+    def get_stats(self):
+        """
+        Get cache statistics.
+
+        Returns:
+            dict: Entry count, size and hit/miss counters
+        """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def _insert(self, key, response, expires_at):
+        """Insert an entry and evict least recently used entries over the size cap."""
+        size = len(key) + len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = (response, expires_at, size)
+        self.current_bytes += size
+
+        while self.current_bytes > self.max_bytes:
+            oldest_key = next(iter(self.entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        """Remove an entry from memory."""
+        _, _, size = self.entries.pop(key)
+        self.current_bytes -= size
@@ -0,0 +1,165 @@
+"""
+Retention module for pruning stored chat messages.
+"""
+import asyncio
+import time
+
+class MessagePruner:
+    """
+    Background pruner enforcing message retention limits.
+
+    Candidate rows are found on read connections and deleted by ID in small batches,
+    so each delete holds the write lock only briefly. Freed pages are then returned
+    to the file system with an incremental vacuum.
+    """
+
+    def __init__(self, db, logger, max_age_days=0, max_rows_per_channel=0, max_bytes_per_guild=0,
+                 batch_size=500, interval=3600, vacuum_pages=2000, batch_pause=0.05):
+        """
+        Initialize the pruner.
+
+        Args:
+            db: AsyncDatabase instance
+            logger: BotLogger instance
+            max_age_days: Delete messages older than this many days (0 disables)
+            max_rows_per_channel: Keep at most this many messages per channel (0 disables)
+            max_bytes_per_guild: Keep at most this many bytes of message text per guild (0 disables)
+            batch_size: Maximum number of rows deleted per transaction
+            interval: Seconds between pruning passes
+            vacuum_pages: Maximum number of free pages released per pass
+            batch_pause: Seconds to wait between delete batches
+        """
+        self.db = db
+        self.logger = logger
+        self.max_age_days = max_age_days
+        self.max_rows_per_channel = max_rows_per_channel
+        self.max_bytes_per_guild = max_bytes_per_guild
+        self.batch_size = batch_size
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self.batch_pause = batch_pause
+
+        # Totals across all passes
+        self.total_rows = 0
+        self.total_bytes = 0
+        self.total_reclaimed = 0
+
+    async def run(self):
+        """Background task that runs a pruning pass every interval."""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.prune()
+                except Exception as e:
+                    self.logger.error(f"Error pruning messages: {e}", exc_info=True)
+        except asyncio.CancelledError:
+            pass
+
+    async def prune(self):
+        """
+        Run one pruning pass over all retention limits.
+
+        Returns:
+            dict: Rows and bytes deleted per limit and bytes returned to the file system
+        """
+        result = {
+            'age_rows': 0,
+            'channel_rows': 0,
+            'guild_rows': 0,
+            'message_bytes': 0,
+            'reclaimed_bytes': 0
+        }
+
+        if self.max_age_days > 0:
+            result['age_rows'] = await self._prune_by_age(result)
+        if self.max_rows_per_channel > 0:
+            result['channel_rows'] = await self._prune_channels(result)
+        if self.max_bytes_per_guild > 0:
+            result['guild_rows'] = await self._prune_guilds(result)
+
+        rows = result['age_rows'] + result['channel_rows'] + result['guild_rows']
+        if rows:
+            result['reclaimed_bytes'] = await self.db.incremental_vacuum(self.vacuum_pages)
+
+            self.total_rows += rows
+            self.total_bytes += result['message_bytes']
+            self.total_reclaimed += result['reclaimed_bytes']
+            self.logger.info(
+                f"Pruned {rows} messages ({result['age_rows']} by age, {result['channel_rows']} by channel size, "
+                f"{result['guild_rows']} by guild size), {result['message_bytes']} bytes of text, "
+                f"reclaimed {result['reclaimed_bytes']} bytes on disk"
+            )
+
+        return result
+
+    async def _delete(self, message_ids, result):
+        """Delete one batch and pause so queued writes can run."""
+        rows, size_bytes = await self.db.delete_messages(message_ids)
+        result['message_bytes'] += size_bytes
+        if self.batch_pause:
+            await asyncio.sleep(self.batch_pause)
+        return rows
+
+    async def _prune_by_age(self, result):
+        """Delete messages older than max_age_days."""
+        cutoff = int((time.time() - self.max_age_days * 86400) * 1000)
+        deleted = 0
+        while True:
+            message_ids = await self.db.get_expired_message_ids(cutoff, self.batch_size)
+            if not message_ids:
+                break
+            deleted += await self._delete(message_ids, result)
+            if len(message_ids) < self.batch_size:
+                break
+        return deleted
+
+    async def _prune_channels(self, result):
+        """Delete the oldest messages of channels above max_rows_per_channel."""
+        deleted = 0
+        for channel in await self.db.get_channels_over_row_limit(self.max_rows_per_channel):
+            excess = channel['message_count'] - self.max_rows_per_channel
+            while excess > 0:
+                messages = await self.db.get_oldest_messages(
+                    channel['guild_id'], min(excess, self.batch_size), channel_id=channel['channel_id']
+                )
+                if not messages:
+                    break
+                rows = await self._delete([message['id'] for message in messages], result)
+                deleted += rows
+                excess -= len(messages)
+        return deleted
+
+    async def _prune_guilds(self, result):
+        """Delete the oldest messages of guilds above max_bytes_per_guild."""
+        deleted = 0
+        for guild in await self.db.get_guilds_over_byte_limit(self.max_bytes_per_guild):
+            excess = guild['size_bytes'] - self.max_bytes_per_guild
+            while excess > 0:
+                messages = await self.db.get_oldest_messages(guild['guild_id'], self.batch_size)
+                if not messages:
+                    break
+
+                # Only take as many of the oldest messages as it takes to get under the limit
+                batch = []
+                for message in messages:
+                    batch.append(message['id'])
+                    excess -= message['size_bytes']
+                    if excess <= 0:
+                        break
+
+                deleted += await self._delete(batch, result)
+        return deleted
+
+    def get_stats(self):
+        """
+        Get pruning totals.
+
+        Returns:
+            dict: Rows, message bytes and disk bytes removed since startup
+        """
+        return {
+            'rows': self.total_rows,
+            'message_bytes': self.total_bytes,
+            'reclaimed_bytes': self.total_reclaimed
+        }
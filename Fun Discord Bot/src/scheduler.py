@@ -0,0 +1,244 @@
+"""
+Scheduling module for sharing outbound OpenAI capacity fairly between guilds.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+class Priority(IntEnum):
+    """Enum for scheduler priority lanes (lower values are served first)."""
+    HIGH = 0    # Moderator and admin commands
+    NORMAL = 1  # Regular chat replies
+    LOW = 2     # Background work
+
+class _Ticket:
+    """A queued request waiting for a scheduler slot."""
+
+    __slots__ = ("guild_id", "cost", "future", "enqueued_at")
+
+    def __init__(self, guild_id, cost, future):
+        self.guild_id = guild_id
+        self.cost = cost
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+class LLMScheduler:
+    """
+    Global scheduler for outbound LLM calls.
+
+    At most max_concurrency calls run at once. Waiting calls are grouped into
+    priority lanes, and inside each lane guilds are served with deficit round-robin
+    so one busy guild cannot starve the others. A lane whose oldest call has waited
+    longer than max_wait is served ahead of higher lanes, so steady high priority
+    traffic cannot starve background work.
+    """
+
+    def __init__(self, max_concurrency=4, quantum=1.0, wait_sample_size=1000, max_wait=30.0):
+        """
+        Initialize the scheduler.
+
+        Args:
+            max_concurrency: Maximum number of calls running at the same time
+            quantum: Credit each guild earns per round-robin visit
+            wait_sample_size: Number of recent wait times kept for metrics
+            max_wait: Seconds a call may wait before its lane jumps the priority order (0 disables)
+        """
+        self.max_concurrency = max_concurrency
+        self.quantum = quantum
+        self.max_wait = max_wait
+        self.active = 0
+
+        # Structure: {priority: OrderedDict({guild_id: deque([ticket, ...])})}
+        self.lanes = {priority: OrderedDict() for priority in Priority}
+
+        # Structure: {priority: {guild_id: deficit}}
+        self.deficits = {priority: {} for priority in Priority}
+
+        # Metrics
+        self.total_started = 0
+        self.total_queued = 0
+        self.total_aged = 0
+        self.wait_times = deque(maxlen=wait_sample_size)
+        self.max_wait_time = 0.0
+
+    @asynccontextmanager
+    async def slot(self, guild_id, priority=Priority.NORMAL, cost=1.0):
+        """
+        Hold a scheduler slot for the duration of the block.
+
+        Args:
+            guild_id: Discord guild ID the call is made for (None for global work)
+            priority: Priority lane to queue in
+            cost: Relative cost of the call for fair queuing
+        """
+        await self.acquire(guild_id, priority, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, guild_id, priority=Priority.NORMAL, cost=1.0):
+        """Wait until a slot is granted to this caller."""
+        # Fast path when nothing is waiting
+        if self.active < self.max_concurrency and self.queue_depth() == 0:
+            self.active += 1
+            self._record_start(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        ticket = _Ticket(guild_id, cost, future)
+        lane = self.lanes[priority]
+        lane.setdefault(guild_id, deque()).append(ticket)
+        self.total_queued += 1
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before cancellation, hand it back
+                self.release()
+            else:
+                self._remove_ticket(priority, ticket)
+            raise
+
+    def release(self):
+        """Release a slot and wake the next waiting caller."""
+        self.active -= 1
+        self._dispatch()
+
+    def queue_depth(self, priority=None):
+        """
+        Get the number of waiting calls.
+
+        Args:
+            priority: Only count this lane (optional)
+
+        Returns:
+            int: Number of queued calls
+        """
+        lanes = [self.lanes[priority]] if priority is not None else self.lanes.values()
+        return sum(len(queue) for lane in lanes for queue in lane.values())
+
+    def get_metrics(self):
+        """
+        Get scheduler metrics.
+
+        Returns:
+            dict: Concurrency, queue depth and wait time statistics
+        """
+        waits = sorted(self.wait_times)
+        if waits:
+            avg_wait = sum(waits) / len(waits)
+            p95_wait = waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+        else:
+            avg_wait = p95_wait = 0.0
+
+        return {
+            'active': self.active,
+            'max_concurrency': self.max_concurrency,
+            'queue_depth': self.queue_depth(),
+            'queue_depth_by_priority': {
+                priority.name.lower(): self.queue_depth(priority) for priority in Priority
+            },
+            'queued_guilds': len({guild_id for lane in self.lanes.values() for guild_id in lane}),
+            'total_started': self.total_started,
+            'total_queued': self.total_queued,
+            'total_aged': self.total_aged,
+            'avg_wait_seconds': avg_wait,
+            'p95_wait_seconds': p95_wait,
+            'max_wait_seconds': self.max_wait_time
+        }
+
+    def _dispatch(self):
+        """Grant free slots to waiting callers."""
+        while self.active < self.max_concurrency:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            if ticket.future.done():
+                continue
+
+            self.active += 1
+            self._record_start(time.monotonic() - ticket.enqueued_at)
+            ticket.future.set_result(None)
+
+    def _next_ticket(self):
+        """Pick the next ticket using priority lanes and deficit round-robin."""
+        # A lane that has waited too long goes first
+        aged = self._aged_lane()
+        if aged is not None:
+            self.total_aged += 1
+            return self._next_in_lane(aged)
+
+        for priority in Priority:
+            if self.lanes[priority]:
+                return self._next_in_lane(priority)
+
+        return None
+
+    def _aged_lane(self):
+        """Get the lane holding the longest waiting call past max_wait, if any."""
+        if self.max_wait <= 0:
+            return None
+
+        # Only lower lanes can starve, the highest waiting lane is served anyway
+        cutoff = time.monotonic() - self.max_wait
+        oldest = None
+        aged = None
+        waiting = [priority for priority in Priority if self.lanes[priority]]
+        for priority in waiting[1:]:
+            # Each guild's queue is in arrival order, so its head is its oldest call
+            enqueued_at = min(queue[0].enqueued_at for queue in self.lanes[priority].values())
+            if enqueued_at <= cutoff and (oldest is None or enqueued_at < oldest):
+                oldest, aged = enqueued_at, priority
+
+        return aged
+
+    def _next_in_lane(self, priority):
+        """Pick the next ticket of a non-empty lane with deficit round-robin."""
+        lane = self.lanes[priority]
+        deficits = self.deficits[priority]
+
+        while True:
+            guild_id, queue = next(iter(lane.items()))
+            head = queue[0]
+
+            # Not enough credit yet, earn a quantum and let the next guild go
+            if deficits.get(guild_id, 0.0) < head.cost:
+                deficits[guild_id] = deficits.get(guild_id, 0.0) + self.quantum
+                lane.move_to_end(guild_id)
+                continue
+
+            deficits[guild_id] -= head.cost
+            queue.popleft()
+
+            # Idle guilds do not keep their credit
+            if not queue:
+                del lane[guild_id]
+                deficits.pop(guild_id, None)
+
+            return head
+
+    def _remove_ticket(self, priority, ticket):
+        """Remove a cancelled ticket from its queue."""
+        lane = self.lanes[priority]
+        queue = lane.get(ticket.guild_id)
+        if queue is None:
+            return
+
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            return
+
+        if not queue:
+            del lane[ticket.guild_id]
+            self.deficits[priority].pop(ticket.guild_id, None)
+
+    def _record_start(self, wait_time):
+        """Record metrics for a call that has started."""
+        self.total_started += 1
+        self.wait_times.append(wait_time)
+        self.max_wait_time = max(self.max_wait_time, wait_time)
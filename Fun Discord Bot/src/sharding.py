@@ -0,0 +1,332 @@
+"""
+Sharding module for spreading guild data over several SQLite files.
+"""
+import asyncio
+import os
+import re
+from async_database import AsyncDatabase
+from database import Database
+
+# Database methods whose first argument is the guild ID
+GUILD_METHODS = frozenset({
+    'get_server_data',
+    'update_server_persona',
+    'set_user_preference',
+    'get_user_preferences',
+    'update_user_max_sentences',
+    'get_user_max_sentences',
+    'store_message',
+    'get_message_history',
+    'get_channel_summary',
+    'update_channel_summary',
+    'get_messages_to_summarize',
+    'search_messages',
+    'add_warning',
+    'get_user_warnings'
+})
+
+# Database methods for data that isn't tied to a guild, kept in the home database
+HOME_METHODS = frozenset({
+    'get_cached_response',
+    'store_cached_response',
+    'delete_expired_cached_responses',
+    'trim_cached_responses',
+    'get_image_cache_entry',
+    'store_image_cache_entry',
+    'touch_image_cache_entry',
+    'delete_image_cache_entry',
+    'get_image_cache_size',
+    'get_least_recent_image_cache_entries',
+    'image_content_in_use'
+})
+
+# Tables holding per-guild rows, moved to the shards by tools/reshard.py
+GUILD_TABLES = ('servers', 'messages', 'user_preferences', 'warnings', 'reminders', 'channel_summaries')
+
+SHARD_FILE = re.compile(r'^shard_(\d+)\.db$')
+
+class PartialWriteError(Exception):
+    """Raised when a batch write failed on some shards, with the rows that were not written."""
+
+    def __init__(self, message, rows):
+        super().__init__(message)
+        self.rows = rows
+
+def shard_key(guild_id, shards):
+    """
+    Get the shard a guild's rows live in.
+
+    Args:
+        guild_id: Discord guild ID
+        shards: Number of shard files
+
+    Returns:
+        int: Shard index
+    """
+    return guild_id % shards
+
+def shard_path(shard_dir, key):
+    """
+    Get the file a shard is stored in.
+
+    Args:
+        shard_dir: Directory holding the shard files
+        key: Shard key from shard_key
+
+    Returns:
+        str: Path to the shard's SQLite file
+    """
+    return os.path.join(shard_dir, f"shard_{key}.db")
+
+class ShardedDatabase:
+    """
+    Awaitable facade spreading guild rows over a fixed number of SQLite files.
+
+    Guilds are assigned to one of N shard files by guild_id modulo N. Every shard is
+    an AsyncDatabase with its own writer thread, so writes for guilds on different
+    shards no longer queue behind one write lock. Data that doesn't belong to a
+    guild, such as the caches, stays in the home database.
+
+    All N shards are opened up front and scans such as due reminders and retention
+    fan out over them, so N should stay small (tens, not thousands).
+
+    Methods that return row IDs used across shards (due reminders and messages to
+    prune) return them as (shard key, ID) pairs, which the matching delete methods
+    accept back.
+    """
+
+    def __init__(self, db_path, shard_dir, shards=4, readers=2, pragmas=None, codec=None):
+        """
+        Initialize the home database and open the shards.
+
+        Args:
+            db_path: Path to the home SQLite database file
+            shard_dir: Directory holding the shard files
+            shards: Number of shard files
+            readers: Number of reader threads per database
+            pragmas: Connection settings passed to every database (optional)
+            codec: ContentCodec shared by every database (optional)
+        """
+        if not isinstance(shards, int) or shards < 1:
+            raise ValueError(f"Invalid shard count: {shards}")
+
+        # Files left from a larger shard count hold guilds this layout would never read
+        os.makedirs(shard_dir, exist_ok=True)
+        extra = [name for name in os.listdir(shard_dir)
+                 if SHARD_FILE.match(name) and int(SHARD_FILE.match(name).group(1)) >= shards]
+        if extra:
+            raise ValueError(f"{shard_dir} has shard files beyond {shards} shards ({', '.join(sorted(extra)[:5])}), "
+                             f"re-shard with tools/reshard.py to change the shard count")
+
+        self.shard_dir = shard_dir
+        self.shard_count = shards
+
+        self.home = AsyncDatabase(db_path, readers=readers, pragmas=pragmas, codec=codec)
+
+        # Structure: {shard key: AsyncDatabase}
+        self.shards = {
+            key: AsyncDatabase(shard_path(shard_dir, key), readers=readers, pragmas=pragmas, codec=codec)
+            for key in range(shards)
+        }
+
+    def _shard(self, guild_id):
+        """Get the database holding a guild's rows."""
+        return self.shards[shard_key(guild_id, self.shard_count)]
+
+    def __getattr__(self, name):
+        """Get an awaitable Database method routed to the right database."""
+        method = getattr(Database, name, None)
+        if name.startswith('_') or not callable(method):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        if name in HOME_METHODS:
+            return getattr(self.home, name)
+        if name not in GUILD_METHODS:
+            raise AttributeError(f"'{type(self).__name__}' does not support '{name}'")
+
+        async def call(guild_id, *args, **kwargs):
+            shard = self._shard(guild_id)
+            return await getattr(shard, name)(guild_id, *args, **kwargs)
+
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        return call
+
+    async def _gather(self, name, *args, include_home=False):
+        """Call a method on every shard, returning (shard key, result) pairs."""
+        shards = list(self.shards.items())
+        if include_home:
+            shards.append((None, self.home))
+        results = await asyncio.gather(*(getattr(shard, name)(*args) for _, shard in shards))
+        return [(key, result) for (key, _), result in zip(shards, results)]
+
+    async def store_messages(self, rows):
+        """
+        Store several messages, grouped into one write per shard.
+
+        Args:
+            rows: List of (guild_id, channel_id, role, name, content, token_count) tuples
+
+        Raises:
+            PartialWriteError: Some shards failed, the error's rows were not written
+        """
+        grouped = {}
+        for row in rows:
+            grouped.setdefault(row[0], []).append(row)
+
+        # Guilds sharing a shard go in the same batch
+        batches = {}
+        for guild_id, guild_rows in grouped.items():
+            shard = self._shard(guild_id)
+            batches.setdefault(id(shard), (shard, []))[1].extend(guild_rows)
+
+        # Each shard commits on its own, so only the rows of failed shards may be retried
+        batches = list(batches.values())
+        results = await asyncio.gather(*(shard.store_messages(batch) for shard, batch in batches),
+                                       return_exceptions=True)
+        failed = [(batch, result) for (_, batch), result in zip(batches, results) if isinstance(result, Exception)]
+        if failed:
+            unwritten = [row for batch, _ in failed for row in batch]
+            raise PartialWriteError(f"{len(failed)} of {len(batches)} shards failed: {failed[0][1]}",
+                                    unwritten) from failed[0][1]
+
+    async def add_reminder(self, user_id, channel_id, guild_id, message, remind_time):
+        """
+        Add a reminder for a user in the guild's shard.
+
+        Returns:
+            tuple: (shard key, reminder ID)
+        """
+        shard = self._shard(guild_id)
+        reminder_id = await shard.add_reminder(user_id, channel_id, guild_id, message, remind_time)
+        return (shard_key(guild_id, self.shard_count), reminder_id)
+
+    async def get_due_reminders(self, current_time):
+        """
+        Get due reminders from every shard.
+
+        Args:
+            current_time: Current time in epoch milliseconds
+
+        Returns:
+            list: Due reminder dictionaries, oldest first, with (shard key, ID) IDs
+        """
+        reminders = []
+        for key, shard_reminders in await self._gather('get_due_reminders', current_time):
+            for reminder in shard_reminders:
+                reminder['id'] = (key, reminder['id'])
+                reminders.append(reminder)
+
+        reminders.sort(key=lambda reminder: reminder['remind_time'])
+        return reminders
+
+    async def delete_reminder(self, reminder_id):
+        """
+        Delete a reminder.
+
+        Args:
+            reminder_id: (shard key, reminder ID) from get_due_reminders or add_reminder
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        key, local_id = reminder_id
+        shard = self.shards.get(key)
+        if shard is None:
+            return False
+        return await shard.delete_reminder(local_id)
+
+    async def get_expired_message_ids(self, cutoff, limit):
+        """
+        Get messages older than a cutoff from every shard.
+
+        Args:
+            cutoff: Epoch milliseconds, older messages are returned
+            limit: Maximum number of IDs
+
+        Returns:
+            list: (shard key, message ID) pairs
+        """
+        message_ids = []
+        for key, shard_ids in await self._gather('get_expired_message_ids', cutoff, limit):
+            message_ids.extend((key, message_id) for message_id in shard_ids)
+        return message_ids[:limit]
+
+    async def get_oldest_messages(self, guild_id, limit, channel_id=None):
+        """
+        Get the oldest messages of a guild, or of one of its channels.
+
+        Returns:
+            list: Dictionaries with (shard key, ID) IDs and size_bytes
+        """
+        shard = self._shard(guild_id)
+        key = shard_key(guild_id, self.shard_count)
+        messages = await shard.get_oldest_messages(guild_id, limit, channel_id=channel_id)
+        for message in messages:
+            message['id'] = (key, message['id'])
+        return messages
+
+    async def get_active_personas(self):
+        """Get the personas servers currently have selected, from every shard."""
+        personas = set()
+        for _, shard_personas in await self._gather('get_active_personas'):
+            personas.update(shard_personas)
+        return sorted(personas)
+
+    async def get_channels_over_row_limit(self, max_rows):
+        """Get channels above a message count from every shard."""
+        return [channel for _, channels in await self._gather('get_channels_over_row_limit', max_rows)
+                for channel in channels]
+
+    async def get_guilds_over_byte_limit(self, max_bytes):
+        """Get guilds above a size in bytes from every shard."""
+        return [guild for _, guilds in await self._gather('get_guilds_over_byte_limit', max_bytes)
+                for guild in guilds]
+
+    async def delete_messages(self, message_ids):
+        """
+        Delete messages from their shards.
+
+        Args:
+            message_ids: (shard key, message ID) pairs
+
+        Returns:
+            tuple: (rows deleted, bytes of text deleted)
+        """
+        grouped = {}
+        for key, message_id in message_ids:
+            grouped.setdefault(key, []).append(message_id)
+
+        results = await asyncio.gather(*(
+            self.shards[key].delete_messages(ids) for key, ids in grouped.items() if key in self.shards
+        ))
+        return (sum(rows for rows, _ in results), sum(size_bytes for _, size_bytes in results))
+
+    async def incremental_vacuum(self, pages=1000):
+        """
+        Release free pages in every database.
+
+        Returns:
+            int: Total bytes returned to the file system
+        """
+        return sum(freed for _, freed in await self._gather('incremental_vacuum', pages, include_home=True))
+
+    async def checkpoint(self, mode='PASSIVE'):
+        """
+        Checkpoint the write-ahead log of every database.
+
+        Returns:
+            dict: Number of busy databases, and wal_pages and checkpointed_pages summed over all of them
+        """
+        totals = {'busy': 0, 'wal_pages': 0, 'checkpointed_pages': 0}
+        for _, result in await self._gather('checkpoint', mode, include_home=True):
+            for name in totals:
+                totals[name] += result[name]
+        return totals
+
+    def close(self):
+        """Finish queued work and close every database."""
+        for shard in self.shards.values():
+            shard.close()
+        self.shards = {}
+        self.home.close()
@@ -0,0 +1,196 @@
+"""
+Summarization module for keeping long channel context cheap.
+"""
+import asyncio
+from collections import OrderedDict
+from scheduler import Priority
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a Discord conversation. Merge the new messages into the "
+    "existing summary. Keep names, facts, decisions and open questions. Write plain prose, "
+    "no more than 150 words."
+)
+
+class ConversationSummarizer:
+    """
+    Background summarizer that folds messages the prompt's token budget no longer
+    holds into a per-channel rolling summary.
+
+    Channels are only summarized once they have been idle for a while, so the
+    extra API call never delays a reply.
+    """
+
+    def __init__(self, db, openai_manager, scheduler, logger, keep_recent=50, idle_seconds=120,
+                 batch_size=50, check_interval=30, max_channels=10000, model="gpt-3.5-turbo"):
+        """
+        Initialize the summarizer.
+
+        Args:
+            db: AsyncDatabase instance
+            openai_manager: OpenAIClientManager providing the shared client
+            scheduler: LLMScheduler the summary calls go through
+            logger: BotLogger instance
+            keep_recent: Most recent messages left out of the summary, lowered per channel
+                to what the token budget last kept (see set_window)
+            idle_seconds: Seconds a channel must be quiet before it is summarized
+            batch_size: Maximum number of messages folded in per refresh
+            check_interval: Seconds between idle checks
+            max_channels: Number of channels whose summary and window stay in memory
+            model: Model used for summaries
+        """
+        self.db = db
+        self.openai_manager = openai_manager
+        self.scheduler = scheduler
+        self.logger = logger
+        self.keep_recent = keep_recent
+        self.idle_seconds = idle_seconds
+        self.batch_size = batch_size
+        self.check_interval = check_interval
+        self.max_channels = max_channels
+        self.model = model
+
+        # Structure: {(guild_id, channel_id): last_activity_time}
+        self.pending = {}
+
+        # Structure: OrderedDict({(guild_id, channel_id): summary dict or None}), least recently used first
+        self.summaries = OrderedDict()
+
+        # Structure: OrderedDict({(guild_id, channel_id): history messages in the last prompt})
+        self.windows = OrderedDict()
+
+    def mark_activity(self, guild_id, channel_id):
+        """Record that a channel has new messages."""
+        self.pending[(guild_id, channel_id)] = asyncio.get_running_loop().time()
+
+    def set_window(self, guild_id, channel_id, kept):
+        """
+        Record how many history messages the token budget kept for a channel's last prompt.
+
+        Messages older than those are folded into the summary, so nothing dropped by the
+        budget is missing from both the prompt and the summary.
+
+        Args:
+            guild_id: Discord guild ID
+            channel_id: Discord channel ID
+            kept: Number of history messages sent with the prompt
+        """
+        self._remember(self.windows, (guild_id, channel_id), kept)
+
+    def _remember(self, entries, key, value):
+        """Store a per-channel entry, dropping the least recently used past max_channels."""
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_channels:
+            entries.popitem(last=False)
+
+    async def get_summary(self, guild_id, channel_id):
+        """
+        Get the current summary text for a channel.
+
+        Args:
+            guild_id: Discord guild ID
+            channel_id: Discord channel ID
+
+        Returns:
+            str: Summary text, or None if the channel has no summary
+        """
+        summary = await self._load_summary(guild_id, channel_id)
+        return summary['summary'] if summary else None
+
+    async def _load_summary(self, guild_id, channel_id):
+        """Get a channel's summary dictionary, reading it from the database if not in memory."""
+        key = (guild_id, channel_id)
+        if key in self.summaries:
+            self.summaries.move_to_end(key)
+            return self.summaries[key]
+
+        summary = await self.db.get_channel_summary(guild_id, channel_id)
+        self._remember(self.summaries, key, summary)
+        return summary
+
+    async def run(self):
+        """Background task that refreshes summaries of idle channels."""
+        try:
+            while True:
+                await asyncio.sleep(self.check_interval)
+
+                now = asyncio.get_running_loop().time()
+                idle = [
+                    key for key, last_activity in self.pending.items()
+                    if now - last_activity >= self.idle_seconds
+                ]
+
+                for key in idle:
+                    last_activity = self.pending[key]
+                    try:
+                        done = await self.summarize_channel(*key)
+                    except Exception as e:
+                        self.logger.error(f"Error summarizing channel {key[1]}: {e}", exc_info=True)
+                        done = True
+
+                    # Keep the channel pending if a backlog remains or new messages arrived meanwhile
+                    if done and self.pending.get(key) == last_activity:
+                        del self.pending[key]
+                        self.windows.pop(key, None)
+        except asyncio.CancelledError:
+            pass
+
+    async def summarize_channel(self, guild_id, channel_id):
+        """
+        Fold the next batch of messages that left the window into the channel summary.
+
+        Args:
+            guild_id: Discord guild ID
+            channel_id: Discord channel ID
+
+        Returns:
+            bool: True if the channel is fully summarized
+        """
+        key = (guild_id, channel_id)
+        current = await self._load_summary(guild_id, channel_id)
+        after_id = current['last_message_id'] if current else 0
+
+        # Everything older than what the last prompt carried belongs in the summary
+        keep_recent = min(self.keep_recent, self.windows.get(key, self.keep_recent))
+
+        messages = await self.db.get_messages_to_summarize(
+            guild_id, channel_id, after_id, keep_recent, self.batch_size
+        )
+        if not messages:
+            return True
+
+        # Build a transcript of the messages leaving the window
+        transcript = "\n".join(
+            f"{message['name'] or message['role']}: {message['content']}" for message in messages
+        )
+        existing = current['summary'] if current else "(none)"
+
+        client = self.openai_manager.get()
+        self.logger.log_api_call("OpenAI Chat Completion", {
+            "purpose": "conversation summary",
+            "messages": len(messages)
+        })
+
+        async with self.scheduler.slot(guild_id, Priority.LOW):
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Existing summary:\n{existing}\n\nNew messages:\n{transcript}"}
+                ],
+                max_tokens=300,
+                temperature=0.3
+            )
+
+        summary = response.choices[0].message.content.strip()
+        last_message_id = messages[-1]['id']
+
+        await self.db.update_channel_summary(guild_id, channel_id, summary, last_message_id)
+        self._remember(self.summaries, key, {
+            'summary': summary,
+            'last_message_id': last_message_id,
+            'updated_at': None
+        })
+
+        self.logger.debug(f"Folded {len(messages)} messages into summary for channel {channel_id}")
+        return len(messages) < self.batch_size
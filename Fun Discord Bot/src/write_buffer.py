@@ -0,0 +1,185 @@
+"""
+Write buffer module for batching chat message inserts.
+"""
+import asyncio
+from sharding import PartialWriteError
+
+# Wait after a failed flush, doubled per failure in a row up to the maximum
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30.0
+
+class MessageWriteBuffer:
+    """
+    Write-behind buffer for chat messages.
+
+    Messages are queued in memory and written in one transaction (see
+    Database.store_messages) once max_rows are waiting or the oldest has waited
+    max_delay_ms, whichever comes first. Those two limits are the most that can be
+    lost if the process dies.
+
+    A failed flush is retried with exponential backoff. After max_retries failures
+    in a row the rows are written one at a time, and the ones that still fail are
+    logged and dropped so a bad row can't block every later write.
+    """
+
+    def __init__(self, db, logger, max_rows=100, max_delay_ms=500, max_retries=5):
+        """
+        Initialize the write buffer.
+
+        Args:
+            db: AsyncDatabase instance
+            logger: BotLogger instance
+            max_rows: Pending rows that trigger an immediate flush
+            max_delay_ms: Longest time a row waits before it is written
+            max_retries: Failed flushes in a row before failing rows are dropped
+        """
+        self.db = db
+        self.logger = logger
+        self.max_rows = max(1, max_rows)
+        self.max_delay_ms = max(0, max_delay_ms)
+        self.max_retries = max(0, max_retries)
+
+        # Structure: [(guild_id, channel_id, role, name, content, token_count), ...]
+        self.rows = []
+
+        self.task = None
+        self.has_rows = asyncio.Event()
+        self.full = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+
+        # Failed flushes since the last successful one
+        self.failures = 0
+
+        # Counters
+        self.flushes = 0
+        self.rows_written = 0
+        self.failed_flushes = 0
+        self.rows_dropped = 0
+
+    def start(self):
+        """Start the background flush task. Must be called from within the running event loop."""
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def add(self, guild_id, channel_id, role, name, content, token_count=None):
+        """
+        Queue a message for writing.
+
+        Args:
+            guild_id: Discord guild ID
+            channel_id: Discord channel ID
+            role: Message role (user or assistant)
+            name: Username (only for user messages)
+            content: Message content
+            token_count: Number of tokens in the content (optional)
+        """
+        self.rows.append((guild_id, channel_id, role, name, content, token_count))
+        self.has_rows.set()
+
+        # Don't let more than max_rows sit unwritten
+        if len(self.rows) >= self.max_rows:
+            self.full.set()
+
+    async def run(self):
+        """Background task that flushes the buffer every max_delay_ms or when it fills up."""
+        try:
+            while True:
+                await self.has_rows.wait()
+
+                # Give the batch until the oldest row is due to fill up
+                if not self.full.is_set() and self.max_delay_ms:
+                    try:
+                        await asyncio.wait_for(self.full.wait(), self.max_delay_ms / 1000)
+                    except asyncio.TimeoutError:
+                        pass
+                self.has_rows.clear()
+                self.full.clear()
+
+                await self.flush()
+
+                # Back off before retrying a failed batch, even with no flush delay
+                if self.failures:
+                    await asyncio.sleep(min(RETRY_BASE_SECONDS * 2 ** (self.failures - 1), RETRY_MAX_SECONDS))
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self):
+        """
+        Write all pending rows in one transaction.
+
+        Returns:
+            int: Number of rows written
+        """
+        async with self.flush_lock:
+            if not self.rows:
+                return 0
+
+            rows, self.rows = self.rows, []
+            try:
+                await self.db.store_messages(rows)
+            except Exception as e:
+                self.failed_flushes += 1
+                self.failures += 1
+                self.logger.error(f"Error writing {len(rows)} buffered messages: {e}", exc_info=True)
+
+                # A failed batch is rolled back, only shards that failed left rows unwritten
+                unwritten = e.rows if isinstance(e, PartialWriteError) else rows
+                written = len(rows) - len(unwritten)
+                if self.failures > self.max_retries:
+                    written += await self._write_each(unwritten)
+                    self.failures = 0
+                else:
+                    # Put the rows back in order so the next flush retries them
+                    self.rows = unwritten + self.rows
+                    self.has_rows.set()
+
+                self.rows_written += written
+                return written
+
+            self.failures = 0
+            self.flushes += 1
+            self.rows_written += len(rows)
+            return len(rows)
+
+    async def _write_each(self, rows):
+        """
+        Write rows one at a time, dropping the ones that fail.
+
+        Returns:
+            int: Number of rows written
+        """
+        written = 0
+        for row in rows:
+            try:
+                await self.db.store_messages([row])
+                written += 1
+            except Exception as e:
+                self.rows_dropped += 1
+                self.logger.error(f"Dropping message for channel {row[1]} in guild {row[0]} after "
+                                  f"{self.max_retries + 1} failed writes: {e}")
+        return written
+
+    async def close(self):
+        """Stop the background task and write everything still pending."""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+        await self.flush()
+
+    def get_stats(self):
+        """
+        Get buffer statistics.
+
+        Returns:
+            dict: Pending rows and flush counters
+        """
+        return {
+            'pending': len(self.rows),
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'failed_flushes': self.failed_flushes,
+            'rows_dropped': self.rows_dropped,
+            'avg_batch': round(self.rows_written / self.flushes, 1) if self.flushes else 0.0
+        }
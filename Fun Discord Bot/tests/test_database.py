@@ -0,0 +1,168 @@
+import calendar
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from database import Database, SCHEMA_VERSION
+
+# Schema of the original release, before user_version was set
+BASELINE_SCHEMA = '''
+CREATE TABLE servers (
+    guild_id TEXT PRIMARY KEY,
+    persona TEXT NOT NULL,
+    settings TEXT
+);
+CREATE TABLE messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    role TEXT NOT NULL,
+    name TEXT,
+    content TEXT NOT NULL
+);
+CREATE TABLE settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE warnings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    moderator_id TEXT NOT NULL,
+    reason TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE reminders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    guild_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    remind_time DATETIME NOT NULL,
+    created_time DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+# Real snowflakes are too large for a float to hold exactly
+GUILD_ID = 1098765432109876543
+CHANNEL_ID = 1098765432109876544
+USER_ID = 1098765432109876545
+MODERATOR_ID = 1098765432109876546
+
+def utc_ms(text):
+    """Epoch milliseconds of a UTC "YYYY-MM-DD HH:MM:SS" string."""
+    return calendar.timegm(datetime.datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timetuple()) * 1000
+
+class TestLegacyMigration(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(tempfile.mkdtemp(prefix="database_"), "bot_data.db")
+
+        # Rows as the original release wrote them: TEXT IDs, preferences inside the
+        # settings blob and reminder times from datetime.now()
+        self.remind_time = datetime.datetime(2024, 5, 1, 18, 30, 0)
+        settings = {'theme': 'dark', 'user_preferences': {'users': {str(USER_ID): {'max_sentences': 3}}}}
+
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(BASELINE_SCHEMA)
+        conn.execute('INSERT INTO servers VALUES (?, ?, ?)', (str(GUILD_ID), 'pirate', json.dumps(settings)))
+        conn.executemany(
+            'INSERT INTO messages (guild_id, channel_id, timestamp, role, name, content) VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (str(GUILD_ID), str(CHANNEL_ID), '2024-05-01 12:00:00', 'user', 'bob', 'Where is the treasure?'),
+                (str(GUILD_ID), str(CHANNEL_ID), '2024-05-01 12:00:05', 'assistant', None, 'Buried under the palm.')
+            ]
+        )
+        conn.execute(
+            'INSERT INTO warnings (guild_id, user_id, moderator_id, reason, timestamp) VALUES (?, ?, ?, ?, ?)',
+            (str(GUILD_ID), str(USER_ID), str(MODERATOR_ID), 'spam', '2024-05-01 13:00:00')
+        )
+        conn.execute(
+            'INSERT INTO reminders (user_id, channel_id, guild_id, message, remind_time, created_time) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (str(USER_ID), str(CHANNEL_ID), str(GUILD_ID), 'dig', str(self.remind_time), '2024-05-01 12:00:00')
+        )
+        conn.commit()
+        conn.close()
+
+    def test_migrates_baseline_schema(self):
+        db = Database(self.db_path)
+        cursor = db.conn.cursor()
+
+        cursor.execute('PRAGMA user_version')
+        self.assertEqual(cursor.fetchone()[0], SCHEMA_VERSION)
+
+        # Snowflakes are INTEGER and keep their exact value
+        for table, column in [('servers', 'guild_id'), ('messages', 'channel_id'), ('warnings', 'moderator_id'),
+                              ('reminders', 'user_id')]:
+            cursor.execute(f'SELECT DISTINCT typeof({column}) FROM {table}')
+            self.assertEqual([row[0] for row in cursor.fetchall()], ['integer'], f"{table}.{column}")
+
+        # Times are epoch milliseconds, UTC columns as is and reminder times from local time
+        cursor.execute('SELECT timestamp FROM messages ORDER BY id')
+        self.assertEqual([row[0] for row in cursor.fetchall()],
+                         [utc_ms('2024-05-01 12:00:00'), utc_ms('2024-05-01 12:00:05')])
+        warnings = db.get_user_warnings(GUILD_ID, USER_ID)
+        self.assertEqual([(warning['moderator_id'], warning['timestamp']) for warning in warnings],
+                         [(MODERATOR_ID, utc_ms('2024-05-01 13:00:00'))])
+        reminders = db.get_due_reminders(int(self.remind_time.timestamp() * 1000))
+        self.assertEqual([(reminder['guild_id'], reminder['remind_time']) for reminder in reminders],
+                         [(GUILD_ID, int(self.remind_time.timestamp() * 1000))])
+        self.assertEqual(db.get_due_reminders(int(self.remind_time.timestamp() * 1000) - 1), [])
+
+        # Preferences moved out of the settings blob, other settings stay
+        self.assertEqual(db.get_user_preferences(GUILD_ID, USER_ID), {'max_sentences': 3})
+        self.assertEqual(db.get_server_data(GUILD_ID, 'default'),
+                         {'guild_id': GUILD_ID, 'persona': 'pirate', 'theme': 'dark'})
+
+        # History and the full-text index cover the migrated messages
+        history = db.get_message_history(GUILD_ID, CHANNEL_ID, 10)
+        self.assertEqual([message['content'] for message in history],
+                         ['Where is the treasure?', 'Buried under the palm.'])
+        results = db.search_messages(GUILD_ID, ['treasure'], 10)
+        self.assertEqual([result['content'] for result in results], ['Where is the treasure?'])
+        self.assertEqual(db.search_messages(GUILD_ID, ['palm'], 10, channel_id=CHANNEL_ID)[0]['role'], 'assistant')
+
+        # The old tables are gone
+        cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE '%_v0'")
+        self.assertEqual(cursor.fetchall(), [])
+        db.close()
+
+    def test_reopening_does_not_migrate_again(self):
+        Database(self.db_path).close()
+        db = Database(self.db_path)
+        self.assertEqual(len(db.get_message_history(GUILD_ID, CHANNEL_ID, 10)), 2)
+        self.assertEqual(len(db.search_messages(GUILD_ID, ['treasure'], 10)), 1)
+        self.assertEqual(db.get_user_preferences(GUILD_ID, USER_ID), {'max_sentences': 3})
+        db.close()
+
+class TestResponseCacheTable(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(os.path.join(tempfile.mkdtemp(prefix="database_"), "bot_data.db"))
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_expired_entries_are_deleted(self):
+        self.db.store_cached_response('old', 'stale', 100.0)
+        self.db.store_cached_response('new', 'fresh', 300.0)
+        self.assertEqual(self.db.delete_expired_cached_responses(200.0), 1)
+        self.assertIsNone(self.db.get_cached_response('old', 0.0))
+        self.assertEqual(self.db.get_cached_response('new', 200.0), ('fresh', 300.0))
+
+    def test_trim_keeps_latest_entries(self):
+        for index in range(5):
+            self.db.store_cached_response(f'key{index}', f'response {index}', 1000.0 + index)
+        self.assertEqual(self.db.trim_cached_responses(2), 3)
+        self.assertEqual([self.db.get_cached_response(f'key{index}', 0.0) is not None for index in range(5)],
+                         [False, False, False, True, True])
+        self.assertEqual(self.db.trim_cached_responses(2), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from insult_pool import InsultPool
+from logger import BotLogger
+from scheduler import LLMScheduler, Priority
+
+PERSONAS = {"general": {"system_prompt": "You are a general."}}
+
+class FakeCompletions:
+    """Chat completions that return a batch of templates after a short delay."""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.calls = 0
+        self.empty = False
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        text = "" if self.empty else "\n".join(f"{{name}} is silly #{index}" for index in range(self.batch_size))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+class FakeOpenAIManager:
+    def __init__(self, completions):
+        self.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    def get(self):
+        return self.client
+
+class TestInsultPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.logger = BotLogger(log_dir=tempfile.mkdtemp(prefix="insult_pool_logs_"))
+        self.logger.logger.setLevel(logging.CRITICAL)
+        self.completions = FakeCompletions(batch_size=3)
+        self.scheduler = LLMScheduler(max_concurrency=1)
+        self.pool = InsultPool(FakeOpenAIManager(self.completions), self.scheduler, self.logger,
+                               PERSONAS, "general", pool_size=3, low_water=0, batch_size=3)
+
+    async def test_concurrent_callers_on_empty_pool(self):
+        # Far more callers than one refill produces, each must wait for a later refill
+        insults = await asyncio.gather(*(self.pool.get_insult("general", "Bob") for _ in range(20)))
+        self.assertEqual(len(insults), 20)
+        self.assertTrue(all(insult.startswith("Bob is silly") for insult in insults))
+
+    async def test_empty_refill_raises(self):
+        self.completions.empty = True
+        with self.assertRaises(RuntimeError):
+            await self.pool.get_insult("general", "Bob")
+
+    async def test_waiter_promotes_background_refill(self):
+        # Hold the only slot and queue chat traffic so a LOW refill has to wait
+        await self.scheduler.acquire(1)
+        chat = asyncio.ensure_future(self.scheduler.acquire(2, Priority.NORMAL))
+        self.pool.schedule_refill("general")
+        await asyncio.sleep(0.001)
+        self.assertEqual(self.scheduler.queue_depth(Priority.LOW), 1)
+
+        insult = asyncio.ensure_future(self.pool.get_insult("general", "Bob"))
+        await asyncio.sleep(0.001)
+        self.assertEqual(self.scheduler.queue_depth(Priority.LOW), 0)
+        self.assertEqual(self.scheduler.queue_depth(Priority.HIGH), 1)
+
+        # The refill is served before the queued chat call
+        self.scheduler.release()
+        await asyncio.sleep(0)
+        self.assertFalse(chat.done())
+        self.assertEqual(await insult, "Bob is silly #0")
+
+        await chat
+        self.scheduler.release()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import os
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from rate_limiting import RateLimiter, RateLimitType
+
+# Limited requests log a warning each, which would flood the test output
+logging.getLogger('discord_bot').setLevel(logging.ERROR)
+
+class TestTryAcquire(unittest.TestCase):
+    def setUp(self):
+        # Long windows so nothing refills while a test runs
+        self.limiter = RateLimiter()
+        self.limiter.rate_limits[RateLimitType.MESSAGE] = (5, 3600)
+        self.limiter.channel_rate_limits[RateLimitType.MESSAGE] = (8, 3600)
+        self.limiter.server_rate_limits[RateLimitType.MESSAGE] = (12, 3600)
+        self.limiter.global_rate_limits[RateLimitType.MESSAGE] = (20, 3600)
+
+    def acquire(self, user_id, guild_id=1, channel_id=10):
+        return self.limiter.try_acquire(RateLimitType.MESSAGE, user_id, guild_id, channel_id)
+
+    def test_user_limit(self):
+        results = [self.acquire(1)[0] for _ in range(7)]
+        self.assertEqual(results, [False] * 5 + [True] * 2)
+
+        is_limited, wait_time, limit_info = self.acquire(1)
+        self.assertTrue(is_limited)
+        self.assertGreater(wait_time, 0)
+        self.assertEqual(limit_info, "5 per 3600s")
+
+    def test_channel_limit(self):
+        # Different users in one channel share the channel tier
+        acquired = sum(not self.acquire(user_id)[0] for user_id in range(20))
+        self.assertEqual(acquired, 8)
+        self.assertEqual(self.acquire(99)[2], "8 per 3600s (channel-wide)")
+
+    def test_server_limit(self):
+        # Different users and channels in one server share the server tier
+        acquired = sum(not self.acquire(user_id, channel_id=user_id)[0] for user_id in range(20))
+        self.assertEqual(acquired, 12)
+        self.assertEqual(self.acquire(99, channel_id=99)[2], "12 per 3600s (server-wide)")
+
+    def test_global_limit(self):
+        acquired = sum(not self.acquire(user_id, guild_id=user_id, channel_id=user_id)[0] for user_id in range(1, 40))
+        self.assertEqual(acquired, 20)
+        self.assertEqual(self.acquire(99, guild_id=99, channel_id=99)[2], "20 per 3600s (bot-wide)")
+
+    def test_command_limit(self):
+        self.limiter.update_rate_limit(None, 2, 3600, scope='server', command='insult')
+        results = [self.limiter.try_acquire(RateLimitType.INSULT, user_id, 1, 10, command='insult')[0]
+                   for user_id in range(4)]
+        self.assertEqual(results, [False, False, True, True])
+
+        # The limit only applies to that command and server
+        self.assertFalse(self.limiter.try_acquire(RateLimitType.INSULT, 5, 1, 10)[0])
+        self.assertFalse(self.limiter.try_acquire(RateLimitType.INSULT, 6, 2, 20, command='insult')[0])
+
+    def test_update_global_limit_at_runtime(self):
+        self.limiter.update_rate_limit(RateLimitType.MESSAGE, 3, 3600, scope='global')
+        acquired = sum(not self.acquire(user_id, guild_id=user_id, channel_id=user_id)[0] for user_id in range(1, 10))
+        self.assertEqual(acquired, 3)
+
+        self.limiter.update_rate_limit(RateLimitType.MESSAGE, None, None, scope='global')
+        self.assertFalse(self.acquire(99, guild_id=99, channel_id=99)[0])
+
+        with self.assertRaises(ValueError):
+            self.limiter.update_rate_limit(RateLimitType.MESSAGE, None, None)
+
+    def test_limited_request_is_not_recorded(self):
+        self.limiter.channel_rate_limits[RateLimitType.MESSAGE] = (1, 3600)
+        self.assertFalse(self.acquire(1)[0])
+        for _ in range(10):
+            self.assertTrue(self.acquire(2)[0])
+
+        # User 2 was never charged, so it still has its full allowance elsewhere
+        self.assertEqual(self.limiter.get_remaining_requests(RateLimitType.MESSAGE, 2)[0], 5)
+
+    def test_refund(self):
+        for _ in range(5):
+            self.assertFalse(self.acquire(1)[0])
+        self.assertTrue(self.acquire(1)[0])
+
+        self.limiter.refund(RateLimitType.MESSAGE, 1, 1, 10)
+        self.assertFalse(self.acquire(1)[0])
+        self.assertTrue(self.acquire(1)[0])
+
+    def test_refund_restores_every_tier(self):
+        for user_id in range(8):
+            self.assertFalse(self.acquire(user_id)[0])
+        for user_id in range(8):
+            self.limiter.refund(RateLimitType.MESSAGE, user_id, 1, 10)
+
+        acquired = sum(not self.acquire(user_id)[0] for user_id in range(100, 120))
+        self.assertEqual(acquired, 8)
+
+    def test_cost(self):
+        self.limiter.rate_limits[RateLimitType.TOKENS] = (1000, 3600)
+        self.limiter.server_rate_limits[RateLimitType.TOKENS] = (5000, 3600)
+
+        def acquire_tokens(user_id, cost):
+            return self.limiter.try_acquire(RateLimitType.TOKENS, user_id, 1, 10, cost=cost)[0]
+
+        self.assertFalse(acquire_tokens(1, 600))
+        self.assertTrue(acquire_tokens(1, 500))
+        self.assertFalse(acquire_tokens(1, 400))
+        self.assertEqual(self.limiter.get_remaining_requests(RateLimitType.TOKENS, 1)[0], 0)
+
+        # Costs known afterwards are charged without a check, and refunds give units back
+        self.limiter.add_request(RateLimitType.TOKENS, 2, 1, 10, cost=900)
+        self.assertTrue(acquire_tokens(2, 200))
+        self.limiter.refund(RateLimitType.TOKENS, 2, 1, 10, cost=900)
+        self.assertFalse(acquire_tokens(2, 200))
+
+    def test_cost_over_budget_needs_full_budget(self):
+        self.limiter.rate_limits[RateLimitType.TOKENS] = (1000, 3600)
+        self.limiter.server_rate_limits.pop(RateLimitType.TOKENS)
+
+        # One oversized request is allowed from a full budget, then nothing until it is paid back
+        self.assertFalse(self.limiter.try_acquire(RateLimitType.TOKENS, 1, cost=1500)[0])
+        is_limited, wait_time, _ = self.limiter.try_acquire(RateLimitType.TOKENS, 1, cost=1)
+        self.assertTrue(is_limited)
+        self.assertGreater(wait_time, 3600 * 0.5)
+
+    def test_command_limits_count_invocations(self):
+        self.limiter.rate_limits[RateLimitType.IMAGE] = (100, 3600)
+        self.limiter.server_rate_limits[RateLimitType.IMAGE] = (100, 3600)
+        self.limiter.update_rate_limit(None, 2, 3600, scope='global', command='generate_image')
+
+        results = [self.limiter.try_acquire(RateLimitType.IMAGE, user_id, 1, 10, command='generate_image', cost=4)[0]
+                   for user_id in range(3)]
+        self.assertEqual(results, [False, False, True])
+
+    def test_concurrent_threads(self):
+        def worker(user_id):
+            return sum(not self.acquire(user_id % 3, guild_id=1, channel_id=user_id)[0] for _ in range(50))
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            acquired = sum(executor.map(worker, range(64)))
+
+        # 3 users at 5 each, under the server limit of 12
+        self.assertEqual(acquired, 12)
+
+    def test_concurrent_add_request(self):
+        self.limiter.rate_limits[RateLimitType.TOKENS] = (1000, 3600)
+
+        def worker(_):
+            for _ in range(25):
+                self.limiter.add_request(RateLimitType.TOKENS, 1, cost=10)
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(worker, range(4)))
+
+        # Every charge lands, so the whole budget is used and nothing more fits
+        is_limited, wait_time, _ = self.limiter.try_acquire(RateLimitType.TOKENS, 1, cost=1)
+        self.assertTrue(is_limited)
+        self.assertAlmostEqual(wait_time, 3.6, delta=0.5)
+
+class TestConcurrentCoroutines(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.limiter = RateLimiter()
+        self.limiter.rate_limits[RateLimitType.MESSAGE] = (5, 3600)
+        self.limiter.server_rate_limits[RateLimitType.MESSAGE] = (12, 3600)
+
+    async def handler(self, user_id, guild_id, fail=False):
+        """Acquire like on_message does, then await a fake API call."""
+        is_limited, _, _ = self.limiter.try_acquire(RateLimitType.MESSAGE, user_id, guild_id, user_id)
+        if is_limited:
+            return False
+
+        await asyncio.sleep(0.01)
+        if fail:
+            self.limiter.refund(RateLimitType.MESSAGE, user_id, guild_id, user_id)
+            return False
+        return True
+
+    async def test_one_user(self):
+        results = await asyncio.gather(*(self.handler(1, 1) for _ in range(100)))
+        self.assertEqual(sum(results), 5)
+
+    async def test_many_users_one_server(self):
+        results = await asyncio.gather(*(self.handler(user_id % 10, 1) for user_id in range(200)))
+        self.assertEqual(sum(results), 12)
+
+    async def test_failed_calls_are_refunded(self):
+        # Every call fails, so none of them use up the limit
+        await asyncio.gather(*(self.handler(1, 1, fail=True) for _ in range(20)))
+        results = await asyncio.gather(*(self.handler(1, 1) for _ in range(20)))
+        self.assertEqual(sum(results), 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from scheduler import LLMScheduler, Priority
+
+async def settle():
+    """Let woken waiters run."""
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+class TestLLMScheduler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.scheduler = LLMScheduler(max_concurrency=1, max_wait=0)
+        self.order = []
+
+    async def queue(self, name, guild_id, priority=Priority.NORMAL):
+        """Queue a call that records when it is granted a slot."""
+        task = asyncio.ensure_future(self.scheduler.acquire(guild_id, priority))
+        task.add_done_callback(lambda _: self.order.append(name))
+        await settle()
+        return task
+
+    async def drain(self):
+        """Release the held slot until every queued call has run."""
+        while self.scheduler.queue_depth() or self.scheduler.active:
+            self.scheduler.release()
+            await settle()
+
+    async def test_lanes_are_served_in_priority_order(self):
+        await self.scheduler.acquire(1)
+        await self.queue("low", 1, Priority.LOW)
+        await self.queue("normal", 2, Priority.NORMAL)
+        await self.queue("high", 3, Priority.HIGH)
+        self.assertEqual(self.scheduler.queue_depth(), 3)
+
+        await self.drain()
+        self.assertEqual(self.order, ["high", "normal", "low"])
+
+    async def test_guilds_take_turns_within_a_lane(self):
+        await self.scheduler.acquire(1)
+        for index in range(3):
+            await self.queue(f"busy{index}", 1)
+        await self.queue("quiet", 2)
+
+        await self.drain()
+        self.assertEqual(self.order, ["busy0", "quiet", "busy1", "busy2"])
+
+    async def test_waiting_low_lane_is_not_starved(self):
+        self.scheduler.max_wait = 0.02
+        await self.scheduler.acquire(1)
+        await self.queue("low", 1, Priority.LOW)
+        await asyncio.sleep(0.03)
+
+        # Chat keeps arriving, the aged background call still goes next
+        await self.queue("normal0", 2)
+        await self.queue("normal1", 3)
+        await self.drain()
+        self.assertEqual(self.order, ["low", "normal0", "normal1"])
+        self.assertEqual(self.scheduler.get_metrics()['total_aged'], 1)
+
+    async def test_strict_priority_without_max_wait(self):
+        await self.scheduler.acquire(1)
+        await self.queue("low", 1, Priority.LOW)
+        await asyncio.sleep(0.03)
+        await self.queue("normal", 2)
+
+        await self.drain()
+        self.assertEqual(self.order, ["normal", "low"])
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        await self.scheduler.acquire(1)
+        task = await self.queue("cancelled", 1)
+        task.cancel()
+        await settle()
+        self.assertEqual(self.scheduler.queue_depth(), 0)
+
+        self.scheduler.release()
+        self.assertEqual(self.scheduler.active, 0)
+
+    async def test_wait_metrics(self):
+        await self.scheduler.acquire(1)
+        await self.queue("waiter", 2, Priority.LOW)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.scheduler.get_metrics()['queue_depth_by_priority'],
+                         {'high': 0, 'normal': 0, 'low': 1})
+
+        await self.drain()
+        metrics = self.scheduler.get_metrics()
+        self.assertEqual(metrics['total_started'], 2)
+        self.assertEqual(metrics['total_queued'], 1)
+        self.assertGreaterEqual(metrics['max_wait_seconds'], 0.01)
+        self.assertEqual(metrics['queue_depth'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import importlib.util
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from database import Database
+from sharding import ShardedDatabase, shard_path
+
+RESHARD = os.path.join(ROOT_DIR, 'tools', 'reshard.py')
+GUILDS = range(1, 8)
+
+def load_reshard():
+    """Import tools/reshard.py, which is a script rather than a module."""
+    spec = importlib.util.spec_from_file_location("reshard", RESHARD)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class TestReshardRoundTrip(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="sharding_")
+        self.source_path = os.path.join(self.temp_dir, "bot_data.db")
+        self.shard_dir = os.path.join(self.temp_dir, "shards")
+        self.past = int(time.time() * 1000) - 60000
+
+        # Long messages are stored compressed, so the shards must rebuild the search index
+        source = Database(self.source_path)
+        for guild_id in GUILDS:
+            source.update_server_persona(guild_id, f"persona{guild_id}")
+            source.set_user_preference(guild_id, 100, 'max_sentences', guild_id)
+            source.store_messages([
+                (guild_id, guild_id * 10, "user", "bob", f"hello from guild {guild_id}", None),
+                (guild_id, guild_id * 10, "assistant", None, f"pineapple {guild_id} " + "filler " * 200, None)
+            ])
+            source.add_reminder(100, guild_id * 10, guild_id, f"reminder {guild_id}", self.past)
+        source.close()
+
+    def reshard(self, shards):
+        result = subprocess.run(
+            [sys.executable, RESHARD, '--source', self.source_path, '--shard-dir', self.shard_dir,
+             '--shards', str(shards), '--prune-source'],
+            capture_output=True, text=True, cwd=self.temp_dir
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    async def check_round_trip(self, shards):
+        self.reshard(shards)
+        db = ShardedDatabase(self.source_path, self.shard_dir, shards=shards, readers=1)
+        try:
+            for guild_id in GUILDS:
+                history = await db.get_message_history(guild_id, guild_id * 10, 10)
+                self.assertEqual(len(history), 2)
+                self.assertEqual(history[0]['content'], f"hello from guild {guild_id}")
+                self.assertTrue(history[1]['content'].startswith(f"pineapple {guild_id} filler"))
+
+                results = await db.search_messages(guild_id, ["pineapple"], 10)
+                self.assertEqual(len(results), 1)
+                self.assertTrue(results[0]['content'].startswith(f"pineapple {guild_id}"))
+
+                server = await db.get_server_data(guild_id, "default")
+                self.assertEqual(server['persona'], f"persona{guild_id}")
+                preferences = await db.get_user_preferences(guild_id, 100)
+                self.assertEqual(int(preferences['max_sentences']), guild_id)
+
+            reminders = await db.get_due_reminders(int(time.time() * 1000))
+            self.assertEqual(sorted(reminder['message'] for reminder in reminders),
+                             [f"reminder {guild_id}" for guild_id in GUILDS])
+            for reminder in reminders:
+                self.assertTrue(await db.delete_reminder(reminder['id']))
+            self.assertEqual(await db.get_due_reminders(int(time.time() * 1000)), [])
+        finally:
+            db.close()
+
+        # The guild rows only live in the shards now
+        source = sqlite3.connect(self.source_path)
+        self.assertEqual(source.execute('SELECT COUNT(*) FROM messages').fetchone()[0], 0)
+        source.close()
+
+    async def test_round_trip(self):
+        await self.check_round_trip(3)
+        self.assertEqual(sorted(os.listdir(self.shard_dir)), [os.path.basename(shard_path(self.shard_dir, key))
+                                                              for key in range(3)])
+
+    async def test_smaller_shard_count_is_refused(self):
+        self.reshard(3)
+        with self.assertRaises(ValueError):
+            ShardedDatabase(self.source_path, self.shard_dir, shards=2, readers=1)
+
+class TestCopyShard(unittest.TestCase):
+    def test_more_guilds_than_bound_variables(self):
+        reshard = load_reshard()
+
+        # Old SQLite builds allow only 999 bound variables per statement
+        class LimitedDatabase(Database):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+        reshard.Database = LimitedDatabase
+
+        temp_dir = tempfile.mkdtemp(prefix="sharding_")
+        source_path = os.path.join(temp_dir, "bot_data.db")
+        source = Database(source_path)
+        source.conn.executemany("INSERT INTO servers (guild_id, persona, settings) VALUES (?, 'default', '{}')",
+                                ((guild_id,) for guild_id in range(1500)))
+        source.conn.commit()
+        guild_ids = reshard.source_guilds(source)
+        source.close()
+
+        counts = reshard.copy_shard(source_path, os.path.join(temp_dir, "shard_0.db"), guild_ids)
+        self.assertEqual(counts['servers'], 1500)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from async_database import AsyncDatabase
+from logger import BotLogger
+from scheduler import LLMScheduler
+from summarizer import ConversationSummarizer
+
+class FakeCompletions:
+    """Chat completions that record the transcripts they are asked to summarize."""
+
+    def __init__(self):
+        self.requests = []
+
+    async def create(self, messages, **kwargs):
+        self.requests.append(messages[-1]['content'])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="A summary."))])
+
+class FakeOpenAIManager:
+    def __init__(self, completions):
+        self.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    def get(self):
+        return self.client
+
+class TestConversationSummarizer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp(prefix="summarizer_")
+        self.logger = BotLogger(log_dir=os.path.join(temp_dir, "logs"))
+        self.logger.logger.setLevel(logging.CRITICAL)
+        self.db = AsyncDatabase(os.path.join(temp_dir, "bot_data.db"), readers=0)
+        self.completions = FakeCompletions()
+        self.summarizer = ConversationSummarizer(
+            self.db, FakeOpenAIManager(self.completions), LLMScheduler(), self.logger,
+            keep_recent=50, batch_size=100, max_channels=3
+        )
+
+    def tearDown(self):
+        self.db.close()
+
+    async def store(self, channel_id, count):
+        await self.db.store_messages([(1, channel_id, "user", "bob", f"message {index}", None)
+                                      for index in range(count)])
+
+    async def test_window_sets_summary_cutoff(self):
+        await self.store(10, 30)
+
+        # Without a window the last 50 messages are left alone
+        self.assertTrue(await self.summarizer.summarize_channel(1, 10))
+        self.assertEqual(self.completions.requests, [])
+
+        # The budget only kept 8, so the 22 before them are summarized
+        self.summarizer.set_window(1, 10, 8)
+        self.assertTrue(await self.summarizer.summarize_channel(1, 10))
+        transcript = self.completions.requests[0]
+        self.assertIn("message 21", transcript)
+        self.assertNotIn("message 22", transcript)
+
+        summary = await self.db.get_channel_summary(1, 10)
+        self.assertEqual(summary['summary'], "A summary.")
+
+    async def test_channels_in_memory_are_capped(self):
+        for channel_id in range(10):
+            self.summarizer.set_window(1, channel_id, 5)
+            await self.summarizer.get_summary(1, channel_id)
+
+        self.assertEqual(list(self.summarizer.summaries), [(1, 7), (1, 8), (1, 9)])
+        self.assertEqual(len(self.summarizer.windows), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from async_database import AsyncDatabase
+from database import Database
+from logger import BotLogger
+from write_buffer import MessageWriteBuffer
+
+# A NULL role breaks the NOT NULL constraint
+BAD_ROW = (1, 10, None, "bob", "broken", None)
+
+def good_row(index):
+    return (1, 10, "user", "bob", f"message {index}", None)
+
+class TestStoreMessages(unittest.TestCase):
+    def test_failed_batch_is_rolled_back(self):
+        db = Database(os.path.join(tempfile.mkdtemp(prefix="write_buffer_"), "bot_data.db"))
+        with self.assertRaises(Exception):
+            db.store_messages([good_row(0), BAD_ROW])
+
+        # Nothing from the failed batch is left to be committed by the next write
+        db.store_messages([good_row(1)])
+        self.assertEqual([message['content'] for message in db.get_message_history(1, 10, 10)], ["message 1"])
+        self.assertEqual([result['content'] for result in db.search_messages(1, ["message"], 10)], ["message 1"])
+        db.close()
+
+class TestMessageWriteBuffer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp(prefix="write_buffer_")
+        self.logger = BotLogger(log_dir=os.path.join(temp_dir, "logs"))
+        self.logger.logger.setLevel(logging.CRITICAL)
+        self.db = AsyncDatabase(os.path.join(temp_dir, "bot_data.db"), readers=0)
+
+    def tearDown(self):
+        self.db.close()
+
+    async def history(self):
+        return [message['content'] for message in await self.db.get_message_history(1, 10, 10)]
+
+    async def test_bad_row_is_dropped_after_retries(self):
+        buffer = MessageWriteBuffer(self.db, self.logger, max_retries=2)
+        for row in (good_row(0), BAD_ROW, good_row(1)):
+            buffer.add(*row)
+
+        # Retried batches are not written twice
+        self.assertEqual(await buffer.flush(), 0)
+        self.assertEqual(await buffer.flush(), 0)
+        self.assertEqual(await self.history(), [])
+        self.assertEqual(len(buffer.rows), 3)
+
+        # Past the retry limit the good rows are written and the bad one dropped
+        self.assertEqual(await buffer.flush(), 2)
+        self.assertEqual(await self.history(), ["message 0", "message 1"])
+        self.assertEqual(buffer.rows, [])
+        self.assertEqual(buffer.get_stats()['rows_dropped'], 1)
+
+    async def test_failing_flushes_back_off(self):
+        buffer = MessageWriteBuffer(self.db, self.logger, max_delay_ms=0, max_retries=100)
+        calls = 0
+        store_messages = self.db.store_messages
+
+        async def failing_store(rows):
+            nonlocal calls
+            calls += 1
+            raise RuntimeError("disk full")
+        self.db.store_messages = failing_store
+
+        buffer.start()
+        buffer.add(*good_row(0))
+        await asyncio.sleep(0.3)
+
+        # Without a delay the retries used to spin, now they wait between attempts
+        self.assertEqual(calls, 1)
+        self.db.store_messages = store_messages
+        await buffer.close()
+        self.assertEqual(await self.history(), ["message 0"])
+
+if __name__ == '__main__':
+    unittest.main()
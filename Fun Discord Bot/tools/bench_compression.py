@@ -0,0 +1,174 @@
+"""
+Benchmark for message content compression.
+
+Compares storing messages as plain text against zlib and zstd (with and without a
+trained dictionary) at several size thresholds. Reports stored size, compression
+ratio, encode/decode time per message, the resulting database file size and the time
+to load a channel's history.
+
+The corpus is either read from an existing bot database or generated: short chat
+messages, multi-sentence assistant replies and occasional pasted logs/code.
+
+Example:
+    python tools/bench_compression.py --messages 20000 --thresholds 0,256,512,1024
+    python tools/bench_compression.py --db data/bot_data.db --save-dict data/messages.dict
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TOOLS_DIR), "src"))
+sys.path.insert(0, TOOLS_DIR)
+
+from compression import ContentCodec, zstandard
+from database import Database
+from fake_openai import WORDS, make_reply
+
+LOG_LINES = [
+    "ERROR 2024-05-01 12:00:{s:02d} worker-{n} failed to connect to db: timeout after 30s",
+    "WARN  2024-05-01 12:00:{s:02d} retrying request id={n} attempt=3",
+    "    at com.example.Service.handle(Service.java:{n})",
+    "def handler(event, context):\n    return {{'status': {n}, 'body': json.dumps(event)}}",
+]
+
+def synthetic_corpus(count, seed):
+    """Generate a mix of chat messages, replies and pasted text."""
+    random.seed(seed)
+    corpus = []
+    for _ in range(count):
+        kind = random.random()
+        if kind < 0.5:
+            # Short user chat
+            corpus.append(' '.join(random.choices(WORDS, k=random.randint(3, 30))))
+        elif kind < 0.95:
+            # Assistant reply
+            corpus.append(''.join(make_reply(2, 10, 500)))
+        else:
+            # Pasted logs or code
+            lines = [random.choice(LOG_LINES).format(s=random.randint(0, 59), n=random.randint(1, 999))
+                     for _ in range(random.randint(5, 40))]
+            corpus.append('\n'.join(lines))
+    return corpus
+
+def database_corpus(path, count):
+    """Read message content from an existing bot database."""
+    db = Database(path, create_tables=False, pragmas={})
+    cursor = db.conn.cursor()
+    cursor.execute('SELECT content, encoding FROM messages ORDER BY id DESC LIMIT ?', (count,))
+    corpus = [db.codec.decode(row['content'], row['encoding']) for row in cursor.fetchall()]
+    db.close()
+    return corpus
+
+def bench_codec(codec, corpus):
+    """Measure stored size and per-message encode/decode time."""
+    start = time.perf_counter()
+    encoded = [codec.encode(text) for text in corpus]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for value, encoding in encoded:
+        codec.decode(value, encoding)
+    decode_time = time.perf_counter() - start
+
+    stored = sum(len(value.encode('utf-8')) if isinstance(value, str) else len(value) for value, _ in encoded)
+    compressed = sum(1 for _, encoding in encoded if encoding)
+    return {
+        'stored_bytes': stored,
+        'compressed_share': compressed / len(corpus),
+        'encode_us': encode_time / len(corpus) * 1e6,
+        'decode_us': decode_time / len(corpus) * 1e6
+    }
+
+def bench_database(codec, corpus, channels, history_limit):
+    """Store the corpus in a scratch database and time history reads."""
+    workdir = tempfile.mkdtemp(prefix="bench_compression_")
+    path = os.path.join(workdir, "bench.db")
+    db = Database(path, codec=codec)
+
+    rows = [(1, index % channels, 'user' if index % 2 else 'assistant', 'user', text, None)
+            for index, text in enumerate(corpus)]
+    for start in range(0, len(rows), 500):
+        db.store_messages(rows[start:start + 500])
+    db.checkpoint('TRUNCATE')
+
+    start = time.perf_counter()
+    for channel in range(channels):
+        db.get_message_history(1, channel, history_limit)
+    history_ms = (time.perf_counter() - start) / channels * 1000
+
+    db.close()
+    file_bytes = os.path.getsize(path)
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+    return {'file_bytes': file_bytes, 'history_ms': history_ms}
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark message content compression")
+    parser.add_argument('--db', default=None, help="Read the corpus from an existing bot database")
+    parser.add_argument('--messages', type=int, default=20000, help="Corpus size")
+    parser.add_argument('--thresholds', default="0,256,512,1024", help="Comma-separated size thresholds in bytes")
+    parser.add_argument('--channels', type=int, default=100, help="Channels the corpus is spread over")
+    parser.add_argument('--history-limit', type=int, default=50, help="Messages loaded per history read")
+    parser.add_argument('--dict-size', type=int, default=16384, help="Trained zstd dictionary size")
+    parser.add_argument('--save-dict', default=None, help="Write the trained dictionary to this file")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+def main():
+    """Run the benchmark."""
+    args = parse_args()
+
+    if args.db:
+        corpus = database_corpus(args.db, args.messages)
+    else:
+        corpus = synthetic_corpus(args.messages, args.seed)
+    if not corpus:
+        print("No messages to benchmark")
+        return
+
+    raw_bytes = sum(len(text.encode('utf-8')) for text in corpus)
+    print(f"Corpus: {len(corpus)} messages, {raw_bytes} bytes, "
+          f"median {sorted(len(t) for t in corpus)[len(corpus) // 2]} chars\n")
+
+    configs = [("zlib-1", "zlib", 1, None), ("zlib-6", "zlib", 6, None), ("zlib-9", "zlib", 9, None)]
+    if zstandard is not None:
+        # Train on a sample so the dictionary isn't scored on exactly what it memorized
+        sample = random.Random(args.seed).sample(corpus, min(len(corpus), 5000))
+        dictionary = ContentCodec.train_dictionary(sample, args.dict_size)
+        if args.save_dict:
+            with open(args.save_dict, 'wb') as f:
+                f.write(dictionary)
+            print(f"Saved {len(dictionary)} byte dictionary to {args.save_dict}\n")
+        configs += [("zstd-1", "zstd", 1, None), ("zstd-3", "zstd", 3, None), ("zstd-19", "zstd", 19, None),
+                    ("zstd-3+dict", "zstd", 3, dictionary)]
+    else:
+        print("zstandard is not installed, skipping zstd\n")
+
+    print(f"{'codec':<14}{'threshold':>10}{'stored':>12}{'ratio':>8}{'compressed':>12}"
+          f"{'enc us':>9}{'dec us':>9}{'db file':>12}{'history ms':>12}")
+
+    baseline = ContentCodec("none")
+    plain = bench_codec(baseline, corpus)
+    plain_db = bench_database(baseline, corpus, args.channels, args.history_limit)
+    print(f"{'none':<14}{'-':>10}{plain['stored_bytes']:>12}{1.0:>8.2f}{0:>11.0%}"
+          f"{plain['encode_us']:>9.1f}{plain['decode_us']:>9.1f}{plain_db['file_bytes']:>12}{plain_db['history_ms']:>12.3f}")
+
+    for threshold in [int(t) for t in args.thresholds.split(',')]:
+        for name, method, level, dictionary in configs:
+            codec = ContentCodec(method, threshold=threshold, level=level, dictionary=dictionary)
+            result = bench_codec(codec, corpus)
+            db_result = bench_database(codec, corpus, args.channels, args.history_limit)
+            print(f"{name:<14}{threshold:>10}{result['stored_bytes']:>12}"
+                  f"{raw_bytes / result['stored_bytes']:>8.2f}{result['compressed_share']:>11.0%}"
+                  f"{result['encode_us']:>9.1f}{result['decode_us']:>9.1f}"
+                  f"{db_result['file_bytes']:>12}{db_result['history_ms']:>12.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Micro-benchmark for the rate limiter.
+
+Compares the GCRA limiter in src/rate_limiting.py against the timestamp-list limiter
+kept in archive/rate_limiting.py. Each run sends check-then-record traffic for a set of
+users spread over guilds, as on_message does, and reports the time per check and the
+memory held by the limiter state afterwards. Limit sizes are varied because the old
+limiter's cost grows with the number of timestamps it keeps per key.
+
+Limiter log output is switched off so the numbers measure the limiter itself.
+
+Example:
+    python tools/bench_rate_limiter.py --limits 10,100,1000 --users 1,1000,10000
+"""
+import argparse
+import gc
+import importlib.util
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TOOLS_DIR)
+
+def load_module(name, path):
+    """Import a module from a file under its own name."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def drive(module, limit, traffic):
+    """Send check-then-record traffic through a new limiter and return it with the limited count."""
+    limiter = module.RateLimiter()
+    message = module.RateLimitType.MESSAGE
+    limiter.rate_limits[message] = (limit, 60)
+    limiter.server_rate_limits[message] = (limit * 10, 60)
+
+    # The archived limiter only has user and server tiers
+    for name in ('channel_rate_limits', 'global_rate_limits'):
+        if hasattr(limiter, name):
+            setattr(limiter, name, {})
+
+    limited = 0
+    for user_id, guild_id in traffic:
+        if limiter.is_rate_limited(message, user_id, guild_id)[0]:
+            limited += 1
+        else:
+            limiter.add_request(message, user_id, guild_id)
+    return limiter, limited
+
+def run(module, limit, users, guilds, operations, seed):
+    """
+    Benchmark one limiter.
+
+    Returns:
+        dict: Time per operation, share of limited checks and state size in bytes
+    """
+    rng = random.Random(seed)
+    traffic = [(user, user % guilds) for user in (rng.randrange(users) for _ in range(operations))]
+
+    gc.collect()
+    start = time.perf_counter()
+    _, limited = drive(module, limit, traffic)
+    elapsed = time.perf_counter() - start
+
+    # Memory is measured on a second pass, tracing allocations slows everything down
+    gc.collect()
+    tracemalloc.start()
+    limiter, _ = drive(module, limit, traffic)
+    state_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del limiter
+
+    return {
+        'op_us': elapsed / operations * 1e6,
+        'limited': limited / operations,
+        'state_bytes': state_bytes
+    }
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark the rate limiter against the archived version")
+    parser.add_argument('--limits', default="10,100,1000", help="Comma-separated requests per window")
+    parser.add_argument('--users', default="1,1000,10000", help="Comma-separated numbers of distinct users")
+    parser.add_argument('--guilds', type=int, default=100, help="Guilds the users are spread over")
+    parser.add_argument('--operations', type=int, default=50000, help="Checks per run")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+def main():
+    """Run the benchmark."""
+    args = parse_args()
+
+    # Both modules create data/bot.log relative to the working directory on import
+    os.chdir(tempfile.mkdtemp(prefix="bench_rate_limiter_"))
+    current = load_module("rate_limiting", os.path.join(ROOT_DIR, "src", "rate_limiting.py"))
+    archived = load_module("archive_rate_limiting", os.path.join(ROOT_DIR, "archive", "rate_limiting.py"))
+    logging.getLogger('discord_bot').setLevel(logging.CRITICAL)
+
+    print(f"{'limit':>7}{'users':>8}{'archive us':>12}{'gcra us':>10}{'speedup':>9}"
+          f"{'archive KiB':>13}{'gcra KiB':>10}{'archive lim':>13}{'gcra lim':>10}")
+    for limit in [int(value) for value in args.limits.split(',')]:
+        for users in [int(value) for value in args.users.split(',')]:
+            old = run(archived, limit, users, args.guilds, args.operations, args.seed)
+            new = run(current, limit, users, args.guilds, args.operations, args.seed)
+            print(f"{limit:>7}{users:>8}{old['op_us']:>12.2f}{new['op_us']:>10.2f}"
+                  f"{old['op_us'] / new['op_us']:>8.1f}x"
+                  f"{old['state_bytes'] / 1024:>13.0f}{new['state_bytes'] / 1024:>10.0f}"
+                  f"{old['limited']:>12.1%}{new['limited']:>10.1%}")
+
+if __name__ == "__main__":
+    main()
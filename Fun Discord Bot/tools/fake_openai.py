@@ -0,0 +1,339 @@
+"""
+Local OpenAI stand-in server for offline load testing.
+
+Implements the endpoints the bot uses:
+  POST /v1/chat/completions   (including stream=true server-sent events)
+  POST /v1/images/generations (returns URLs served by this process)
+  GET  /images/<id>.png
+
+Point the bot at it with OPENAI_BASE_URL=http://127.0.0.1:8089/v1 (any OPENAI_API_KEY works).
+
+Example:
+    python tools/fake_openai.py --latency lognormal:-1.5,0.5 --tokens-per-second 40 \
+        --error-rate 0.01 --rate-limit-rate 0.05
+"""
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "democracy freedom liberty mission orders diver squad planet sector launch "
+    "report status supply drop reinforce extract objective patrol signal ready "
+    "coffee donut sandwich couch remote garage weekend barbecue cousin neighbor"
+).split()
+
+class LatencyModel:
+    """Samples request latencies from a configured distribution."""
+
+    def __init__(self, spec):
+        """
+        Initialize the latency model.
+
+        Args:
+            spec: Distribution spec such as "fixed:0.2", "uniform:0.1,0.5",
+                  "normal:0.3,0.1", "lognormal:-1.5,0.5" or "exp:0.3" (seconds)
+        """
+        name, _, params = spec.partition(':')
+        self.name = name
+        self.params = [float(p) for p in params.split(',')] if params else []
+
+        if self.name not in ("fixed", "uniform", "normal", "lognormal", "exp"):
+            raise ValueError(f"Unknown latency distribution: {self.name}")
+
+    def sample(self):
+        """Get one latency sample in seconds."""
+        if self.name == "fixed":
+            value = self.params[0] if self.params else 0.0
+        elif self.name == "uniform":
+            value = random.uniform(self.params[0], self.params[1])
+        elif self.name == "normal":
+            value = random.gauss(self.params[0], self.params[1])
+        elif self.name == "lognormal":
+            value = random.lognormvariate(self.params[0], self.params[1])
+        else:
+            value = random.expovariate(1.0 / self.params[0])
+        return max(0.0, value)
+
+class FakeOpenAIState:
+    """Configuration and counters shared by all request handlers."""
+
+    def __init__(self, args):
+        self.latency = LatencyModel(args.latency)
+        self.image_latency = LatencyModel(args.image_latency)
+        self.tokens_per_second = args.tokens_per_second
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.min_sentences = args.min_sentences
+        self.max_sentences = args.max_sentences
+        self.public_url = args.public_url or f"http://{args.host}:{args.port}"
+
+        self.lock = threading.Lock()
+        self.counters = {
+            'chat': 0,
+            'chat_stream': 0,
+            'images': 0,
+            'errors_injected': 0,
+            'rate_limits_injected': 0,
+            'stream_aborted': 0
+        }
+
+    def count(self, name):
+        """Increment a counter."""
+        with self.lock:
+            self.counters[name] += 1
+
+def make_reply(min_sentences, max_sentences, max_tokens):
+    """Build a random reply as a list of word tokens."""
+    tokens = []
+    for _ in range(random.randint(min_sentences, max_sentences)):
+        words = random.choices(WORDS, k=random.randint(5, 14))
+        words[0] = words[0].capitalize()
+        sentence = [f"{word} " for word in words]
+        sentence[-1] = sentence[-1].strip() + random.choice(".!?") + " "
+        tokens.extend(sentence)
+
+    tokens = tokens[:max_tokens]
+    if tokens:
+        tokens[-1] = tokens[-1].rstrip()
+    return tokens
+
+def count_prompt_tokens(messages):
+    """Estimate prompt tokens the same way the bot does without tiktoken."""
+    return sum(4 + (len(str(m.get('content') or '')) + 3) // 4 for m in messages)
+
+def make_png(seed):
+    """Build a small solid-colour PNG derived from a seed string."""
+    digest = hashlib.sha256(seed.encode('utf-8')).digest()
+    width = height = 64
+    row = b'\x00' + bytes(digest[:3]) * width
+    raw = row * height
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data
+                + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw))
+            + chunk(b'IEND', b''))
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Request handler implementing the OpenAI endpoints the bot uses."""
+
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        """Silence per-request logging."""
+
+    def do_POST(self):
+        """Handle chat completion and image generation requests."""
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_error(400, "invalid_request_error", "Invalid JSON body")
+            return
+
+        path = self.path.split('?')[0].rstrip('/')
+        if path.endswith('/chat/completions'):
+            self._chat_completions(body)
+        elif path.endswith('/images/generations'):
+            self._image_generations(body)
+        else:
+            self._send_error(404, "invalid_request_error", f"Unknown endpoint {self.path}")
+
+    def do_GET(self):
+        """Serve generated images."""
+        path = self.path.split('?')[0]
+        if path.startswith('/images/') and path.endswith('.png'):
+            data = make_png(path)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path == '/stats':
+            with self.state.lock:
+                self._send_json(200, dict(self.state.counters))
+        else:
+            self._send_error(404, "invalid_request_error", f"Unknown path {self.path}")
+
+    def _inject_failure(self):
+        """Randomly fail the request with a 429 or 500. Returns True if it failed."""
+        roll = random.random()
+        if roll < self.state.rate_limit_rate:
+            self.state.count('rate_limits_injected')
+            self._send_error(429, "rate_limit_exceeded", "Rate limit reached (injected)",
+                             headers={'Retry-After': '1'})
+            return True
+        if roll < self.state.rate_limit_rate + self.state.error_rate:
+            self.state.count('errors_injected')
+            self._send_error(500, "server_error", "Internal error (injected)")
+            return True
+        return False
+
+    def _chat_completions(self, body):
+        """Handle POST /chat/completions."""
+        if self._inject_failure():
+            return
+
+        model = body.get('model', 'gpt-3.5-turbo')
+        max_tokens = int(body.get('max_tokens') or 500)
+        prompt_tokens = count_prompt_tokens(body.get('messages', []))
+        tokens = make_reply(self.state.min_sentences, self.state.max_sentences, max_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        # Time to first token
+        time.sleep(self.state.latency.sample())
+
+        if body.get('stream'):
+            self.state.count('chat_stream')
+            self._stream_chat(completion_id, created, model, tokens)
+            return
+
+        self.state.count('chat')
+
+        # Simulate generation time for the whole reply
+        if self.state.tokens_per_second > 0:
+            time.sleep(len(tokens) / self.state.tokens_per_second)
+
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                'finish_reason': 'stop' if len(tokens) < max_tokens else 'length'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': len(tokens),
+                'total_tokens': prompt_tokens + len(tokens)
+            }
+        })
+
+    def _stream_chat(self, completion_id, created, model, tokens):
+        """Send a reply as server-sent events at the configured token rate."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish_reason=None):
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        delay = 1.0 / self.state.tokens_per_second if self.state.tokens_per_second > 0 else 0.0
+        try:
+            event({'role': 'assistant', 'content': ''})
+            for token in tokens:
+                if delay:
+                    time.sleep(delay)
+                event({'content': token})
+            event({}, 'stop')
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early
+            self.state.count('stream_aborted')
+
+    def _image_generations(self, body):
+        """Handle POST /images/generations."""
+        if self._inject_failure():
+            return
+
+        time.sleep(self.state.image_latency.sample())
+        self.state.count('images')
+
+        image_id = hashlib.sha256(
+            f"{body.get('prompt', '')}{random.random()}".encode('utf-8')
+        ).hexdigest()[:32]
+
+        self._send_json(200, {
+            'created': int(time.time()),
+            'data': [{
+                'url': f"{self.state.public_url}/images/{image_id}.png",
+                'revised_prompt': body.get('prompt', '')
+            }]
+        })
+
+    def _send_json(self, status, payload, headers=None):
+        """Send a JSON response."""
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, error_type, message, headers=None):
+        """Send an OpenAI-style error response."""
+        self._send_json(status, {
+            'error': {'message': message, 'type': error_type, 'param': None, 'code': error_type}
+        }, headers)
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Local OpenAI stand-in for load testing the bot")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--public-url', default=None,
+                        help="Base URL used in returned image links (default: http://host:port)")
+    parser.add_argument('--latency', default='lognormal:-1.5,0.5',
+                        help="Time-to-first-token distribution, e.g. fixed:0.2, uniform:0.1,0.5, "
+                             "normal:0.3,0.1, lognormal:-1.5,0.5, exp:0.3")
+    parser.add_argument('--image-latency', default='uniform:2,6',
+                        help="Image generation latency distribution")
+    parser.add_argument('--tokens-per-second', type=float, default=50.0,
+                        help="Simulated generation speed (0 for instant)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of requests answered with a 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                        help="Fraction of requests answered with a 429")
+    parser.add_argument('--min-sentences', type=int, default=2)
+    parser.add_argument('--max-sentences', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args()
+
+def main():
+    """Run the stand-in server."""
+    args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    FakeOpenAIHandler.state = FakeOpenAIState(args)
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    server.daemon_threads = True
+
+    print(f"Fake OpenAI listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
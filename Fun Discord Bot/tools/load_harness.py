@@ -0,0 +1,569 @@
+"""
+Synthetic gateway load harness for the bot's event handlers.
+
+Imports src/bot.py, swaps the OpenAI client for an in-process fake (or points it at
+tools/fake_openai.py), and replays a configurable mix of fake mentions and slash
+commands across many guilds against the real handlers. Reports throughput,
+p50/p95/p99 latency per event type, time spent in selected bot functions and
+event-loop lag.
+
+The bot's configuration is read from the environment as usual, so e.g.
+STREAM_RESPONSES=false or CONTEXT_TOKEN_BUDGET=800 can be set in front of the command.
+
+Example:
+    python tools/load_harness.py --rate 300 --duration 30 --guilds 2000 \
+        --mix message=0.9,set_response_length=0.04,remindme=0.03,persona=0.02,insult=0.01
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(TOOLS_DIR), "src")
+sys.path.insert(0, TOOLS_DIR)
+
+from fake_openai import LatencyModel, make_png, make_reply
+
+EVENT_TYPES = ("message", "persona", "insult", "set_response_length", "remindme", "generate_image")
+
+# ---------------------------------------------------------------------------
+# Fake OpenAI client
+# ---------------------------------------------------------------------------
+
+class FakeStream:
+    """Async iterator mimicking an OpenAI chat completion stream."""
+
+    def __init__(self, tokens, tokens_per_second):
+        self.tokens = tokens
+        self.delay = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for token in self.tokens:
+            if self.closed:
+                return
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            delta = types.SimpleNamespace(content=token)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+    async def close(self):
+        self.closed = True
+
+class FakeChatCompletions:
+    """In-process stand-in for client.chat.completions."""
+
+    def __init__(self, args):
+        self.latency = LatencyModel(args.latency)
+        self.tokens_per_second = args.tokens_per_second
+        self.error_rate = args.error_rate
+        self.calls = 0
+
+    async def create(self, model=None, messages=None, max_tokens=500, stream=False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        if random.random() < self.error_rate:
+            raise RuntimeError("Injected OpenAI error")
+
+        tokens = make_reply(2, 8, max_tokens)
+
+        # Insult pool refills expect one template per line
+        if messages and "{name}" in str(messages[-1].get('content', '')):
+            tokens = [f"{{name}} is {' '.join(random.choices(['slow', 'odd', 'loud', 'lost'], k=3))}\n"
+                      for _ in range(10)]
+
+        if stream:
+            return FakeStream(tokens, self.tokens_per_second)
+
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(len(tokens) / self.tokens_per_second)
+
+        prompt_tokens = sum(4 + len(str(m.get('content') or '')) // 4 for m in messages or [])
+        message = types.SimpleNamespace(content=''.join(tokens))
+        usage = types.SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=len(tokens),
+            total_tokens=prompt_tokens + len(tokens)
+        )
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+class FakeImages:
+    """In-process stand-in for client.images."""
+
+    def __init__(self, args):
+        self.latency = LatencyModel(args.image_latency)
+        self.calls = 0
+
+    async def generate(self, prompt=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        image = types.SimpleNamespace(url=f"fake://images/{random.getrandbits(64):x}.png")
+        return types.SimpleNamespace(data=[image])
+
+class FakeOpenAI:
+    """In-process stand-in for openai.AsyncOpenAI."""
+
+    def __init__(self, args):
+        self.chat = types.SimpleNamespace(completions=FakeChatCompletions(args))
+        self.images = FakeImages(args)
+
+    async def close(self):
+        pass
+
+class FakeDownloadClient:
+    """Stand-in for the image job queue's httpx client."""
+
+    async def get(self, url):
+        return types.SimpleNamespace(content=make_png(url), raise_for_status=lambda: None)
+
+    async def aclose(self):
+        pass
+
+# ---------------------------------------------------------------------------
+# Fake Discord objects
+# ---------------------------------------------------------------------------
+
+_ids = itertools.count(10 ** 17)
+
+def next_id():
+    """Get a new snowflake-like ID."""
+    return next(_ids)
+
+class FakeSentMessage:
+    """A message the bot sent."""
+
+    def __init__(self, content):
+        self.id = next_id()
+        self.content = content
+        self.edits = 0
+
+    async def edit(self, content=None, **kwargs):
+        self.edits += 1
+        self.content = content
+
+class FakeUser:
+    """Minimal discord.Member replacement."""
+
+    def __init__(self, guild, user_id=None, name=None, bot=False, moderator=False, admin=False):
+        self.id = user_id or next_id()
+        self.name = name or f"user{self.id % 100000}"
+        self.display_name = self.name
+        self.mention = f"<@{self.id}>"
+        self.bot = bot
+        self.guild = guild
+        self.guild_permissions = types.SimpleNamespace(
+            administrator=admin,
+            manage_messages=moderator,
+            ban_members=False,
+            kick_members=False,
+            manage_channels=False
+        )
+
+    async def send(self, *args, **kwargs):
+        return FakeSentMessage(args[0] if args else "")
+
+    async def edit(self, **kwargs):
+        pass
+
+class FakeChannel:
+    """Minimal text channel replacement."""
+
+    def __init__(self, guild, backlog):
+        self.id = next_id()
+        self.guild = guild
+        self.members = guild.members
+        self.backlog = backlog
+
+    def history(self, limit=None, before=None):
+        return self._history(limit)
+
+    async def _history(self, limit):
+        # Newest first, like Discord
+        for _ in range(min(limit or 0, self.backlog)):
+            author = random.choice(self.guild.members)
+            yield types.SimpleNamespace(
+                author=author,
+                content=''.join(make_reply(1, 3, 60))
+            )
+
+    async def send(self, content=None, **kwargs):
+        return FakeSentMessage(content)
+
+    async def purge(self, limit=None):
+        await asyncio.sleep(0)
+        return [None] * (limit or 0)
+
+class FakeGuild:
+    """Minimal guild replacement."""
+
+    def __init__(self, users, channels, backlog):
+        self.id = next_id()
+        self.name = f"guild{self.id % 100000}"
+        self.members = []
+        self.owner_id = None
+        for index in range(users):
+            self.members.append(FakeUser(self, moderator=index == 0, admin=index == 0))
+        self.owner_id = self.members[0].id
+        self.me = FakeUser(self, bot=True)
+        self.channels = [FakeChannel(self, backlog) for _ in range(channels)]
+
+class FakeMessage:
+    """An incoming message that mentions the bot."""
+
+    def __init__(self, bot_user, author, channel, content):
+        self.id = next_id()
+        self.author = author
+        self.guild = channel.guild
+        self.channel = channel
+        self.mentions = [bot_user]
+        self.content = f"<@{bot_user.id}> {content}"
+        self.replies = []
+
+    async def reply(self, content=None, **kwargs):
+        sent = FakeSentMessage(content)
+        self.replies.append(sent)
+        return sent
+
+class FakeResponse:
+    """interaction.response replacement."""
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+        self.interaction.sent.append(content)
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+class FakeFollowup:
+    """interaction.followup replacement."""
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self.interaction.sent.append(content)
+        return FakeSentMessage(content)
+
+class FakeInteraction:
+    """A slash command interaction."""
+
+    def __init__(self, user, channel):
+        self.user = user
+        self.guild = channel.guild
+        self.guild_id = channel.guild.id
+        self.channel = channel
+        self.channel_id = channel.id
+        self.sent = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    """Get a percentile from a sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(values):
+    """Get count, p50, p95, p99 and max of a list of durations in seconds."""
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 0.50) * 1000,
+        'p95_ms': percentile(values, 0.95) * 1000,
+        'p99_ms': percentile(values, 0.99) * 1000,
+        'max_ms': (values[-1] if values else 0.0) * 1000
+    }
+
+class Timings:
+    """Collects durations of wrapped bot functions."""
+
+    def __init__(self):
+        self.values = defaultdict(list)
+
+    def wrap(self, module, name):
+        """Replace module.name with a timing wrapper."""
+        original = getattr(module, name)
+
+        if asyncio.iscoroutinefunction(original):
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.values[name].append(time.perf_counter() - start)
+        else:
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.values[name].append(time.perf_counter() - start)
+
+        setattr(module, name, wrapper)
+
+async def monitor_loop_lag(interval, samples, stop):
+    """Measure how late the event loop wakes up a sleeping task."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+# ---------------------------------------------------------------------------
+# Harness
+# ---------------------------------------------------------------------------
+
+def parse_mix(spec):
+    """Parse a traffic mix like "message=0.9,insult=0.1"."""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type in mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+class LoadHarness:
+    """Drives the real handlers with synthetic traffic."""
+
+    def __init__(self, bot_module, args):
+        self.bot_module = bot_module
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self.timings = Timings()
+        self.loop_lag = []
+        self.guilds = []
+
+    def setup(self):
+        """Create fake guilds and patch the bot for offline use."""
+        bot_module = self.bot_module
+        bot = bot_module.bot
+
+        # The bot needs a user to compare mentions against
+        bot_user = FakeUser(None, name="LoadTestBot", bot=True)
+        bot._connection.user = bot_user
+        self.bot_user = bot_user
+
+        # Prefix commands are not used and need real message state
+        async def process_commands(message):
+            return None
+        bot.process_commands = process_commands
+
+        # Swap in the fake OpenAI client unless a stand-in server is used
+        if not self.args.openai_base_url:
+            bot_module.openai_manager.client = FakeOpenAI(self.args)
+        else:
+            bot_module.openai_manager.base_url = self.args.openai_base_url
+
+        for name in ("get_message_history", "store_message"):
+            self.timings.wrap(bot_module, name)
+        self.timings.wrap(bot_module.rate_limiter, "try_acquire")
+
+        random.seed(self.args.seed)
+        for _ in range(self.args.guilds):
+            self.guilds.append(FakeGuild(self.args.users_per_guild, self.args.channels_per_guild,
+                                         self.args.backlog))
+
+    async def run(self):
+        """Replay traffic for the configured duration and return the elapsed time."""
+        bot_module = self.bot_module
+        bot_module.openai_manager.get()
+        bot_module.image_jobs.start()
+        bot_module.message_buffer.start()
+        await bot_module.warm_insult_pools()
+        if not self.args.openai_base_url:
+            await bot_module.image_jobs.http_client.aclose()
+            bot_module.image_jobs.http_client = FakeDownloadClient()
+
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(monitor_loop_lag(0.01, self.loop_lag, stop))
+
+        kinds = list(self.mix)
+        weights = [self.mix[kind] for kind in kinds]
+        tasks = set()
+
+        # Hot guilds get more traffic than the long tail
+        guild_weights = [1.0 / (index + 1) ** self.args.guild_skew for index in range(len(self.guilds))]
+
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(random.expovariate(self.args.rate))
+            kind = random.choices(kinds, weights)[0]
+            guild = random.choices(self.guilds, guild_weights)[0]
+            task = asyncio.create_task(self._dispatch(kind, guild))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.args.drain_timeout)
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await lag_task
+        await bot_module.image_jobs.stop()
+        await bot_module.message_buffer.close()
+        return elapsed
+
+    async def _dispatch(self, kind, guild):
+        """Run one synthetic event through the real handler and time it."""
+        bot_module = self.bot_module
+        channel = random.choice(guild.channels)
+        user = random.choice(guild.members)
+
+        start = time.perf_counter()
+        try:
+            if kind == "message":
+                message = FakeMessage(self.bot_user, user, channel, random.choice(PROMPTS))
+                await bot_module.on_message(message)
+                outcome = self._classify([r.content for r in message.replies])
+            else:
+                # Commands that need a moderator or admin run as the guild owner
+                if kind in ("persona", "insult", "generate_image"):
+                    user = guild.members[0]
+                interaction = FakeInteraction(user, channel)
+                await self._run_command(kind, interaction, guild)
+                outcome = self._classify(interaction.sent)
+        except Exception as e:
+            outcome = f"exception:{type(e).__name__}"
+
+        self.latencies[kind].append(time.perf_counter() - start)
+        self.outcomes[kind][outcome] += 1
+
+    async def _run_command(self, kind, interaction, guild):
+        """Invoke a slash command callback."""
+        bot_module = self.bot_module
+        if kind == "persona":
+            persona = random.choice(list(bot_module.personas))
+            await bot_module.change_persona.callback(interaction, persona)
+        elif kind == "insult":
+            await bot_module.insult_user.callback(interaction, random.choice(guild.members[1:] or guild.members))
+        elif kind == "set_response_length":
+            await bot_module.set_response_length.callback(interaction, random.randint(0, 10))
+        elif kind == "remindme":
+            await bot_module.remind_me.callback(interaction, f"{random.randint(1, 59)}m", "load test reminder")
+        elif kind == "generate_image":
+            await bot_module.generate_image.callback(interaction, random.choice(IMAGE_PROMPTS))
+
+    @staticmethod
+    def _classify(sent):
+        """Classify an event by the bot's reply."""
+        text = " ".join(str(s) for s in sent if s)
+        if "too quickly" in text:
+            return "rate_limited"
+        if "error" in text.lower() or "sorry" in text.lower():
+            return "error"
+        return "ok"
+
+    def report(self, elapsed):
+        """Print the results."""
+        total = sum(len(values) for values in self.latencies.values())
+        print(f"\nEvents: {total} in {elapsed:.1f}s -> {total / elapsed:.1f} events/s "
+              f"({self.args.guilds} guilds, target {self.args.rate}/s)\n")
+
+        print(f"{'event':<22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  outcomes")
+        for kind in EVENT_TYPES:
+            if kind not in self.latencies:
+                continue
+            stats = summarize(self.latencies[kind])
+            outcomes = ", ".join(f"{name}={count}" for name, count in sorted(self.outcomes[kind].items()))
+            print(f"{kind:<22}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+                  f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}  {outcomes}")
+
+        print(f"\n{'function':<22}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, values in sorted(self.timings.values.items()):
+            stats = summarize(values)
+            print(f"{name:<22}{stats['count']:>8}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}"
+                  f"{stats['p99_ms']:>10.3f}{stats['max_ms']:>10.3f}")
+
+        lag = summarize(self.loop_lag)
+        print(f"\nEvent loop lag: p50 {lag['p50_ms']:.1f} ms, p95 {lag['p95_ms']:.1f} ms, "
+              f"p99 {lag['p99_ms']:.1f} ms, max {lag['max_ms']:.1f} ms")
+        print(f"LLM scheduler: {self.bot_module.llm_scheduler.get_metrics()}")
+        print(f"Message write buffer: {self.bot_module.message_buffer.get_stats()}")
+
+PROMPTS = [
+    "hi", "who are you", "tell me a joke", "what's the plan for tonight?",
+    "summarize the last thing we talked about", "give me a motivational quote",
+    "what do you think about pineapple on pizza?", "explain black holes like I'm five",
+]
+
+IMAGE_PROMPTS = ["a cat in space", "a robot making pancakes", "a castle made of cheese"]
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Synthetic gateway load harness for the bot")
+    parser.add_argument('--rate', type=float, default=100.0, help="Average events per second")
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds of traffic to generate")
+    parser.add_argument('--drain-timeout', type=float, default=60.0,
+                        help="Seconds to wait for in-flight events after traffic stops")
+    parser.add_argument('--guilds', type=int, default=500)
+    parser.add_argument('--channels-per-guild', type=int, default=3)
+    parser.add_argument('--users-per-guild', type=int, default=20)
+    parser.add_argument('--guild-skew', type=float, default=1.0,
+                        help="Zipf exponent for picking guilds (0 for uniform)")
+    parser.add_argument('--backlog', type=int, default=10,
+                        help="Messages returned by channel.history for channels without stored history")
+    parser.add_argument('--mix', default="message=0.9,set_response_length=0.04,remindme=0.03,persona=0.02,insult=0.01",
+                        help="Traffic mix of " + ", ".join(EVENT_TYPES))
+    parser.add_argument('--latency', default='lognormal:-1.5,0.5', help="Fake OpenAI time to first token")
+    parser.add_argument('--image-latency', default='uniform:2,6', help="Fake image generation latency")
+    parser.add_argument('--tokens-per-second', type=float, default=50.0, help="Fake generation speed")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of fake OpenAI calls that fail")
+    parser.add_argument('--openai-base-url', default=None,
+                        help="Use a running tools/fake_openai.py instead of the in-process fake")
+    parser.add_argument('--workdir', default=None,
+                        help="Directory for the bot's data/ and logs/ (default: a temporary directory)")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+def main():
+    """Import the bot in a scratch directory and run the load test."""
+    args = parse_args()
+
+    # Keep the real database and logs untouched
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bot_load_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, SRC_DIR)
+
+    if args.openai_base_url:
+        os.environ['OPENAI_BASE_URL'] = args.openai_base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'load-test')
+
+    import bot as bot_module
+
+    harness = LoadHarness(bot_module, args)
+    harness.setup()
+    print(f"Running load test in {workdir}")
+    elapsed = asyncio.run(harness.run())
+    bot_module.db.close()
+    harness.report(elapsed)
+
+if __name__ == "__main__":
+    main()
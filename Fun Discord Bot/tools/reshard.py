@@ -0,0 +1,139 @@
+"""
+Split a single-file bot database into shard files for DB_SHARDS.
+
+Copies every guild's servers, messages, preferences, warnings, reminders and channel
+summaries into data/shards/shard_<n>.db, guild_id modulo the shard count. Row IDs
+are kept, so channel summaries still point at the right messages. The caches stay in the source file, which remains
+the home database.
+
+Stop the bot first. The source is left untouched unless --prune-source is given, which
+removes the copied rows from it afterwards.
+
+Example:
+    python tools/reshard.py --shards 8
+    python tools/reshard.py --source data/bot_data.db --shards 4 --prune-source
+"""
+import argparse
+import os
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TOOLS_DIR), "src"))
+
+from database import Database
+from sharding import GUILD_TABLES, SHARD_FILE, shard_key, shard_path
+
+def table_columns(db, table):
+    """Get a table's column names."""
+    cursor = db.conn.cursor()
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [row['name'] for row in cursor.fetchall()]
+
+def source_guilds(db):
+    """Get every guild ID with rows in the per-guild tables."""
+    cursor = db.conn.cursor()
+    cursor.execute(' UNION '.join(f'SELECT guild_id FROM {table}' for table in GUILD_TABLES))
+    return sorted(row[0] for row in cursor.fetchall())
+
+def copy_shard(source_path, path, guild_ids):
+    """
+    Copy the rows of some guilds into a new shard file.
+
+    Returns:
+        dict: Rows copied per table
+    """
+    shard = Database(path)
+    cursor = shard.conn.cursor()
+    cursor.execute('ATTACH DATABASE ? AS source', (source_path,))
+
+    # A shard can hold more guilds than SQLite allows bound variables, so join on a temp table
+    cursor.execute('CREATE TEMP TABLE shard_guilds (guild_id INTEGER PRIMARY KEY)')
+    cursor.executemany('INSERT INTO shard_guilds (guild_id) VALUES (?)', ((guild_id,) for guild_id in guild_ids))
+
+    counts = {}
+    for table in GUILD_TABLES:
+        columns = ', '.join(table_columns(shard, table))
+        cursor.execute(
+            f'INSERT INTO main.{table} ({columns}) SELECT {columns} FROM source.{table} '
+            f'WHERE guild_id IN (SELECT guild_id FROM temp.shard_guilds)'
+        )
+        counts[table] = cursor.rowcount
+    shard.conn.commit()
+    cursor.execute('DROP TABLE temp.shard_guilds')
+    cursor.execute('DETACH DATABASE source')
+
+    # Message content may be compressed, so the index is rebuilt from the decoded rows
+    shard.rebuild_search_index()
+    shard.checkpoint('TRUNCATE')
+    shard.close()
+    return counts
+
+def prune_source(db):
+    """Remove the copied rows from the source database and shrink the file."""
+    cursor = db.conn.cursor()
+    for table in GUILD_TABLES:
+        cursor.execute(f'DELETE FROM {table}')
+    db.conn.commit()
+    db.rebuild_search_index()
+    cursor.execute('VACUUM')
+    db.checkpoint('TRUNCATE')
+
+def parse_shards(value):
+    """Parse --shards as a positive count."""
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("shard count must be at least 1")
+    return count
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Split a bot database into shard files")
+    parser.add_argument('--source', default="data/bot_data.db", help="Single-file database to split")
+    parser.add_argument('--shard-dir', default="data/shards", help="Directory for the shard files")
+    parser.add_argument('--shards', type=parse_shards, required=True,
+                        help="Number of shard files")
+    parser.add_argument('--prune-source', action='store_true',
+                        help="Delete the copied rows from the source afterwards")
+    return parser.parse_args()
+
+def main():
+    """Run the re-shard."""
+    args = parse_args()
+    if not os.path.exists(args.source):
+        sys.exit(f"Source database not found: {args.source}")
+
+    os.makedirs(args.shard_dir, exist_ok=True)
+    existing = [name for name in os.listdir(args.shard_dir) if SHARD_FILE.match(name)]
+    if existing:
+        sys.exit(f"{args.shard_dir} already contains shard files ({', '.join(existing[:5])}), "
+                 f"move them away before re-sharding")
+
+    # Opening the source brings its schema up to date before anything is copied
+    source = Database(args.source)
+    guilds = source_guilds(source)
+
+    assignments = {}
+    for guild_id in guilds:
+        assignments.setdefault(shard_key(guild_id, args.shards), []).append(guild_id)
+    print(f"{len(guilds)} guilds into {len(assignments)} shard files in {args.shard_dir}")
+
+    start = time.perf_counter()
+    totals = dict.fromkeys(GUILD_TABLES, 0)
+    for key, guild_ids in sorted(assignments.items()):
+        path = shard_path(args.shard_dir, key)
+        counts = copy_shard(args.source, path, guild_ids)
+        for table, count in counts.items():
+            totals[table] += count
+        print(f"  {os.path.basename(path)}: {len(guild_ids)} guilds, {counts['messages']} messages")
+
+    print("Copied " + ", ".join(f"{count} {table}" for table, count in totals.items())
+          + f" in {time.perf_counter() - start:.1f}s")
+
+    if args.prune_source:
+        prune_source(source)
+        print(f"Removed guild rows from {args.source}")
+    source.close()
+
+if __name__ == "__main__":
+    main()